@@ -5,10 +5,14 @@ from .evaluate_rag_metrics import RAGEvaluator
 from .evaluate_concept_agents import ConceptAgentEvaluator
 from .evaluate_system_metrics import SystemMetricsEvaluator
 from .evaluate_integrated import IntegratedEvaluator
+from .evaluate_retrieval_performance import RetrievalPerformanceEvaluator
+from .evaluate_embedding_performance import EmbeddingPerformanceEvaluator
 
 __all__ = [
     'RAGEvaluator',
     'ConceptAgentEvaluator',
     'SystemMetricsEvaluator',
-    'IntegratedEvaluator'
+    'IntegratedEvaluator',
+    'RetrievalPerformanceEvaluator',
+    'EmbeddingPerformanceEvaluator'
 ]
@@ -2,14 +2,14 @@ import asyncio
 from typing import Dict, List, Any
 import numpy as np
 from sklearn.metrics import precision_score, recall_score, f1_score
-from sentence_transformers import SentenceTransformer
+from src.tools.embeddings import get_sentence_transformer
 import pandas as pd
 import re
 
 
 class ConceptAgentEvaluator:
     def __init__(self):
-        self.embedding_model = SentenceTransformer("cointegrated/rubert-tiny2")
+        self.embedding_model = get_sentence_transformer("cointegrated/rubert-tiny2")
 
     async def evaluate_concept_extraction(self, test_texts: List[Dict]) -> Dict:
         """
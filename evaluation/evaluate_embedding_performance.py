@@ -0,0 +1,143 @@
+import time
+import numpy as np
+from typing import List, Dict
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from src.config import EMBEDDING_MODEL, CHUNK_SIZE, CHUNK_OVERLAP
+from src.tools.embeddings import create_embeddings, EMBEDDING_BACKENDS
+from src.tools.pdf_extraction import iter_pdf_pages
+
+
+TEST_QUERIES = [
+    "Что такое второй закон Ньютона?",
+    "Основные темы и понятия конспекта",
+    "Какие бывают методы решения уравнений?",
+    "Объясни закон Ома",
+    "Что такое производная?",
+]
+
+
+def load_sample_texts(pdf_path: str = "data/Full.pdf", limit: int = 200) -> List[str]:
+    """Чанки PDF, нарезанные так же, как при индексации."""
+    splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    texts = []
+    for page in iter_pdf_pages(pdf_path):
+        texts.extend(chunk.page_content for chunk in splitter.split_documents([page]))
+        if len(texts) >= limit:
+            break
+    return texts[:limit]
+
+
+def _normalized(vectors: List[List[float]]) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+class EmbeddingPerformanceEvaluator:
+    """Сравнение бэкендов модели эмбеддингов: совпадение векторов и скорость."""
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL):
+        self.model_name = model_name
+        self._models = {}
+        self.load_seconds = {}
+
+    def _get_model(self, backend: str):
+        if backend not in self._models:
+            start_time = time.perf_counter()
+            self._models[backend] = create_embeddings(self.model_name, backend=backend)
+            self.load_seconds[backend] = time.perf_counter() - start_time
+        return self._models[backend]
+
+    def evaluate_parity(self, backend: str, texts: List[str], queries: List[str] = TEST_QUERIES,
+                        reference: str = "torch", k: int = 5) -> Dict:
+        """
+        Насколько бэкенд совпадает с эталонным:
+        косинус между векторами одного текста, расхождение косинусных скоров запрос-чанк
+        и доля общего top-k при поиске.
+        """
+        reference_model, candidate_model = self._get_model(reference), self._get_model(backend)
+
+        reference_docs = _normalized(reference_model.embed_documents(texts))
+        candidate_docs = _normalized(candidate_model.embed_documents(texts))
+        reference_queries = _normalized([reference_model.embed_query(q) for q in queries])
+        candidate_queries = _normalized([candidate_model.embed_query(q) for q in queries])
+
+        vector_cosine = np.sum(reference_docs * candidate_docs, axis=1)
+        reference_scores = reference_queries @ reference_docs.T
+        candidate_scores = candidate_queries @ candidate_docs.T
+        score_diff = np.abs(reference_scores - candidate_scores)
+
+        overlaps = []
+        for reference_row, candidate_row in zip(reference_scores, candidate_scores):
+            expected = set(np.argsort(-reference_row)[:k].tolist())
+            found = set(np.argsort(-candidate_row)[:k].tolist())
+            overlaps.append(len(expected & found) / len(expected))
+
+        return {
+            "backend": backend,
+            "reference": reference,
+            "vector_cosine_mean": float(vector_cosine.mean()),
+            "vector_cosine_min": float(vector_cosine.min()),
+            "score_abs_diff_mean": float(score_diff.mean()),
+            "score_abs_diff_max": float(score_diff.max()),
+            f"top{k}_overlap": float(np.mean(overlaps)),
+        }
+
+    def evaluate_latency(self, backend: str, texts: List[str], queries: List[str] = TEST_QUERIES,
+                         repeats: int = 3) -> Dict:
+        """Задержка одного запроса (как в RAGLoader) и пропускная способность на чанках (как при индексации)."""
+        model = self._get_model(backend)
+        model.embed_query(queries[0])  # Прогрев
+
+        query_latencies = []
+        for _ in range(repeats):
+            for query in queries:
+                start_time = time.perf_counter()
+                model.embed_query(query)
+                query_latencies.append(time.perf_counter() - start_time)
+
+        batch_seconds = []
+        for _ in range(repeats):
+            start_time = time.perf_counter()
+            model.embed_documents(texts)
+            batch_seconds.append(time.perf_counter() - start_time)
+
+        return {
+            "backend": backend,
+            "load_seconds": self.load_seconds[backend],
+            "query_latency_ms_p50": 1000 * float(np.percentile(query_latencies, 50)),
+            "query_latency_ms_p95": 1000 * float(np.percentile(query_latencies, 95)),
+            "chunks_per_second": len(texts) / float(np.median(batch_seconds)),
+        }
+
+    def compare_backends(self, texts: List[str], backends: List[str] = EMBEDDING_BACKENDS) -> List[Dict]:
+        results = []
+        for backend in backends:
+            try:
+                result = self.evaluate_latency(backend, texts)
+                if backend != "torch":
+                    result.update(self.evaluate_parity(backend, texts))
+                results.append(result)
+            except Exception as e:
+                results.append({"backend": backend, "error": str(e)})
+        return results
+
+
+def run_evaluation(pdf_path: str = "data/Full.pdf"):
+    """Запуск сравнения бэкендов эмбеддингов"""
+    texts = load_sample_texts(pdf_path)
+    evaluator = EmbeddingPerformanceEvaluator()
+
+    print(f"⚡ Бэкенды эмбеддингов ({len(texts)} чанков из {pdf_path}):")
+    results = evaluator.compare_backends(texts)
+    for result in results:
+        print(f"\n   {result['backend']}:")
+        for key, value in result.items():
+            if key == "backend":
+                continue
+            print(f"      {key}: {value:.4f}" if isinstance(value, float) else f"      {key}: {value}")
+
+    return results
+
+
+if __name__ == "__main__":
+    run_evaluation()
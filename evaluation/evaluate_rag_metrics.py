@@ -2,14 +2,14 @@ import asyncio
 import numpy as np
 from typing import List, Dict, Tuple
 from sklearn.metrics.pairwise import cosine_similarity
-from sentence_transformers import SentenceTransformer
 import pandas as pd
 from src.tools.rag_query import RAGLoader
+from src.tools.embeddings import get_sentence_transformer
 
 
 class RAGEvaluator:
     def __init__(self, embedding_model: str = "cointegrated/rubert-tiny2"):
-        self.embedding_model = SentenceTransformer(embedding_model)
+        self.embedding_model = get_sentence_transformer(embedding_model)
 
     async def evaluate_retrieval_quality(self, user_id: int, test_queries: List[Dict]) -> Dict:
         """
@@ -0,0 +1,268 @@
+import time
+import tempfile
+import numpy as np
+from typing import List, Dict, Tuple
+from src.config import RETRIEVER_K, RERANK_TOP_N, RERANK_FETCH_K, MMR_LAMBDA
+from src.tools.rag_query import RAGLoader
+from src.tools.numpy_store import NumpyVectorStore, QUANTIZATIONS
+from src.tools.retrieval import build_retriever
+from src.tools.tokens import count_tokens, encode_tokens
+
+
+SHINGLE_SIZE = 8  # Окно токенов, по которому повтор текста считается дубликатом
+
+
+def unique_token_count(texts: List[str], shingle_size: int = SHINGLE_SIZE) -> Tuple[int, int]:
+    """
+    (уникальные токены, все токены) контекста: токен уникален, если окно из shingle_size
+    токенов, которое с него начинается, ещё не встречалось в предыдущем тексте контекста.
+    Так перекрытия соседних чанков считаются один раз.
+    """
+    seen = set()
+    unique = total = 0
+    for text in texts:
+        ids = encode_tokens(text)
+        total += len(ids)
+        for start in range(len(ids)):
+            shingle = tuple(ids[start:start + shingle_size])
+            if shingle not in seen:
+                seen.add(shingle)
+                unique += 1
+    return unique, total
+
+
+TEST_QUERIES = [
+    "Что такое второй закон Ньютона?",
+    "Основные темы и понятия конспекта",
+    "Какие бывают методы решения уравнений?",
+    "Объясни закон Ома",
+    "Что такое производная?",
+]
+
+
+class RetrievalPerformanceEvaluator:
+    """Бенчмарки слоя поиска: хранение векторов, переранжирование и разнообразие выдачи (MMR)."""
+
+    def _load_corpus(self, user_id: int) -> Tuple[RAGLoader, List[str], List[str], np.ndarray]:
+        """Чанки документа пользователя и их эталонные векторы float32."""
+        loader = RAGLoader(user_id)
+        data = loader.vectorstore.get(include=["documents"])
+        ids, texts = data["ids"], data["documents"]
+        vectors = np.asarray(loader.embeddings.embed_documents(texts), dtype=np.float32)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return loader, ids, texts, vectors
+
+    def evaluate_quantization(self, user_id: int, queries: List[str] = TEST_QUERIES,
+                              k: int = RETRIEVER_K) -> Dict:
+        """
+        Сравнение квантованного NumpyVectorStore с точным поиском float32:
+        recall@k относительно float32 (с пересчётом и без), задержка и байты на вектор.
+        """
+        loader, ids, texts, vectors = self._load_corpus(user_id)
+        query_vectors = np.asarray([loader.embeddings.embed_query(q) for q in queries], dtype=np.float32)
+        query_vectors /= np.maximum(np.linalg.norm(query_vectors, axis=1, keepdims=True), 1e-12)
+
+        # Эталон: точный top-k по float32
+        exact_top = [set(np.argsort(-(vectors @ q))[:k].tolist()) for q in query_vectors]
+        results = {"float32": {"bytes_per_vector": vectors.shape[1] * 4, "recall_at_k": 1.0}}
+
+        for quantization in QUANTIZATIONS:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                store = NumpyVectorStore(tmp_dir, loader.embeddings, quantization=quantization)
+                store.add_vectors(texts, vectors.tolist(), ids=ids)
+                store.persist()
+                row_by_id = {chunk_id: i for i, chunk_id in enumerate(ids)}
+                results[quantization] = {"bytes_per_vector": store.bytes_per_vector}
+
+                for rescore in (False, True):
+                    recalls, latencies = [], []
+                    for q, expected in zip(query_vectors, exact_top):
+                        start_time = time.perf_counter()
+                        found = store.similarity_search_by_vector_with_score(q.tolist(), k=k, rescore=rescore)
+                        latencies.append(time.perf_counter() - start_time)
+                        found_rows = {row_by_id[doc.id] for doc, _ in found}
+                        recalls.append(len(found_rows & expected) / max(len(expected), 1))
+
+                    suffix = "_rescored" if rescore else ""
+                    results[quantization][f"recall_at_k{suffix}"] = float(np.mean(recalls))
+                    results[quantization][f"avg_latency_ms{suffix}"] = 1000 * float(np.mean(latencies))
+                store.close()
+
+        loader.close()
+        return {"num_chunks": len(ids), "k": k, "num_queries": len(queries), "storage": results}
+
+    def evaluate_vector_stores(self, user_id: int, queries: List[str] = TEST_QUERIES,
+                               k: int = RETRIEVER_K, repeats: int = 5) -> Dict:
+        """
+        NumpyVectorStore (mmap + полный перебор) против Chroma на чанках документа пользователя:
+        время открытия базы (как в RAGLoader.__init__), задержка поиска и recall@k Chroma (HNSW)
+        относительно точного перебора.
+        """
+        from chromadb.api.shared_system_client import SharedSystemClient
+        from langchain_community.vectorstores import Chroma
+
+        loader, ids, texts, vectors = self._load_corpus(user_id)
+        data = loader.vectorstore.get(ids=ids, include=["metadatas"])
+        metadatas = data["metadatas"]
+        query_vectors = [loader.embeddings.embed_query(q) for q in queries]
+
+        def open_chroma(path):
+            return Chroma(persist_directory=path, embedding_function=loader.embeddings,
+                          collection_metadata={"hnsw:space": "cosine"})
+
+        def open_numpy(path):
+            return NumpyVectorStore(path, loader.embeddings, quantization="float32")
+
+        results = {}
+        with tempfile.TemporaryDirectory() as chroma_dir, tempfile.TemporaryDirectory() as numpy_dir:
+            chroma = open_chroma(chroma_dir)
+            chroma._collection.upsert(ids=ids, embeddings=vectors.tolist(), documents=texts, metadatas=metadatas)
+            store = open_numpy(numpy_dir)
+            store.add_vectors(texts, vectors.tolist(), metadatas, ids)
+            store.persist()
+
+            exact = {}
+            for name, path, open_store in (("numpy", numpy_dir, open_numpy), ("chroma", chroma_dir, open_chroma)):
+                open_seconds, latencies, recalls = [], [], []
+                for _ in range(repeats):
+                    # Холодное открытие: без закэшированного клиента Chroma
+                    SharedSystemClient.clear_system_cache()
+                    start_time = time.perf_counter()
+                    opened = open_store(path)
+                    open_seconds.append(time.perf_counter() - start_time)
+
+                for i, query_vector in enumerate(query_vectors):
+                    for _ in range(repeats):
+                        start_time = time.perf_counter()
+                        found = opened.similarity_search_by_vector(query_vector, k=k)
+                        latencies.append(time.perf_counter() - start_time)
+                    found_texts = [doc.page_content for doc in found]
+                    if name == "numpy":
+                        exact[i] = set(found_texts)
+                    recalls.append(len(exact[i] & set(found_texts)) / max(len(exact[i]), 1))
+
+                results[name] = {
+                    "avg_open_ms": 1000 * float(np.mean(open_seconds)),
+                    "avg_query_ms": 1000 * float(np.mean(latencies)),
+                    "p95_query_ms": 1000 * float(np.percentile(latencies, 95)),
+                    "recall_at_k_vs_exact": float(np.mean(recalls)),
+                }
+            SharedSystemClient.clear_system_cache()
+
+        loader.close()
+        return {"num_chunks": len(ids), "k": k, "num_queries": len(queries), "stores": results}
+
+    def evaluate_reranking(self, user_id: int, queries: List[str] = TEST_QUERIES,
+                           top_n: int = RERANK_TOP_N, fetch_k: int = RERANK_FETCH_K) -> Dict:
+        """
+        Сколько токенов контекста экономит переранжирование на запрос:
+        обычный поиск (RETRIEVER_K чанков в промпт) против кросс-энкодера (top_n из fetch_k).
+        """
+        from src.tools.reranker import RerankingRetriever, get_reranker
+
+        loader = RAGLoader(user_id)
+        baseline = build_retriever(loader.vectorstore, loader.user_db_path, k=RETRIEVER_K, rerank=False, mmr=False)
+        reranking = RerankingRetriever(base_retriever=baseline, reranker=get_reranker(),
+                                       fetch_k=fetch_k, top_n=top_n)
+        reranking.reranker.warm_up()
+
+        rows = []
+        for query in queries:
+            start_time = time.perf_counter()
+            baseline_docs = baseline.invoke(query)
+            baseline_ms = (time.perf_counter() - start_time) * 1000
+
+            start_time = time.perf_counter()
+            reranked_docs = reranking.invoke(query)
+            reranked_ms = (time.perf_counter() - start_time) * 1000
+
+            baseline_tokens = count_tokens("\n---\n".join(doc.page_content for doc in baseline_docs))
+            reranked_tokens = count_tokens("\n---\n".join(doc.page_content for doc in reranked_docs))
+            rows.append((baseline_tokens, reranked_tokens, baseline_ms, reranked_ms))
+
+        loader.close()
+        baseline_tokens, reranked_tokens, baseline_ms, reranked_ms = (np.array(column) for column in zip(*rows))
+        return {
+            "num_queries": len(queries),
+            "baseline_chunks": RETRIEVER_K,
+            "reranked_chunks": top_n,
+            "avg_context_tokens_baseline": float(baseline_tokens.mean()),
+            "avg_context_tokens_reranked": float(reranked_tokens.mean()),
+            "avg_tokens_saved_per_query": float((baseline_tokens - reranked_tokens).mean()),
+            "tokens_saved_share": float(1 - reranked_tokens.sum() / max(baseline_tokens.sum(), 1)),
+            "avg_retrieval_ms_baseline": float(baseline_ms.mean()),
+            "avg_retrieval_ms_reranked": float(reranked_ms.mean()),
+            "reranker": reranking.reranker.get_stats(),
+        }
+
+    def evaluate_mmr(self, user_id: int, queries: List[str] = TEST_QUERIES, k: int = RETRIEVER_K,
+                     lambdas: Tuple[float, ...] = (1.0, MMR_LAMBDA, 0.5)) -> Dict:
+        """
+        Уникальный контент на токен контекста с MMR при разных lambda (1.0 — без разнообразия):
+        доля уникальных токенов, уникальные токены в первых 2000 символах
+        (обрезка get_retrieved_context) и задержка поиска.
+        """
+        loader = RAGLoader(user_id)
+        retriever = build_retriever(loader.vectorstore, loader.user_db_path, k=k, mmr=True)
+
+        results = {}
+        for lambda_mult in lambdas:
+            rows = []
+            for query in queries:
+                start_time = time.perf_counter()
+                docs = retriever.invoke(query, k=k, lambda_mult=lambda_mult)
+                latency_ms = (time.perf_counter() - start_time) * 1000
+
+                texts = [doc.page_content for doc in docs]
+                unique, total = unique_token_count(texts)
+                unique_in_cut, _ = unique_token_count(["\n---\n".join(texts)[:2000]])
+                rows.append((unique / max(total, 1), unique, total, unique_in_cut, latency_ms))
+
+            share, unique, total, unique_in_cut, latency_ms = (np.array(column) for column in zip(*rows))
+            results[f"lambda={lambda_mult:g}"] = {
+                "unique_content_per_token": float(share.mean()),
+                "avg_unique_tokens": float(unique.mean()),
+                "avg_context_tokens": float(total.mean()),
+                "avg_unique_tokens_in_2000_chars": float(unique_in_cut.mean()),
+                "avg_retrieval_ms": float(latency_ms.mean()),
+            }
+
+        loader.close()
+        return {"num_queries": len(queries), "k": k, "shingle_size": SHINGLE_SIZE, "mmr": results}
+
+
+def run_evaluation(user_id: int = 12345):
+    """Запуск бенчмарков поиска"""
+    evaluator = RetrievalPerformanceEvaluator()
+
+    print("🔍 Квантование векторов (recall@k относительно float32):")
+    report = evaluator.evaluate_quantization(user_id)
+    print(f"   Чанков: {report['num_chunks']}, k={report['k']}, запросов: {report['num_queries']}")
+    for name, metrics in report["storage"].items():
+        line = ", ".join(f"{key}={value:.3f}" if isinstance(value, float) else f"{key}={value}"
+                         for key, value in metrics.items())
+        print(f"   {name}: {line}")
+
+    print("\n🗄 NumpyVectorStore против Chroma (открытие базы и поиск):")
+    stores_report = evaluator.evaluate_vector_stores(user_id)
+    for name, metrics in stores_report["stores"].items():
+        line = ", ".join(f"{key}={value:.3f}" for key, value in metrics.items())
+        print(f"   {name}: {line}")
+
+    print("\n🎯 Переранжирование кросс-энкодером (токены контекста на запрос):")
+    rerank_report = evaluator.evaluate_reranking(user_id)
+    for key, value in rerank_report.items():
+        print(f"   {key}: {value:.3f}" if isinstance(value, float) else f"   {key}: {value}")
+
+    print("\n🧩 MMR (уникальный контент на токен контекста):")
+    mmr_report = evaluator.evaluate_mmr(user_id)
+    for name, metrics in mmr_report["mmr"].items():
+        line = ", ".join(f"{key}={value:.3f}" for key, value in metrics.items())
+        print(f"   {name}: {line}")
+
+    return {"quantization": report, "vector_stores": stores_report, "reranking": rerank_report,
+            "mmr": mmr_report}
+
+
+if __name__ == "__main__":
+    run_evaluation()
@@ -1,5 +1,7 @@
+import os
 import asyncio
 import time
+import tracemalloc
 import psutil
 import pandas as pd
 from typing import Dict, List, Any
@@ -167,6 +169,109 @@ class SystemMetricsEvaluator:
             "disk_io": process.io_counters()
         }
 
+    def collect_cache_metrics(self) -> Dict:
+        """Попадания в кэши поиска: результаты поиска и эмбеддинги запросов"""
+        from src.tools.embeddings import get_query_embeddings
+        from src.tools.retrieval_cache import get_retrieval_cache
+
+        return {
+            "retrieval_cache": get_retrieval_cache().get_stats(),
+            "query_embedding_cache": get_query_embeddings().get_stats(),
+        }
+
+    def collect_condense_metrics(self) -> Dict:
+        """Пропуски переформулировки вопроса: доля ходов без вызова LLM и сэкономленное время"""
+        from src.tools.condense_gate import get_condense_gate
+        return get_condense_gate().get_stats()
+
+    def collect_session_metrics(self) -> Dict:
+        """Пул RAG-сессий: живые, вытесненные (LRU/простой), пересобранные"""
+        from src.core.orchestrator import get_session_stats
+        return get_session_stats()
+
+    def evaluate_session_footprint(self, user_id: int, n_sessions: int = 20) -> Dict:
+        """
+        Стоимость RAG-сессий одного пользователя: создание (ленивое — без базы и цепочки),
+        сборка компонентов при первом вопросе и память на сессию — лениво и сразу собранной.
+        В API LLM не обращается. Диалоги сессий пишутся во временную базу, а не в рабочий
+        ConversationStore: восстановление настоящего диалога могло бы запустить сводку через LLM.
+        """
+        import tempfile
+        from src.tools.conversation_store import ConversationStore
+        from src.tools.rag_with_memory import UserRAGQuery
+
+        def build_sessions(eager: bool, store: ConversationStore) -> Dict:
+            tracemalloc.start()
+            sessions, create_times, build_times = [], [], []
+            for _ in range(n_sessions):
+                start = time.perf_counter()
+                session = UserRAGQuery(user_id, conversation_store=store)
+                create_times.append(time.perf_counter() - start)
+                if eager:
+                    start = time.perf_counter()
+                    session.qa_chain  # то, что раньше делал конструктор
+                    build_times.append(time.perf_counter() - start)
+                sessions.append(session)
+            memory_bytes, _ = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            for session in sessions:
+                session.loader.close()
+            return {
+                "create_ms": float(np.mean(create_times)) * 1000,
+                "first_question_build_ms": float(np.mean(build_times)) * 1000 if build_times else 0.0,
+                "memory_kb_per_session": memory_bytes / n_sessions / 1024,
+            }
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            store = ConversationStore(os.path.join(tmp_dir, "conversations.sqlite3"))
+            # Прогрев: импорты, общая LLM и кэши не должны попасть в замер первого режима
+            warmup = UserRAGQuery(user_id, conversation_store=store)
+            warmup.qa_chain
+            warmup.loader.close()
+            lazy, eager = build_sessions(eager=False, store=store), build_sessions(eager=True, store=store)
+            store.close()
+        return {
+            "sessions": n_sessions,
+            "lazy": lazy,
+            "eager": eager,
+            "memory_saved_kb_per_session": eager["memory_kb_per_session"] - lazy["memory_kb_per_session"],
+        }
+
+    def evaluate_conversation_restore(self, n_turns: int = 200, n_loads: int = 20) -> Dict:
+        """
+        Скорость восстановления диалога из ConversationStore (во временной базе):
+        запись реплик, сохранение сводки и подъём сессии после вытеснения.
+        """
+        import tempfile
+        from langchain_core.messages import AIMessage, HumanMessage
+        from src.tools.conversation_store import ConversationStore
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            store = ConversationStore(os.path.join(tmp_dir, "conversations.sqlite3"))
+            start = time.perf_counter()
+            for i in range(n_turns):
+                store.append(0, [HumanMessage(content=f"Вопрос {i} по конспекту?"),
+                                 AIMessage(content=f"Ответ {i} по конспекту.")])
+            append_ms = (time.perf_counter() - start) / n_turns * 1000
+
+            # Сводка покрывает все реплики, кроме последних 10 ходов
+            _, messages = store.load(0)
+            store.save_summary(0, "Сводка диалога.", int(messages[-21].id))
+
+            load_times = []
+            for _ in range(n_loads):
+                start = time.perf_counter()
+                summary, messages = store.load(0)
+                load_times.append(time.perf_counter() - start)
+            store.close()
+
+        return {
+            "turns": n_turns,
+            "append_ms_per_turn": append_ms,
+            "restore_ms": float(np.mean(load_times)) * 1000,
+            "restored_messages": len(messages),
+        }
+
     async def run_comprehensive_evaluation(self, user_id: int = 12345):
         """Комплексная оценка системы"""
 
@@ -218,6 +323,35 @@ class SystemMetricsEvaluator:
             else:
                 print(f"   {key}: {value}")
 
+        # 5. Кэши поиска (после прогонов выше повторные вопросы должны попадать в кэш)
+        print("\n5. Кэши поиска и RAG-сессии:")
+        cache_metrics = self.collect_cache_metrics()
+        for name, stats in cache_metrics.items():
+            print(f"   {name}: hit_rate={stats['hit_rate']:.2%}, hits={stats['hits']}, "
+                  f"misses={stats['misses']}, size={stats['size']}/{stats['max_size']}")
+
+        session_metrics = self.collect_session_metrics()
+        print(f"   rag_sessions: live={session_metrics['live']}/{session_metrics['max_size']}, "
+              f"evicted={session_metrics['evicted']}, rebuilt={session_metrics['rebuilt']}")
+
+        condense_metrics = self.collect_condense_metrics()
+        print(f"   condense_gate: bypass_rate={condense_metrics['bypass_rate']:.2%} "
+              f"({condense_metrics['bypassed']}/{condense_metrics['turns']}), "
+              f"saved={condense_metrics['saved_ms_per_turn']:.0f} мс/ход")
+
+        # 6. Стоимость RAG-сессии: ленивое создание против сборки всего сразу
+        print("\n6. Создание RAG-сессий:")
+        footprint_metrics = self.evaluate_session_footprint(user_id)
+        for mode in ("lazy", "eager"):
+            stats = footprint_metrics[mode]
+            print(f"   {mode}: create={stats['create_ms']:.2f} мс, "
+                  f"first_question_build={stats['first_question_build_ms']:.2f} мс, "
+                  f"memory={stats['memory_kb_per_session']:.1f} КБ/сессия")
+        restore_metrics = self.evaluate_conversation_restore()
+        print(f"   restore: {restore_metrics['restore_ms']:.2f} мс "
+              f"({restore_metrics['restored_messages']} сообщений после {restore_metrics['turns']} ходов), "
+              f"append={restore_metrics['append_ms_per_turn']:.2f} мс/ход")
+
         # Сводный отчет
         print("\n📊 СВОДНЫЙ ОТЧЕТ:")
         summary = {
@@ -241,6 +375,11 @@ class SystemMetricsEvaluator:
             "load_test": load_metrics,
             "scalability": scalability_metrics,
             "resources": resource_metrics,
+            "caches": cache_metrics,
+            "sessions": session_metrics,
+            "condense_gate": condense_metrics,
+            "session_footprint": footprint_metrics,
+            "conversation_restore": restore_metrics,
             "summary": summary,
             "overall_score": overall_score
         }
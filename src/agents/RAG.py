@@ -1,7 +1,7 @@
-
-
+from src.config import NOTE_TOPICS_QUERY, SESSION_PERSIST_MEMORY
+from src.core.session_pool import SessionPool
+from src.tools.conversation_store import get_conversation_store
 from src.tools.rag_with_memory import UserRAGQuery
-from typing import Dict
 
 
 class RAGAgent:
@@ -11,15 +11,40 @@ class RAGAgent:
 
 
     def __init__(self):
-        self.user_sessions: Dict[int, UserRAGQuery] = {}
+        # Ограниченный пул (LRU + простой): диалог лежит в ConversationStore,
+        # поэтому сессию можно вытеснить в любой момент и быстро поднять снова
+        self.user_sessions: SessionPool[UserRAGQuery] = SessionPool(
+            factory=self._create_session,
+            on_evict=self._on_session_evicted
+        )
+
+    def _create_session(self, user_id: int) -> UserRAGQuery:
+        # Создаем новый объект: память восстанавливается из ConversationStore, цепь — при первом вопросе
+        return UserRAGQuery(user_id=user_id)
+
+    def _on_session_evicted(self, user_id: int, session: UserRAGQuery, reason: str):
+        """Закрывает ресурсы вытесненной сессии (реплики и сводка уже на диске)."""
+        session.loader.close()
 
     def _get_or_create_session(self, user_id: int) -> UserRAGQuery:
         """Получает активную сессию с памятью или создает новую."""
-        if user_id not in self.user_sessions:
-            # Создаем новый объект, который инициализирует цепь и память
-            session = UserRAGQuery(user_id=user_id)
-            self.user_sessions[user_id] = session
-        return self.user_sessions[user_id]
+        return self.user_sessions.get_or_create(user_id)
+
+    def use_session(self, user_id: int):
+        """Сессия на время запроса: вытеснение из пула закроет её только после него."""
+        return self.user_sessions.use(user_id)
+
+    def get_session_stats(self) -> dict:
+        """Сессии в пуле: живые, вытесненные, пересобранные после вытеснения."""
+        return self.user_sessions.get_stats()
+
+    async def sweep_idle_sessions(self):
+        """Фоновая задача бота: закрывает сессии, простаивающие дольше SESSION_IDLE_TTL_SECONDS."""
+        await self.user_sessions.sweep_expired()
+
+    def close_all_sessions(self):
+        """Закрывает все сессии при остановке бота (диалоги остаются в ConversationStore)."""
+        self.user_sessions.close_all()
 
     def run(self, user_id: int, query: str) -> str:
         """
@@ -27,8 +52,8 @@ class RAGAgent:
         """
         try:
             # 1. Получаем объект с памятью
-            rag = self._get_or_create_session(user_id)
-            response = rag.ask(query)
+            with self.use_session(user_id) as rag:
+                response = rag.ask(query)
             failure_keywords = [
                 "не могу найти",
                 "не содержится",
@@ -56,34 +81,28 @@ class RAGAgent:
             return "❌ Ошибка при генерации ответа."
 
     def reset_session(self, user_id: int):
-        """Закрывает и удаляет сессию RAG для пользователя."""
-        if user_id in self.user_sessions:
-            # 1. Получаем объект, чтобы вызвать метод close()
-            session = self.user_sessions[user_id]
+        """Закрывает и удаляет сессию RAG для пользователя (память не сохраняется)."""
+        # 1. Убираем сессию из пула; загрузчик закроется, когда завершатся её текущие запросы
+        self.user_sessions.discard(user_id)
 
-            # 2. Вызываем метод close() на загрузчике
-            if hasattr(session, 'loader') and hasattr(session.loader, 'close'):
-                session.loader.close()
+        # 2. Диалог о прежнем документе больше не нужен
+        if SESSION_PERSIST_MEMORY:
+            get_conversation_store().delete_user(user_id)
 
-            # 3. Удаляем сессию
-            del self.user_sessions[user_id]
     def get_note_text(self, user_id: int, max_chars: int = 15000) -> str:
         """
         Возвращает сырой текст конспекта пользователя для генерации квиза.
         Берёт текст из retriever внутри UserRAGQuery.
         """
-        if user_id not in self.user_sessions:
-            print("get_note_text: нет сессии для user_id", user_id)
-            return ""
-
         try:
-            session = self.user_sessions[user_id]
-            retriever = getattr(session, "retriever", None)
-            if retriever is None:
-                print("get_note_text: у session нет поля retriever")
-                return ""
-
-            docs = retriever.get_relevant_documents("основные темы и понятия конспекта")
+            # Сессия поднимается и после вытеснения из пула (диалог и база — на диске)
+            with self.use_session(user_id) as session:
+                retriever = getattr(session, "retriever", None)
+                if retriever is None:
+                    print("get_note_text: у session нет поля retriever")
+                    return ""
+
+                docs = retriever.get_relevant_documents(NOTE_TOPICS_QUERY)
             if not docs:
                 print("get_note_text: retriever вернул 0 документов")
                 return ""
@@ -95,8 +114,7 @@ class RAGAgent:
                 if not text:
                     continue
                 if total + len(text) > max_chars:
-                    chunks.append(text[: max_chars - total])
-                    break
+                    break  # Чанки целиком: квиз уложит текст в бюджет токенов сам
                 chunks.append(text)
                 total += len(text)
 
@@ -104,6 +122,9 @@ class RAGAgent:
             print("get_note_text: длина текста для квиза =", len(full_text))
             return full_text
 
+        except FileNotFoundError:
+            print("get_note_text: нет документа для user_id", user_id)
+            return ""
         except Exception as e:
             print(f"Ошибка получения текста для квиза: {e}")
             return ""
\ No newline at end of file
@@ -1,9 +1,9 @@
 import re
 import logging
 from typing import List, Dict, Any
-from langchain_gigachat.chat_models import GigaChat
-from src.services.get_token import get_token
-from src.config import LLM_TEMPERATURE
+from src.services.llm_client import get_llm
+from src.config import LLM_TEMPERATURE, CONCEPTS_CONTEXT_TOKENS
+from src.tools.context_packer import pack_text
 
 logger = logging.getLogger(__name__)
 
@@ -16,18 +16,14 @@ class ConceptExplainerAgent:
         self.llm = self._initialize_llm()
     
     def _initialize_llm(self):
-        """Инициализация GigaChat"""
-        token = get_token()
-        return GigaChat(
-            temperature=LLM_TEMPERATURE,
-            verify_ssl_certs=False,
-            access_token=token
-        )
+        """Общая LLM процесса (один HTTP-клиент GigaChat на все агенты и сессии)"""
+        return get_llm(temperature=LLM_TEMPERATURE)
     
     def extract_concepts(self, text: str, max_concepts: int = 10) -> List[Dict[str, Any]]:
         """
         Извлекает ключевые концепты из текста
         """
+        packed_text = pack_text(text, CONCEPTS_CONTEXT_TOKENS)["text"]
         prompt = f"""
         Проанализируй следующий текст и выдели {max_concepts} самых важных концептов, терминов, теорий или методов.
         Для каждого концепта предоставь:
@@ -37,7 +33,7 @@ class ConceptExplainerAgent:
         - Краткое определение (1-2 предложения)
         
         Текст для анализа:
-        {text[:4000]}
+        {packed_text}
         
         Верни ответ в формате:
         КОНЦЕПТ: [название]
@@ -3,22 +3,10 @@ import re
 import logging
 import time
 from typing import Dict, Any, Optional
-from langchain_gigachat.chat_models import GigaChat
 
+from src.services.llm_client import get_llm
 from src.tools.pdf_math_indexer import extract_math_context_ultimate
 
-try:
-    from src.services.get_token import get_token as get_gigachat_credentials
-except ImportError:
-    try:
-        # 2. Если не вышло (старая версия файла), пробуем старое имя
-        from src.services.get_token import get_gigachat_credentials
-    except ImportError:
-        # 3. если совсем беда с импортами, берем из ENV напрямую
-        import os
-        def get_gigachat_credentials():
-            return os.getenv("GIGACHAT_TOKEN", "")
-
 logger = logging.getLogger(__name__)
 
 
@@ -28,14 +16,8 @@ class MathAgent:
         os.makedirs(self.output_dir, exist_ok=True)
 
     def _get_llm(self, temp=0.1):
-        token = get_gigachat_credentials()
-        return GigaChat(
-            access_token=token,
-            model="GigaChat",
-            verify_ssl_certs=False,
-            temperature=temp,
-            scope="GIGACHAT_API_PERS"
-        )
+        # Общая LLM процесса: клиент GigaChat и токен не создаются на каждую задачу
+        return get_llm(temperature=temp)
 
     def solve_task(self, task_spec: str, pdf_path: str) -> Dict[str, Any]:
         logger.info(f"🚀 MathAgent: Решение задачи '{task_spec}'")
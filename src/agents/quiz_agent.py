@@ -2,9 +2,9 @@ import json
 import logging
 from typing import Dict, Any
 
-from langchain_gigachat.chat_models import GigaChat
-from src.services.get_token import get_token
-from src.config import LLM_TEMPERATURE
+from src.services.llm_client import get_llm
+from src.config import QUIZ_CONTEXT_TOKENS
+from src.tools.context_packer import pack_text
 
 logger = logging.getLogger(__name__)
 
@@ -18,13 +18,8 @@ class QuizAgent:
         self.llm = self._initialize_llm()
 
     def _initialize_llm(self):
-        """Инициализация GigaChat"""
-        token = get_token()
-        return GigaChat(
-            temperature=0.1,
-            verify_ssl_certs=False,
-            access_token=token,
-        )
+        """Общая LLM процесса (один HTTP-клиент GigaChat на все агенты и сессии)"""
+        return get_llm(temperature=0.1)
 
     def generate_quiz(self, context_text: str, num_questions: int = 10, topic: str | None = None) -> Dict[str, Any]:
         """
@@ -37,7 +32,10 @@ class QuizAgent:
         if not context_text:
             return {"questions": []}
 
-        safe_context = context_text[:9000]
+        # Целые чанки и предложения в пределах бюджета токенов
+        packed = pack_text(context_text, QUIZ_CONTEXT_TOKENS)
+        safe_context = packed["text"]
+        logger.info(f"Контекст квиза: {packed['tokens_used']}/{QUIZ_CONTEXT_TOKENS} токенов")
 
         prompt = f"""
 Проанализируй следующий конспект и составь тест из {num_questions} вопросов {topic_hint}.
@@ -1,8 +1,7 @@
 import logging
 import re
 from typing import List, Dict, Any
-from langchain_gigachat.chat_models import GigaChat
-from src.services.get_token import get_token
+from src.services.llm_client import get_llm
 from src.config import LLM_TEMPERATURE
 
 logger = logging.getLogger(__name__)
@@ -20,13 +19,8 @@ class SourceFinderAgent:
         self.source_types = self._initialize_source_types()
 
     def _initialize_llm(self):
-        """Инициализация GigaChat"""
-        token = get_token()
-        return GigaChat(
-            temperature=LLM_TEMPERATURE,
-            verify_ssl_certs=False,
-            access_token=token
-        )
+        """Общая LLM процесса (один HTTP-клиент GigaChat на все агенты и сессии)"""
+        return get_llm(temperature=LLM_TEMPERATURE)
 
     def _initialize_knowledge_bases(self) -> Dict[str, Dict[str, List[str]]]:
         """Расширенная база знаний с источниками по различным дисциплинам"""
@@ -1,8 +1,8 @@
 import logging
 from typing import List, Dict, Any
-from langchain_gigachat.chat_models import GigaChat
-from src.services.get_token import get_token
-from src.config import LLM_TEMPERATURE
+from src.services.llm_client import get_llm
+from src.config import LLM_TEMPERATURE, NOTES_SAMPLE_TOKENS
+from src.tools.context_packer import pack_text
 
 logger = logging.getLogger(__name__)
 
@@ -15,13 +15,8 @@ class StudyAdvisorAgent:
         self.llm = self._initialize_llm()
     
     def _initialize_llm(self):
-        """Инициализация GigaChat"""
-        token = get_token()
-        return GigaChat(
-            temperature=LLM_TEMPERATURE,
-            verify_ssl_certs=False,
-            access_token=token
-        )
+        """Общая LLM процесса (один HTTP-клиент GigaChat на все агенты и сессии)"""
+        return get_llm(temperature=LLM_TEMPERATURE)
     
     def get_study_advice(self) -> Dict[str, Any]:
         """
@@ -112,10 +107,11 @@ class StudyAdvisorAgent:
         """
         Анализирует и улучшает конспекты
         """
+        packed_sample = pack_text(notes_sample, NOTES_SAMPLE_TOKENS)["text"]
         prompt = f"""
         Проанализируй следующий образец конспекта и дай рекомендации по улучшению:
         
-        {notes_sample[:2000]}
+        {packed_sample}
         
         Обрати внимание на:
         - Структуру и организацию
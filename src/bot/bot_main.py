@@ -1,8 +1,10 @@
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
-from src.config import TELEGRAM_BOT_TOKEN
+from src.config import TELEGRAM_BOT_TOKEN, RERANKER_ENABLED
 from src.bot.handlers import router
+from src.tools.embeddings import warm_up
+from src.tools.chroma_store import migrate_legacy_stores
 
 async def start_bot():
     """Запускает Telegram бота"""
@@ -12,6 +14,27 @@ async def start_bot():
     )
     dp = Dispatcher()
     dp.include_router(router)
-    
+
+    # Базы старого формата (своя папка Chroma на пользователя) переносим в общий клиент
+    migrated = migrate_legacy_stores()
+    if migrated:
+        print(f"🔁 Перенесено векторных баз в общий клиент Chroma: {migrated}")
+
+    # Модель эмбеддингов грузится до первого сообщения, а не на первом запросе
+    stats = warm_up()
+    print(f"🔥 Модель эмбеддингов прогрета за {stats['warm_up_seconds']:.1f} с "
+          f"(память процесса: {stats['process_rss_mb']:.0f} МБ)")
+    if RERANKER_ENABLED:
+        from src.tools.reranker import get_reranker
+        get_reranker().warm_up()
+
+    # Простаивающие сессии закрываются и без новых сообщений
+    from src.core.orchestrator import start_session_sweeper, shutdown_sessions
+    sweeper = start_session_sweeper()
+
     print("✅ Бот запущен и готов к работе!")
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        sweeper.cancel()
+        shutdown_sessions()
@@ -4,9 +4,10 @@ from aiogram import Router, F
 from aiogram.types import Message, FSInputFile
 from aiogram.filters import Command
 from aiogram.enums import ParseMode
+from aiogram.exceptions import TelegramBadRequest
 
 # Импортируем функции из оркестратора
-from src.core.orchestrator import handle_document_upload, handle_user_query, get_help_message
+from src.core.orchestrator import handle_document_upload, handle_user_query, get_help_message, get_indexing_status
 
 router = Router()
 
@@ -24,31 +25,35 @@ async def handle_document(message: Message):
         await message.answer("❌ Пожалуйста, отправьте PDF-файл.")
         return
 
+    # Пока идёт индексация предыдущего файла, новый не принимаем
+    indexing_status = get_indexing_status(message.from_user.id)
+    if indexing_status:
+        await message.answer(f"{indexing_status}\nДождитесь окончания обработки предыдущего файла.")
+        return
+
     wait_msg = await message.answer("📥 Начинаю обработку вашего конспекта...")
 
     try:
         # Скачиваем файл во временную папку
-        # Используем tempfile.gettempdir() для кроссплатформенности
+        # Используем tempfile для кроссплатформенности и уникального имени
         file = await message.bot.get_file(message.document.file_id)
 
         # Сохраняем во временную директорию
         # Важно: если нужно сохранить надолго для math_agent,
         # orchestrator сам скопирует его куда надо (в pdf_cache)
-        temp_path = os.path.join(tempfile.gettempdir(), f"{message.from_user.id}_{message.document.file_name}")
+        fd, temp_path = tempfile.mkstemp(prefix=f"{message.from_user.id}_", suffix=".pdf")
+        os.close(fd)
 
         await message.bot.download_file(file.file_path, temp_path)
 
-        # Вызываем оркестратор для обработки
-        result_text = await handle_document_upload(message.from_user.id, temp_path)
-
-        # Удаляем временный файл (orchestrator уже сделал свою копию, если нужно)
-        if os.path.exists(temp_path):
-            try:
-                os.remove(temp_path)
-            except:
-                pass
+        # Ставим файл в очередь индексации: прогресс и итог придут в это же сообщение.
+        # Временный файл удалит оркестратор после обработки.
+        status_text = await handle_document_upload(message.from_user.id, temp_path, on_status=wait_msg.edit_text)
 
-        await wait_msg.edit_text(result_text)
+        try:
+            await wait_msg.edit_text(status_text)
+        except TelegramBadRequest:
+            pass  # Фоновая задача уже успела выставить этот же статус
 
     except Exception as e:
         # Логируем ошибку, если есть логгер, иначе просто пишем в чат
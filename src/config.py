@@ -11,6 +11,10 @@ TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 # Paths
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 VECTOR_DB_ROOT_PATH = os.path.join(BASE_DIR, "chroma_db_users")
+DOCUMENT_REGISTRY_PATH = os.path.join(VECTOR_DB_ROOT_PATH, "registry.sqlite3")
+CHROMA_SHARED_PATH = os.path.join(VECTOR_DB_ROOT_PATH, "chroma")  # Один клиент Chroma, коллекция на документ
+CONVERSATION_DB_PATH = os.path.join(VECTOR_DB_ROOT_PATH, "conversations.sqlite3")  # Память диалогов RAG-сессий
+CHROMA_MEMORY_LIMIT_MB = 512  # Лимит кэша HNSW-сегментов (LRU)
 
 # RAG Settings
 GIGA_MODEL_NAME = "GigaChat Lite"
@@ -18,8 +22,94 @@ AUTH_URL = "https://ngw.devices.sberbank.ru:9443/api/v2/oauth"
 EMBEDDING_MODEL = "cointegrated/rubert-tiny2"
 CHUNK_SIZE = 500
 CHUNK_OVERLAP = 100
+# Parent-child: в базу идут дочерние чанки CHUNK_SIZE без перекрытия (контекст вокруг даёт родитель),
+# в промпт — родитель: страница или её раздел не длиннее PARENT_CHUNK_SIZE
+PARENT_CHILD_ENABLED = True
+CHILD_CHUNK_OVERLAP = 0
+PARENT_CHUNK_SIZE = 1500
+PARENT_CHILD_FETCH_K = 15  # Сколько дочерних чанков искать, чтобы набрать k разных родителей
 RETRIEVER_K = 5
+
+# Внутренние поисковые запросы (одинаковые для всех пользователей)
+NOTE_TOPICS_QUERY = "основные темы и понятия конспекта"
+NOTE_METHODOLOGY_QUERY = "конспект методика"
+NOTE_STRUCTURE_QUERY = "конспект структура"
+INTERNAL_QUERIES = (NOTE_TOPICS_QUERY, NOTE_METHODOLOGY_QUERY, NOTE_STRUCTURE_QUERY)
+QUERY_EMBEDDING_CACHE_SIZE = 2048  # LRU эмбеддингов запросов, общий для всех пользователей
+RETRIEVAL_MODE = "hybrid"  # "hybrid" = BM25 + векторный поиск, "dense" = только векторный
+HYBRID_FETCH_K = 20  # Кандидатов из каждого списка перед слиянием
+RRF_K = 60  # Константа reciprocal rank fusion
+MMR_ENABLED = True  # Разнообразие выдачи (maximal marginal relevance): без почти дубликатов из перекрытий чанков
+MMR_LAMBDA = 0.7  # 1 — только релевантность, 0 — только разнообразие
+MMR_FETCH_K = 20  # Кандидатов, из которых MMR выбирает k
+RETRIEVAL_CACHE_SIZE = 4096  # LRU результатов поиска (пользователь, версия индекса, запрос, k)
+RETRIEVAL_CACHE_TTL_SECONDS = 3600  # None — записи живут до вытеснения или переиндексации
+
+# Reranking (кросс-энкодер после поиска: в промпт идут только лучшие чанки)
+RERANKER_ENABLED = False
+RERANKER_MODEL = "DiTy/cross-encoder-russian-msmarco"
+RERANK_FETCH_K = 30  # Сколько кандидатов переранжировать
+RERANK_TOP_N = 3  # Сколько чанков отдавать в промпт
+RERANK_BATCH_SIZE = 8  # Пар в батче: между батчами проверяется бюджет задержки
+RERANK_LATENCY_BUDGET_MS = 300  # Дольше не переранжируем: остальные кандидаты идут в исходном порядке
 LLM_TEMPERATURE = 0.1
+LLM_MAX_CONNECTIONS = 20  # Пул соединений общего HTTP-клиента GigaChat (один на все сессии)
+
+# RAG-сессии пользователей (цепочка, память, клиенты) держатся в ограниченном пуле
+SESSION_POOL_MAX_SIZE = 200
+SESSION_IDLE_TTL_SECONDS = 30 * 60  # Простаивающая дольше сессия закрывается
+SESSION_SWEEP_INTERVAL_SECONDS = 60  # Как часто фоновая задача бота ищет простаивающие сессии
+SESSION_PERSIST_MEMORY = True  # Хранить диалог на диске: сессия восстанавливается после вытеснения и перезапуска
+
+# Память диалога: старые реплики сворачиваются в сводку фоном, ответ не ждёт LLM
+MEMORY_MAX_TOKENS = 1000  # Последние реплики, которые идут в промпт дословно
+SUMMARY_WORKERS = 4  # Потоки фоновой суммаризации (общие для всех сессий)
+SUMMARY_FALLBACK_TOKENS = 300  # Выжимка без LLM, пока фоновая сводка не готова
+CONDENSE_GATE_ENABLED = True  # Не переформулировать вопрос через LLM, если он понятен без истории
+CONDENSE_GATE_MIN_WORDS = 3  # Вопрос короче считается продолжением диалога («Почему?», «Приведи пример»)
+
+# Бюджеты контекста в промптах, токены (≈ 4 символа русского текста на токен).
+# Чанки укладываются упаковщиком контекста и не режутся посреди предложения
+CONTEXT_PACKING = "greedy"  # "greedy" или "knapsack"
+# RAGLoader.get_retrieved_context (раньше 2000 символов). С parent-child в контекст идут родители
+# до PARENT_CHUNK_SIZE символов (400+ токенов: на плотном тексте выходит меньше 4 символов на токен,
+# считаем по 3 с запасом), поэтому бюджет рассчитан на AGENT_CONTEXT_PARENTS разделов, а не на один
+AGENT_CONTEXT_PARENTS = 3
+AGENT_CONTEXT_TOKENS = AGENT_CONTEXT_PARENTS * PARENT_CHUNK_SIZE // 3 if PARENT_CHILD_ENABLED else 500
+QUIZ_CONTEXT_TOKENS = 2200  # QuizAgent (раньше 9000 символов)
+CONCEPTS_CONTEXT_TOKENS = 1000  # ConceptExplainerAgent.extract_concepts (раньше 4000 символов)
+NOTES_SAMPLE_TOKENS = 500  # StudyAdvisorAgent.improve_notes (раньше 2000 символов)
+
+# Indexing
+MAX_PDF_SIZE_MB = 20  # Лимит Telegram Bot API на скачивание файлов
+INDEX_BATCH_SIZE = 64  # Чанков в одном микро-батче эмбеддингов
+INDEX_INFLIGHT_BATCHES = 2  # Сколько батчей одновременно в работе
+INDEXING_WORKERS = 2  # Сколько PDF индексируется одновременно (фоновая очередь)
+INDEXING_QUEUE_SIZE = 50  # Максимум задач, ожидающих в очереди
+INDEXING_PROGRESS_INTERVAL = 3.0  # Как часто (сек) обновлять сообщение о прогрессе
+PDF_EXTRACTION_WORKERS = int(os.getenv("PDF_EXTRACTION_WORKERS", "0"))  # 0 = по числу ядер
+PDF_EXTRACTION_SHARD_PAGES = 8  # Страниц в одном задании процесса извлечения
+
+# Embedding engine (можно переопределить через переменные окружения на хостах индексации)
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+EMBEDDING_WORKERS = int(os.getenv("EMBEDDING_WORKERS", "1"))  # >1 включает пул процессов
+EMBEDDING_THREADS_PER_WORKER = int(os.getenv("EMBEDDING_THREADS_PER_WORKER", "0"))  # 0 = ядра / воркеры
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")  # "torch" | "torch-int8" | "onnx"
+EMBEDDING_EXPORT_DIR = os.path.join(VECTOR_DB_ROOT_PATH, "models")  # Куда сохраняется ONNX-экспорт модели
+
+# Embedding cache (общий для всех пользователей, ключ — модель + хэш текста чанка)
+EMBEDDING_CACHE_ENABLED = True
+EMBEDDING_CACHE_DIR = os.path.join(VECTOR_DB_ROOT_PATH, "embedding_cache")
+EMBEDDING_CACHE_MAX_ENTRIES = 100_000  # ~120 МБ для 312-мерных векторов rubert-tiny2
+
+# Vector storage
+# "auto" — NumpyVectorStore (mmap .npy, полный перебор), пока база не больше NUMPY_STORE_MAX_CHUNKS, иначе Chroma;
+# "numpy" / "chroma" — всегда указанное хранилище
+VECTOR_STORE_BACKEND = os.getenv("VECTOR_STORE_BACKEND", "auto")
+NUMPY_STORE_MAX_CHUNKS = 20_000
+VECTOR_QUANTIZATION = None  # None = float32; "int8" или "float16" = квантованное NumpyVectorStore
+QUANTIZED_RESCORE = True  # Пересчитывать лучших кандидатов в полной точности
+QUANTIZED_RESCORE_FETCH_K = 20  # Сколько кандидатов брать для пересчёта
 
 # Validation
 def validate_config():
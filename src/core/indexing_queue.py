@@ -0,0 +1,163 @@
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, Optional
+from src.config import INDEXING_WORKERS, INDEXING_QUEUE_SIZE, INDEXING_PROGRESS_INTERVAL
+from src.tools.pdf_indexer import index_user_pdf
+
+logger = logging.getLogger(__name__)
+
+# Состояния задачи индексации
+QUEUED = "queued"
+PARSING = "parsing"
+EMBEDDING = "embedding"
+DONE = "done"
+FAILED = "failed"
+
+StatusCallback = Callable[[str], Awaitable[None]]
+DoneCallback = Callable[[bool], Awaitable[None]]
+
+
+@dataclass
+class IndexingJob:
+    user_id: int
+    file_path: str
+    on_status: Optional[StatusCallback] = None
+    on_done: Optional[DoneCallback] = None
+    state: str = QUEUED
+    pages_done: int = 0
+    pages_total: int = 0
+    created_at: float = field(default_factory=time.time)
+
+    @property
+    def is_active(self) -> bool:
+        return self.state not in (DONE, FAILED)
+
+    def describe(self) -> str:
+        """Текст статуса для пользователя."""
+        if self.state == QUEUED:
+            return "⏳ Конспект в очереди на обработку..."
+        if self.state == PARSING:
+            return "📄 Читаю конспект..."
+        if self.state == EMBEDDING:
+            if self.pages_total:
+                percent = int(100 * self.pages_done / self.pages_total)
+                return f"🧠 Индексирую конспект: {self.pages_done}/{self.pages_total} стр. ({percent}%)"
+            return "🧠 Индексирую конспект..."
+        if self.state == DONE:
+            return "✅ Конспект обработан."
+        return "❌ Не удалось обработать файл."
+
+
+class IndexingQueue:
+    """
+    Очередь фоновой индексации PDF.
+
+    Обработчик загрузки только ставит задачу и сразу освобождается. Индексация идёт
+    в собственном пуле потоков (не в default executor, которым пользуются запросы),
+    воркеров не больше INDEXING_WORKERS. Прогресс периодически отправляется в on_status.
+    """
+
+    def __init__(self, workers: int = INDEXING_WORKERS, max_queued: int = INDEXING_QUEUE_SIZE,
+                 progress_interval: float = INDEXING_PROGRESS_INTERVAL):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.progress_interval = progress_interval
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="indexing")
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker_tasks = []
+        self._jobs: Dict[int, IndexingJob] = {}
+
+    def get_job(self, user_id: int) -> Optional[IndexingJob]:
+        """Незавершённая задача пользователя, если она есть."""
+        job = self._jobs.get(user_id)
+        return job if job is not None and job.is_active else None
+
+    def submit(self, user_id: int, file_path: str, on_status: Optional[StatusCallback] = None,
+               on_done: Optional[DoneCallback] = None) -> IndexingJob:
+        """
+        Ставит файл в очередь. Файл удаляется после обработки.
+        on_status получает тексты прогресса, on_done — итог (True/False).
+        Бросает RuntimeError, если у пользователя уже идёт индексация,
+        и asyncio.QueueFull, если очередь переполнена.
+        """
+        self._ensure_started()
+        if self.get_job(user_id) is not None:
+            raise RuntimeError(f"Индексация для user_id {user_id} уже выполняется")
+
+        job = IndexingJob(user_id=user_id, file_path=file_path, on_status=on_status, on_done=on_done)
+        self._queue.put_nowait(job)
+        self._jobs[user_id] = job
+        logger.info(f"📥 Задача индексации user_id {user_id} в очереди (ожидают: {self._queue.qsize()})")
+        return job
+
+    def _ensure_started(self):
+        """Очередь и воркеры создаются в работающем event loop при первой задаче."""
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queued)
+            self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                try:
+                    success = await self._run_job(job)
+                except Exception as e:
+                    logger.error(f"❌ Ошибка задачи индексации user_id {job.user_id}: {e}")
+                    job.state = FAILED
+                    success = False
+                # Итог сообщаем вне try выше: ошибка уведомления не делает готовый индекс неудачным
+                if job.on_done is not None:
+                    try:
+                        await job.on_done(success)
+                    except Exception as e:
+                        logger.warning(f"Не удалось сообщить итог индексации user_id {job.user_id}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _run_job(self, job: IndexingJob) -> bool:
+        loop = asyncio.get_running_loop()
+        job.state = PARSING
+
+        def on_progress(stage: str, done: int, total: int):
+            # Вызывается из потока индексации: только меняем поля, сообщения шлёт event loop
+            job.state = stage
+            job.pages_done = done
+            job.pages_total = total
+
+        reporter = asyncio.create_task(self._report_progress(job))
+        try:
+            success = await loop.run_in_executor(
+                self._executor, lambda: index_user_pdf(job.file_path, job.user_id, progress_callback=on_progress)
+            )
+        finally:
+            reporter.cancel()
+            if os.path.exists(job.file_path):
+                try:
+                    os.remove(job.file_path)
+                except OSError:
+                    pass
+
+        job.state = DONE if success else FAILED
+        logger.info(f"{'✅' if success else '❌'} Индексация user_id {job.user_id} завершена "
+                    f"за {time.time() - job.created_at:.1f} с")
+        return success
+
+    async def _report_progress(self, job: IndexingJob):
+        """Раз в progress_interval секунд отправляет статус, если он изменился."""
+        if job.on_status is None:
+            return
+        last_text = None
+        while True:
+            text = job.describe()
+            if text != last_text:
+                try:
+                    await job.on_status(text)
+                    last_text = text
+                except Exception as e:
+                    logger.warning(f"Не удалось обновить прогресс индексации: {e}")
+            await asyncio.sleep(self.progress_interval)
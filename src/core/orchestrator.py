@@ -2,8 +2,9 @@ import asyncio
 import logging
 import os
 import re
-from typing import Dict, Any, List
-from src.tools.pdf_indexer import index_user_pdf
+from typing import Dict, Any, List, Optional, Callable, Awaitable
+from src.config import MAX_PDF_SIZE_MB, NOTE_METHODOLOGY_QUERY, NOTE_STRUCTURE_QUERY, QUIZ_CONTEXT_TOKENS
+from src.core.indexing_queue import IndexingQueue
 from src.agents.RAG import RAGAgent
 from src.agents.concept_explainer import ConceptExplainerAgent
 from src.agents.source_finder import SourceFinderAgent
@@ -25,24 +26,11 @@ _concept_explainer = ConceptExplainerAgent()
 _source_finder = SourceFinderAgent()
 _study_advisor = StudyAdvisorAgent()
 _quiz_agent = QuizAgent()
+# Фоновая индексация загруженных PDF
+_indexing_queue = IndexingQueue()
 
 
-async def handle_document_upload(user_id: int, file_path: str) -> str:
-    """
-    Обрабатывает загрузку конспекта студента
-    """
-    try:
-        logger.info(f"📥 Обработка конспекта для студента {user_id}")
-
-        file_size = os.path.getsize(file_path) / (1024 * 1024)
-        if file_size > 10:
-            return "❌ Файл слишком большой. Максимальный размер - 10MB."
-
-        success: bool = await asyncio.to_thread(index_user_pdf, file_path, user_id)
-
-        if success:
-            logger.info(f"✅ Конспект студента {user_id} успешно обработан")
-            return """✅ Ваш конспект успешно обработан!
+UPLOAD_SUCCESS_MESSAGE = """✅ Ваш конспект успешно обработан!
 
 Теперь я могу помочь вам:
 
@@ -53,11 +41,80 @@ async def handle_document_upload(user_id: int, file_path: str) -> str:
 • 🔍 **Ответить на вопросы** - любые вопросы по конспекту
 
 Задавайте вопросы по вашему конспекту!"""
-        else:
-            logger.error(f"❌ Не удалось обработать конспект для студента {user_id}")
-            return "❌ Не удалось обработать файл. Убедитесь, что это читаемый PDF."
+
+
+def _remove_file(file_path: str):
+    if os.path.exists(file_path):
+        try:
+            os.remove(file_path)
+        except OSError:
+            pass
+
+
+def get_indexing_status(user_id: int) -> Optional[str]:
+    """Статус незавершённой индексации пользователя или None."""
+    job = _indexing_queue.get_job(user_id)
+    return job.describe() if job is not None else None
+
+
+def get_session_stats() -> Dict[str, int]:
+    """Пул RAG-сессий: живые, вытесненные, пересобранные."""
+    return _rag_agent.get_session_stats()
+
+
+def start_session_sweeper() -> asyncio.Task:
+    """Запускает фоновую очистку простаивающих RAG-сессий (вызывается при старте бота)."""
+    return asyncio.create_task(_rag_agent.sweep_idle_sessions())
+
+
+def shutdown_sessions():
+    """Закрывает RAG-сессии при остановке бота (память сессий сохраняется на диск)."""
+    _rag_agent.close_all_sessions()
+
+
+async def handle_document_upload(user_id: int, file_path: str,
+                                 on_status: Optional[Callable[[str], Awaitable[None]]] = None) -> str:
+    """
+    Ставит конспект студента в очередь на индексацию и сразу возвращает статус.
+    Прогресс и итог обработки приходят в on_status. Файл удаляется после обработки.
+    """
+    try:
+        logger.info(f"📥 Обработка конспекта для студента {user_id}")
+
+        file_size = os.path.getsize(file_path) / (1024 * 1024)
+        if file_size > MAX_PDF_SIZE_MB:
+            _remove_file(file_path)
+            return f"❌ Файл слишком большой. Максимальный размер - {MAX_PDF_SIZE_MB}MB."
+
+        async def on_done(success: bool):
+            if success:
+                logger.info(f"✅ Конспект студента {user_id} успешно обработан")
+                # Старая сессия смотрит на прежнюю базу документа — пересоздадим её при следующем вопросе
+                _rag_agent.reset_session(user_id)
+                result_text = UPLOAD_SUCCESS_MESSAGE
+            else:
+                logger.error(f"❌ Не удалось обработать конспект для студента {user_id}")
+                result_text = "❌ Не удалось обработать файл. Убедитесь, что это читаемый PDF."
+            if on_status is not None:
+                try:
+                    await on_status(result_text)
+                except Exception as e:
+                    # Индекс уже готов: ошибка Telegram при правке сообщения не меняет результат
+                    logger.warning(f"Не удалось отправить итог индексации студенту {user_id}: {e}")
+
+        job = _indexing_queue.submit(user_id, file_path, on_status=on_status, on_done=on_done)
+        return job.describe()
+
+    except asyncio.QueueFull:
+        _remove_file(file_path)
+        return "⏳ Сейчас обрабатывается слишком много файлов. Попробуйте через пару минут."
+
+    except RuntimeError:
+        _remove_file(file_path)
+        return get_indexing_status(user_id) or "⏳ Ваш предыдущий конспект ещё обрабатывается."
 
     except Exception as e:
+        _remove_file(file_path)
         logger.error(f"❌ Ошибка при обработке конспекта (user_id={user_id}): {e}")
         return "❌ Произошла ошибка при обработке файла."
 
@@ -75,6 +132,11 @@ async def handle_user_query(user_id: int, query: str) -> str:
         if text_lower in ['/start', '/help', 'помощь', 'help']:
             return get_help_message()
 
+        # Пока конспект индексируется, отвечать по нему нельзя
+        indexing_status = get_indexing_status(user_id)
+        if indexing_status:
+            return f"{indexing_status}\nОтвечу на вопросы по конспекту, как только обработка завершится."
+
         # Пользователь просит сделать квиз
         quiz_triggers = [
             'квиз',
@@ -499,7 +561,7 @@ async def _handle_study_advice(user_id: int, query: str) -> str:
         # Определяем тип совета
         if any(word in query.lower() for word in ['конспект', 'заметк', 'запис']):
             # Советы по ведению конспектов
-            notes_context = await _get_context_from_notes(user_id, "конспект методика")
+            notes_context = await _get_context_from_notes(user_id, NOTE_METHODOLOGY_QUERY)
             advice_result = await asyncio.to_thread(
                 _study_advisor.get_notes_advice,
                 notes_context
@@ -546,7 +608,7 @@ async def _handle_notes_improvement(user_id: int, query: str) -> str:
     """Обработка запросов на улучшение конспектов"""
     try:
         # Получаем пример конспекта пользователя
-        notes_sample = await _get_context_from_notes(user_id, "конспект структура")
+        notes_sample = await _get_context_from_notes(user_id, NOTE_STRUCTURE_QUERY)
 
         if not notes_sample:
             return "❌ Не найдено конспектов для анализа. Сначала загрузите свой конспект."
@@ -611,8 +673,12 @@ async def _handle_study_plan(user_id: int, query: str) -> str:
         topic = _extract_topic_from_query(query)
         timeframe = _extract_timeframe_from_query(query)
 
-        # Получаем контекст по теме
-        context = await _get_context_from_notes(user_id, topic or "учебный план")
+        # Получаем контекст по теме (по всем подтемам сразу, если их несколько)
+        subtopics = _split_topics(topic) if topic else []
+        if len(subtopics) > 1:
+            context = await _get_context_from_notes_batch(user_id, subtopics)
+        else:
+            context = await _get_context_from_notes(user_id, topic or "учебный план")
 
         plan_result = await asyncio.to_thread(
             _study_advisor.create_study_plan,
@@ -659,8 +725,12 @@ async def _handle_quiz(user_id: int, query: str, topic: str = "весь") -> str
 
         # 2. получаем текст конспекта
         if topic and topic != "весь":
-            # берём релевантный контекст по теме
-            context = await _get_context_from_notes(user_id, topic)
+            # берём релевантный контекст по теме (несколько подтем — одним батчем)
+            subtopics = _split_topics(topic)
+            if len(subtopics) > 1:
+                context = await _get_context_from_notes_batch(user_id, subtopics)
+            else:
+                context = await _get_context_from_notes(user_id, topic)
         else:
             # весь конспект
             context = await asyncio.to_thread(_rag_agent.get_note_text, user_id)
@@ -719,13 +789,12 @@ async def _get_context_from_notes(user_id: int, query: str) -> str:
     """Получает релевантный контекст из конспектов пользователя, БЕЗ использования памяти RAG."""
     try:
         # 1. Получаем сессию RAG (для доступа к ретриверу)
-        rag_session = _rag_agent._get_or_create_session(user_id)
-
-        # 2. Используем ЧИСТЫЙ метод извлечения
-        context = await asyncio.to_thread(
-            rag_session.loader.get_retrieved_context,
-            query
-        )
+        with _rag_agent.use_session(user_id) as rag_session:
+            # 2. Используем ЧИСТЫЙ метод извлечения
+            context = await asyncio.to_thread(
+                rag_session.loader.get_retrieved_context,
+                query
+            )
         return context
 
     except Exception as e:
@@ -733,6 +802,31 @@ async def _get_context_from_notes(user_id: int, query: str) -> str:
         return ""
 
 
+def _split_topics(topic: str) -> List[str]:
+    """Разбивает перечисление тем ("производная, интеграл; ряды") на подтемы."""
+    return [part.strip() for part in re.split(r'[,;\n]', topic) if part.strip()]
+
+
+async def _get_context_from_notes_batch(user_id: int, queries: List[str],
+                                        budget_tokens: int = QUIZ_CONTEXT_TOKENS) -> str:
+    """
+    Контекст сразу по нескольким подтемам: один батч эмбеддингов на все подтемы,
+    поиски по подтемам идут параллельно (RAGLoader.retrieve_batch). Чанки объединяются без повторов.
+    """
+    try:
+        with _rag_agent.use_session(user_id) as rag_session:
+            result = await asyncio.to_thread(
+                rag_session.loader.retrieve_batch,
+                queries,
+                budget_tokens=budget_tokens
+            )
+        return result["context"]
+
+    except Exception as e:
+        logger.warning(f"Не удалось получить контекст по подтемам: {e}")
+        return ""
+
+
 def _extract_concept_from_query(query: str) -> str:
     """Извлекает понятие из запроса"""
     patterns = [
@@ -828,5 +922,6 @@ def get_help_message() -> str:
 __all__ = [
     'handle_document_upload',
     'handle_user_query',
+    'get_indexing_status',
     'get_help_message'
 ]
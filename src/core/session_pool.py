@@ -0,0 +1,214 @@
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Dict, Generic, Hashable, Iterator, Optional, TypeVar
+from src.config import SESSION_POOL_MAX_SIZE, SESSION_IDLE_TTL_SECONDS, SESSION_SWEEP_INTERVAL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+S = TypeVar("S")
+
+
+class SessionPool(Generic[S]):
+    """
+    Ограниченный пул пользовательских сессий: не больше max_size живых сессий (LRU)
+    и не дольше idle_ttl_seconds без обращений.
+
+    Вытесненная сессия передаётся в on_evict (закрыть ресурсы, сохранить память).
+    Простаивающие сессии вытесняются при обращениях к пулу и фоновой задачей sweep_expired.
+    Сессия, взятая через use(), в это время может обслуживать запрос в другом потоке:
+    если её вытеснили, on_evict вызывается, когда её отпустит последний пользователь.
+    Если пользователь вернулся после вытеснения, сессия создаётся заново — это
+    считается пересборкой (rebuilt). Интерфейс словаря (in, [], del) сохранён,
+    чтобы код, работавший с dict, не менялся.
+    """
+
+    def __init__(self, factory: Callable[[Hashable], S],
+                 on_evict: Optional[Callable[[Hashable, S, str], None]] = None,
+                 max_size: int = SESSION_POOL_MAX_SIZE,
+                 idle_ttl_seconds: Optional[float] = SESSION_IDLE_TTL_SECONDS):
+        self.factory = factory
+        self.on_evict = on_evict
+        self.max_size = max_size
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self._sessions: "OrderedDict[Hashable, tuple]" = OrderedDict()  # ключ -> (сессия, время обращения)
+        self._evicted_keys = set()
+        self._in_use: Dict[int, int] = {}  # id(сессии) -> сколько запросов её сейчас держат
+        self._deferred: Dict[int, tuple] = {}  # id(сессии) -> (ключ, причина) отложенного on_evict
+        self._lock = threading.Lock()
+        self.created = 0
+        self.rebuilt = 0
+        self.evicted: Dict[str, int] = {"lru": 0, "ttl": 0}
+
+    def get_or_create(self, key: Hashable) -> S:
+        return self._get_or_create(key, acquire=False)
+
+    @contextmanager
+    def use(self, key: Hashable) -> Iterator[S]:
+        """Сессия на время запроса: пока она занята, вытеснение не закрывает её ресурсы."""
+        session = self._get_or_create(key, acquire=True)
+        try:
+            yield session
+        finally:
+            self._release(session)
+
+    def _acquire(self, session: S):
+        # Вызывается под self._lock
+        self._in_use[id(session)] = self._in_use.get(id(session), 0) + 1
+
+    def _release(self, session: S):
+        with self._lock:
+            count = self._in_use.pop(id(session)) - 1
+            if count:
+                self._in_use[id(session)] = count
+                return
+            deferred = self._deferred.pop(id(session), None)
+        if deferred is not None:
+            self._close(deferred[0], session, deferred[1])
+
+    def _get_or_create(self, key: Hashable, acquire: bool) -> S:
+        self.evict_expired()
+        with self._lock:
+            entry = self._sessions.get(key)
+            if entry is not None:
+                self._sessions[key] = (entry[0], time.monotonic())
+                self._sessions.move_to_end(key)
+                if acquire:
+                    self._acquire(entry[0])
+                return entry[0]
+
+        # Создание медленное (токен, база, цепочка): делаем его вне блокировки
+        session = self.factory(key)
+        with self._lock:
+            entry = self._sessions.get(key)
+            if entry is None:
+                self._sessions[key] = (session, time.monotonic())
+                self.created += 1
+                if key in self._evicted_keys:
+                    self._evicted_keys.discard(key)
+                    self.rebuilt += 1
+                overflow = self._pop_overflow()
+            else:
+                # Параллельный вызов успел раньше: лишнюю сессию закрываем
+                overflow = [(key, session, "duplicate")]
+                session = entry[0]
+            if acquire:
+                self._acquire(session)
+        for evicted_key, evicted_session, reason in overflow:
+            self._evict(evicted_key, evicted_session, reason)
+        return session
+
+    def _pop_overflow(self) -> list:
+        overflow = []
+        while len(self._sessions) > self.max_size:
+            evicted_key, (evicted_session, _) = self._sessions.popitem(last=False)
+            overflow.append((evicted_key, evicted_session, "lru"))
+        return overflow
+
+    def evict_expired(self) -> int:
+        """
+        Вытесняет сессии, простаивающие дольше idle_ttl_seconds (самые старые — в начале LRU).
+        Занятые запросом сессии (use()) пропускает: они вытеснятся при следующей проверке.
+        """
+        if not self.idle_ttl_seconds:
+            return 0
+        deadline = time.monotonic() - self.idle_ttl_seconds
+        expired = []
+        with self._lock:
+            for key, (session, last_used) in list(self._sessions.items()):
+                if last_used > deadline:
+                    break
+                if id(session) in self._in_use:
+                    continue
+                del self._sessions[key]
+                expired.append((key, session))
+        for key, session in expired:
+            self._evict(key, session, "ttl")
+        return len(expired)
+
+    async def sweep_expired(self, interval_seconds: float = SESSION_SWEEP_INTERVAL_SECONDS):
+        """
+        Фоновая задача (запускается вместе с ботом): закрывает простаивающие сессии, даже
+        если новых запросов нет. Закрытие ресурсов блокирующее, поэтому идёт в потоке.
+        """
+        while True:
+            await asyncio.sleep(interval_seconds)
+            try:
+                await asyncio.to_thread(self.evict_expired)
+            except Exception as e:
+                logger.error(f"❌ Ошибка фоновой очистки сессий: {e}")
+
+    def _evict(self, key: Hashable, session: S, reason: str):
+        """reason: lru, ttl (учитываются в статистике), shutdown, duplicate, reset."""
+        with self._lock:
+            if reason in self.evicted:
+                self.evicted[reason] += 1
+                self._evicted_keys.add(key)
+                logger.info(f"♻️ Сессия {key} вытеснена ({reason})")
+            if id(session) in self._in_use:
+                # Сессия ещё отвечает на запрос: закроем её в _release
+                self._deferred[id(session)] = (key, reason)
+                return
+        self._close(key, session, reason)
+
+    def _close(self, key: Hashable, session: S, reason: str):
+        if self.on_evict is not None:
+            try:
+                self.on_evict(key, session, reason)
+            except Exception as e:
+                logger.error(f"❌ Ошибка при закрытии сессии {key}: {e}")
+
+    def pop(self, key: Hashable) -> Optional[S]:
+        """Убирает сессию без вытеснения (сброс пользователем); закрывает её вызывающий."""
+        with self._lock:
+            entry = self._sessions.pop(key, None)
+            self._evicted_keys.discard(key)
+        return entry[0] if entry is not None else None
+
+    def discard(self, key: Hashable):
+        """Убирает сессию и закрывает её через on_evict (сразу или после текущих запросов)."""
+        session = self.pop(key)
+        if session is not None:
+            self._evict(key, session, "reset")
+
+    def close_all(self):
+        """Вытесняет все сессии (остановка бота): ресурсы закрываются, память сохраняется."""
+        with self._lock:
+            sessions = list(self._sessions.items())
+            self._sessions.clear()
+        for key, (session, _) in sessions:
+            self._evict(key, session, "shutdown")
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._sessions
+
+    def __getitem__(self, key: Hashable) -> S:
+        with self._lock:
+            session, _ = self._sessions[key]
+            self._sessions[key] = (session, time.monotonic())
+            self._sessions.move_to_end(key)
+            return session
+
+    def __delitem__(self, key: Hashable):
+        if self.pop(key) is None:
+            raise KeyError(key)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._sessions)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "live": len(self._sessions),
+                "max_size": self.max_size,
+                "created": self.created,
+                "evicted": sum(self.evicted.values()),
+                "evicted_lru": self.evicted["lru"],
+                "evicted_ttl": self.evicted["ttl"],
+                "rebuilt": self.rebuilt,
+            }
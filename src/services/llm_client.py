@@ -0,0 +1,52 @@
+import threading
+from functools import lru_cache
+from typing import Optional
+from langchain_gigachat.chat_models import GigaChat
+from src.config import LLM_TEMPERATURE, LLM_MAX_CONNECTIONS
+from src.services.get_token import get_token
+
+_client_lock = threading.Lock()
+_client = None  # gigachat.GigaChat с текущим токеном
+_client_token: Optional[str] = None
+_retired_client = None  # Клиент прошлого токена: закрывается при следующей смене, чтобы не оборвать запросы
+
+
+def get_gigachat_client():
+    """
+    Один HTTP-клиент GigaChat на процесс (пул соединений LLM_MAX_CONNECTIONS).
+    Когда get_token() выдаёт новый токен, клиент пересоздаётся — все сессии
+    сразу работают с действующим токеном.
+    """
+    global _client, _client_token, _retired_client
+    token = get_token()
+    if not token:
+        raise ValueError("Не удалось получить Access Token.")
+    if token == _client_token:
+        return _client
+    with _client_lock:
+        if token != _client_token:
+            import gigachat
+            if _retired_client is not None:
+                _retired_client.close()
+            _retired_client = _client
+            _client = gigachat.GigaChat(access_token=token, verify_ssl_certs=False,
+                                        max_connections=LLM_MAX_CONNECTIONS)
+            _client_token = token
+        return _client
+
+
+class PooledGigaChat(GigaChat):
+    """GigaChat, который ходит в API через общий клиент процесса, а не через свой."""
+
+    @property
+    def _client(self):
+        return get_gigachat_client()
+
+
+@lru_cache(maxsize=None)
+def get_llm(temperature: float = LLM_TEMPERATURE) -> PooledGigaChat:
+    """
+    Общая LLM для всех сессий и агентов (одна на значение temperature).
+    Токен запрашивается при первом обращении к API, а не при создании.
+    """
+    return PooledGigaChat(temperature=temperature, verify_ssl_certs=False)
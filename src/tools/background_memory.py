@@ -0,0 +1,165 @@
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence
+from pydantic import ConfigDict, PrivateAttr
+from langchain.memory import ConversationSummaryBufferMemory
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, get_buffer_string
+from src.config import SUMMARY_WORKERS, SUMMARY_FALLBACK_TOKENS
+from src.tools.context_packer import pack_context, split_sentences
+from src.tools.conversation_store import ConversationStore
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=1)
+def get_summary_executor() -> ThreadPoolExecutor:
+    """Общий пул потоков фоновой суммаризации для всех сессий."""
+    return ThreadPoolExecutor(max_workers=SUMMARY_WORKERS, thread_name_prefix="summary")
+
+
+def _keep_newest(lines: Sequence[str], budget_tokens: int) -> str:
+    """Строки в исходном порядке; если все не влезают в бюджет, остаются самые свежие."""
+    scores = list(range(1, len(lines) + 1))
+    return pack_context(lines, budget_tokens, scores=scores, separator="\n")["text"]
+
+
+def extractive_summary(messages: Sequence[BaseMessage], budget_tokens: int = SUMMARY_FALLBACK_TOKENS) -> str:
+    """Дешёвая сводка без LLM: первое предложение каждой реплики, свежие важнее старых."""
+    lines = []
+    for message in messages:
+        sentences = split_sentences(message.content) if isinstance(message.content, str) else []
+        if sentences:
+            role = "Студент" if isinstance(message, HumanMessage) else "Ассистент"
+            lines.append(f"{role}: {sentences[0]}")
+    return _keep_newest(lines, budget_tokens)
+
+
+class BackgroundSummaryMemory(ConversationSummaryBufferMemory):
+    """
+    ConversationSummaryBufferMemory, которая не суммаризирует на пути запроса.
+
+    Реплики, вышедшие за max_token_limit, откладываются, а сводку по ним LLM
+    пишет в фоновом потоке — ответ студенту уходит сразу. Если к следующему
+    вопросу фоновая сводка ещё не готова, в промпт идёт прежняя сводка плюс
+    выжимка отложенных реплик (extractive_summary). Если LLM не ответила,
+    выжимка становится частью сводки, чтобы отложенное не копилось.
+
+    Со store каждая реплика сразу дописывается в ConversationStore, готовая
+    сводка — тоже, и restore() поднимает диалог с диска без LLM.
+    """
+
+    fallback_tokens: int = SUMMARY_FALLBACK_TOKENS
+    store: Optional[ConversationStore] = None
+    user_id: Optional[int] = None
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    _pending: List[BaseMessage] = PrivateAttr(default_factory=list)
+    _job: Optional[Future] = PrivateAttr(default=None)
+    _generation: int = PrivateAttr(default=0)
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+
+    def save_context(self, inputs: Dict[str, Any], outputs: Dict[str, str]) -> None:
+        input_str, output_str = self._get_input_output(inputs, outputs)
+        messages = [HumanMessage(content=input_str), AIMessage(content=output_str)]
+        if self.store is not None:
+            self.store.append(self.user_id, messages)
+        self.chat_memory.add_messages(messages)
+        self.prune()
+
+    async def asave_context(self, inputs: Dict[str, Any], outputs: Dict[str, str]) -> None:
+        self.save_context(inputs, outputs)
+
+    def prune(self) -> None:
+        """Убирает старые реплики из буфера и ставит их сводку в фоновую очередь."""
+        buffer = self.chat_memory.messages
+        pruned = []
+        while buffer and self.llm.get_num_tokens_from_messages(buffer) > self.max_token_limit:
+            pruned.append(buffer.pop(0))
+        if not pruned:
+            return
+        with self._lock:
+            self._pending.extend(pruned)
+        self._schedule()
+
+    async def aprune(self) -> None:
+        self.prune()
+
+    def _schedule(self):
+        with self._lock:
+            if self._job is not None or not self._pending:
+                return
+            self._job = get_summary_executor().submit(self._compact, self._generation)
+
+    def _compact(self, generation: int):
+        with self._lock:
+            batch = list(self._pending)
+            summary = self.moving_summary_buffer
+        try:
+            new_summary = self.predict_new_summary(batch, summary)
+        except Exception as e:
+            logger.warning(f"Фоновая сводка диалога не удалась, оставляем выжимку: {e}")
+            new_summary = self._fallback_summary(summary, batch, self.max_token_limit)
+
+        with self._lock:
+            self._job = None
+            # Если память очистили или восстановили, пока писалась сводка, результат не нужен
+            if generation == self._generation:
+                self.moving_summary_buffer = new_summary
+                del self._pending[:len(batch)]
+                if self.store is not None and batch[-1].id:
+                    self.store.save_summary(self.user_id, new_summary, int(batch[-1].id))
+        # Пока писалась сводка, могли отложиться новые реплики
+        self._schedule()
+
+    def _fallback_summary(self, summary: str, pending: Sequence[BaseMessage],
+                          budget_tokens: Optional[int] = None) -> str:
+        """Прежняя сводка плюс выжимка отложенных реплик (с budget_tokens — только самые свежие строки)."""
+        extract = extractive_summary(pending, self.fallback_tokens)
+        if budget_tokens is None:
+            return "\n".join(part for part in (summary, extract) if part)
+        lines = [line for line in (summary + "\n" + extract).splitlines() if line.strip()]
+        return _keep_newest(lines, budget_tokens)
+
+    def load_memory_variables(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        with self._lock:
+            summary = self.moving_summary_buffer
+            pending = list(self._pending)
+        if pending:
+            # Фоновая сводка ещё не готова: не ждём LLM
+            logger.debug(f"Сводка диалога не готова, выжимка по {len(pending)} репликам")
+            summary = self._fallback_summary(summary, pending)
+
+        buffer = list(self.chat_memory.messages)
+        if summary:
+            buffer = [self.summary_message_cls(content=summary)] + buffer
+        if not self.return_messages:
+            buffer = get_buffer_string(buffer, human_prefix=self.human_prefix, ai_prefix=self.ai_prefix)
+        return {self.memory_key: buffer}
+
+    async def aload_memory_variables(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        return self.load_memory_variables(inputs)
+
+    def restore(self):
+        """Сводка и несвёрнутые реплики из store (после вытеснения сессии или перезапуска бота)."""
+        summary, messages = self.store.load(self.user_id)
+        with self._lock:
+            self._generation += 1
+            self._pending = []
+            self.moving_summary_buffer = summary
+        self.chat_memory.messages = messages
+        # Реплики сверх max_token_limit свернутся фоном
+        self.prune()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._pending = []
+            if self.store is not None:
+                self.store.delete_user(self.user_id)
+        super().clear()
+
+    async def aclear(self) -> None:
+        self.clear()
@@ -0,0 +1,223 @@
+import os
+import time
+import shutil
+import hashlib
+import logging
+from functools import lru_cache
+from typing import Dict, List, Optional
+from langchain_community.vectorstores import Chroma
+from src.config import VECTOR_DB_ROOT_PATH, CHROMA_SHARED_PATH, CHROMA_MEMORY_LIMIT_MB, INDEX_BATCH_SIZE
+
+logger = logging.getLogger(__name__)
+
+CHROMA_DB_FILE = "chroma.sqlite3"
+LEGACY_COLLECTION = "langchain"  # Имя коллекции, которое LangChain давал отдельным базам
+
+
+@lru_cache(maxsize=1)
+def get_chroma_client():
+    """
+    Единственный клиент Chroma на процесс: одна SQLite-база и один кэш HNSW-сегментов
+    для всех документов. Сегменты вытесняются по LRU, поэтому память не растёт
+    с числом активных пользователей.
+    """
+    import chromadb
+    from chromadb.config import Settings
+    os.makedirs(CHROMA_SHARED_PATH, exist_ok=True)
+    return chromadb.PersistentClient(
+        path=CHROMA_SHARED_PATH,
+        settings=Settings(
+            anonymized_telemetry=False,
+            chroma_segment_cache_policy="LRU",
+            chroma_memory_limit_bytes=CHROMA_MEMORY_LIMIT_MB * 1024 * 1024,
+        )
+    )
+
+
+def collection_name(document_key: str) -> str:
+    """Имя коллекции документа (ключ — sha256 документа; Chroma ограничивает длину имени)."""
+    return f"doc_{document_key[:56]}"
+
+
+def document_collection_exists(document_key: str) -> bool:
+    try:
+        get_chroma_client().get_collection(collection_name(document_key))
+        return True
+    except Exception:
+        return False
+
+
+def open_document_collection(document_key: str, embeddings) -> Chroma:
+    """Векторная база документа — коллекция в общем клиенте (создаётся при первом обращении)."""
+    # Метаданные задаются только при создании: get_or_create_collection перезаписал бы их при каждом открытии
+    metadata = None if document_collection_exists(document_key) else {
+        "hnsw:space": "cosine", "document": document_key, "created_at": time.time()
+    }
+    return Chroma(
+        client=get_chroma_client(),
+        collection_name=collection_name(document_key),
+        embedding_function=embeddings,
+        collection_metadata=metadata
+    )
+
+
+def drop_document_collection(document_key: str):
+    if document_collection_exists(document_key):
+        get_chroma_client().delete_collection(collection_name(document_key))
+
+
+def _iter_records(collection, include: List[str]):
+    """Все записи коллекции порциями (ids, embeddings, documents, metadatas)."""
+    total = collection.count()
+    for offset in range(0, total, INDEX_BATCH_SIZE):
+        yield collection.get(limit=INDEX_BATCH_SIZE, offset=offset, include=include)
+
+
+def copy_document_collection(source_key: str, target_key: str, embeddings) -> int:
+    """Копирует векторы документа в коллекцию другого документа (основа для инкрементальной индексации)."""
+    source = get_chroma_client().get_collection(collection_name(source_key))
+    target = open_document_collection(target_key, embeddings)._collection
+    copied = 0
+    for batch in _iter_records(source, ["embeddings", "documents", "metadatas"]):
+        target.upsert(ids=batch["ids"], embeddings=batch["embeddings"],
+                      documents=batch["documents"], metadatas=batch["metadatas"])
+        copied += len(batch["ids"])
+    return copied
+
+
+def list_document_collections() -> List[Dict]:
+    """Коллекции документов с метаданными и числом чанков (для обслуживания)."""
+    client = get_chroma_client()
+    result = []
+    for collection in client.list_collections():
+        collection = client.get_collection(collection.name)
+        result.append({"name": collection.name, "count": collection.count(), "metadata": collection.metadata})
+    return result
+
+
+def release_legacy_system(path: str):
+    """Останавливает закэшированный клиент Chroma для отдельной папки (база старого формата)."""
+    from chromadb.api.shared_system_client import SharedSystemClient
+    system = SharedSystemClient._identifier_to_system.pop(path, None)
+    if system is not None:
+        system.stop()
+
+
+def _read_legacy_collection(persist_dir: str) -> Optional[dict]:
+    """Все записи базы старого формата (отдельный клиент Chroma в папке)."""
+    import chromadb
+    client = chromadb.PersistentClient(path=persist_dir)
+    try:
+        collections = client.list_collections()
+        if not collections:
+            return None
+        names = [c.name for c in collections]
+        collection = client.get_collection(LEGACY_COLLECTION if LEGACY_COLLECTION in names else names[0])
+        records = {"ids": [], "embeddings": [], "documents": [], "metadatas": []}
+        for batch in _iter_records(collection, ["embeddings", "documents", "metadatas"]):
+            for key in records:
+                records[key].extend(batch[key])
+        return records
+    finally:
+        release_legacy_system(persist_dir)
+
+
+def _import_records(document_key: str, records: dict, embeddings, rekey: bool):
+    """Записывает векторы в коллекцию документа; при rekey id заменяются хэшами текстов (с дедупликацией)."""
+    ids, vectors, documents, metadatas = [], [], [], []
+    seen = set()
+    for chunk_id, vector, text, metadata in zip(records["ids"], records["embeddings"],
+                                                records["documents"], records["metadatas"]):
+        if rekey:
+            chunk_id = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        if chunk_id in seen:
+            continue
+        seen.add(chunk_id)
+        ids.append(chunk_id)
+        vectors.append(list(vector))
+        documents.append(text)
+        metadatas.append(metadata or None)
+
+    collection = open_document_collection(document_key, embeddings)._collection
+    for start in range(0, len(ids), INDEX_BATCH_SIZE):
+        end = start + INDEX_BATCH_SIZE
+        collection.upsert(ids=ids[start:end], embeddings=vectors[start:end],
+                          documents=documents[start:end], metadatas=metadatas[start:end])
+    return ids, documents
+
+
+def migrate_legacy_stores(embeddings=None) -> int:
+    """
+    Переносит базы старого формата (своя папка с chroma.sqlite3) в коллекции общего клиента.
+
+    - chroma_db_users/user_<id>: персональные базы до реестра документов. Id чанков
+      заменяются хэшами текстов, ключ документа — хэш его чанков; пользователь
+      привязывается к документу в реестре.
+    - chroma_db_users/shared/<sha256>: базы документов с отдельным клиентом.
+
+    Лексический индекс и отметка о готовности остаются в папке документа.
+    Векторы переносятся готовыми, модель не вызывается. Возвращает число перенесённых баз.
+    """
+    from src.tools.document_registry import get_document_db_path, get_document_registry
+    from src.tools.lexical_index import LexicalIndex
+    from src.tools.pdf_indexer import COMPLETE_MARKER
+
+    if not os.path.isdir(VECTOR_DB_ROOT_PATH):
+        return 0
+    registry = get_document_registry()
+    migrated = 0
+
+    # Базы документов с собственным клиентом: переносим векторы, остальное в папке не трогаем
+    shared_root = os.path.join(VECTOR_DB_ROOT_PATH, "shared")
+    for document_key in (os.listdir(shared_root) if os.path.isdir(shared_root) else []):
+        document_dir = os.path.join(shared_root, document_key)
+        if not os.path.exists(os.path.join(document_dir, CHROMA_DB_FILE)):
+            continue
+        try:
+            records = _read_legacy_collection(document_dir)
+            if records:
+                _import_records(document_key, records, embeddings, rekey=False)
+            for name in os.listdir(document_dir):
+                path = os.path.join(document_dir, name)
+                if name == CHROMA_DB_FILE:
+                    os.remove(path)
+                elif os.path.isdir(path):
+                    shutil.rmtree(path)  # HNSW-сегменты старого клиента
+            migrated += 1
+        except Exception as e:
+            logger.error(f"❌ Не удалось перенести базу {document_dir}: {e}")
+
+    # Персональные базы user_<id>
+    for name in os.listdir(VECTOR_DB_ROOT_PATH):
+        legacy_dir = os.path.join(VECTOR_DB_ROOT_PATH, name)
+        if not (name.startswith("user_") and name[5:].isdigit()
+                and os.path.exists(os.path.join(legacy_dir, CHROMA_DB_FILE))):
+            continue
+        user_id = int(name[5:])
+        try:
+            if registry.get_digest(user_id) is None:
+                records = _read_legacy_collection(legacy_dir)
+                if records and records["ids"]:
+                    chunk_ids = sorted(hashlib.sha256(text.encode("utf-8")).hexdigest()
+                                       for text in records["documents"])
+                    document_key = hashlib.sha256("".join(chunk_ids).encode("utf-8")).hexdigest()
+                    document_dir = get_document_db_path(document_key)
+                    if not os.path.exists(os.path.join(document_dir, COMPLETE_MARKER)):
+                        shutil.rmtree(document_dir, ignore_errors=True)
+                        ids, documents = _import_records(document_key, records, embeddings, rekey=True)
+                        os.makedirs(document_dir, exist_ok=True)
+                        lexical_index = LexicalIndex(document_dir)
+                        lexical_index.add(ids, documents)
+                        lexical_index.close()
+                        with open(os.path.join(document_dir, COMPLETE_MARKER), "w") as f:
+                            f.write(document_key)
+                    registry.assign(user_id, document_key)
+            release_legacy_system(legacy_dir)
+            shutil.rmtree(legacy_dir, ignore_errors=True)
+            migrated += 1
+        except Exception as e:
+            logger.error(f"❌ Не удалось перенести базу {legacy_dir}: {e}")
+
+    if migrated:
+        logger.info(f"🔁 Перенесено баз в общий клиент Chroma: {migrated}")
+    return migrated
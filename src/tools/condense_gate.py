@@ -0,0 +1,164 @@
+import re
+import time
+import threading
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+from pydantic import ConfigDict
+from langchain.chains.base import Chain
+from langchain_core.callbacks import CallbackManagerForChainRun
+from src.config import CONDENSE_GATE_MIN_WORDS
+
+_WORD_RE = re.compile(r"[a-zа-яё0-9]+")
+
+# Слова, которые отсылают к сказанному раньше: без истории вопрос с ними непонятен
+_REFERENCE_WORDS = frozenset({
+    "это", "этот", "эта", "эти", "этого", "этой", "этому", "этим", "этом", "этих", "эту",
+    "он", "она", "оно", "они", "его", "её", "ее", "их", "него", "неё", "нее", "них", "ним", "ней", "нему", "ими",
+    "там", "тут", "здесь", "сюда", "отсюда", "туда", "оттуда", "тогда", "тот", "та", "те", "того", "тому", "том", "тех",
+    "так", "такой", "такая", "такое", "такие", "такого", "такую", "таким", "такими", "таких", "такому",
+    "выше", "ниже", "предыдущий", "предыдущая", "предыдущее", "предыдущего", "ещё", "еще", "подробнее",
+    "аналогично", "аналогичный", "аналогичная", "аналогичное", "другой", "другая", "другое", "другие",
+    "it", "this", "that", "these", "those", "they", "them", "there", "such",
+})
+# Первое слово продолжения диалога: «А где это применимо?», «И как его найти?»
+_CONTINUATION_WORDS = frozenset({"а", "и", "но", "ну", "тоже", "также", "так", "and", "but", "so"})
+# Основы общих слов просьбы и вопроса: сами по себе не называют тему
+# («Приведи пример из конспекта», «Объясни подробнее, почему так происходит»)
+_GENERIC_STEMS = frozenset({
+    "приве", "приме", "консп", "объяс", "расск", "покаж", "поясн", "проис", "почем", "зачем",
+    "каков", "какой", "какая", "какое", "какие", "каким", "каких", "сколь", "нужно", "можно",
+    "значи", "котор", "чтобы", "когда", "пожал", "спаси", "вопро", "ответ", "текст", "докум",
+    "матер", "лекци", "задач", "получ", "делат", "сдела", "напиш", "скажи", "опиши", "сравн", "найти",
+    "what", "which", "where", "when", "explain", "example", "please", "about",
+})
+# «Что такое закон Ома?», «Кто такой Ньютон?» — оборот определения, а не отсылка
+_DEFINITION_WORDS = frozenset({"что", "кто"})
+_STEM_LENGTH = 5  # Грубая основа: «закона» и «законом» совпадают с «закон»
+_MIN_TERM_LENGTH = 4  # Короче — служебные слова и обрывки
+
+
+def _stem(word: str) -> str:
+    return word[:_STEM_LENGTH]
+
+
+def _has_reference(words: List[str]) -> bool:
+    for i, word in enumerate(words):
+        if word not in _REFERENCE_WORDS:
+            continue
+        if word.startswith("так") and word != "так" and i and words[i - 1] in _DEFINITION_WORDS:
+            continue
+        return True
+    return False
+
+
+def _content_stems(text: str) -> set:
+    """Основы слов, которые могут называть тему вопроса."""
+    return {
+        _stem(word) for word in _WORD_RE.findall(text.lower())
+        if len(word) >= _MIN_TERM_LENGTH and _stem(word) not in _GENERIC_STEMS and word not in _REFERENCE_WORDS
+    }
+
+
+def is_standalone_question(question: str, chat_history: Any = "",
+                           min_words: int = CONDENSE_GATE_MIN_WORDS) -> bool:
+    """
+    Понятен ли вопрос без истории диалога (без модели, по словам вопроса и истории).
+
+    Ошибка возможна в обе стороны: лишняя переформулировка стоит вызова LLM, а
+    пропущенный продолжающий вопрос («Почему так происходит?») уйдёт в поиск без
+    темы и вернёт не те чанки. Поэтому вопрос пропускается только при явных признаках
+    новой темы: в нём нет отсылок к сказанному и есть содержательный термин, которого
+    ещё не было в истории. Вопрос по уже обсуждаемой теме переформулируется как раньше.
+    chat_history — строка истории из ConversationalRetrievalChain или список сообщений.
+    """
+    words = _WORD_RE.findall(question.lower())
+    if len(words) < min_words:
+        return False
+    if words[0] in _CONTINUATION_WORDS:
+        return False
+    if _has_reference(words):
+        return False
+
+    if not isinstance(chat_history, str):
+        chat_history = "\n".join(str(getattr(message, "content", message)) for message in chat_history or [])
+    history_stems = {_stem(word) for word in _WORD_RE.findall(chat_history.lower())}
+    return any(stem not in history_stems for stem in _content_stems(question))
+
+
+class CondenseGate:
+    """
+    Статистика шлюза переформулировки вопроса, общая для всех сессий.
+    Сэкономленное время — среднее время переформулировки через LLM, умноженное на
+    число пропущенных вызовов.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.bypassed = 0
+        self.condensed = 0
+        self.condense_seconds = 0.0
+
+    def record_bypass(self):
+        with self._lock:
+            self.bypassed += 1
+
+    def record_condense(self, seconds: float):
+        with self._lock:
+            self.condensed += 1
+            self.condense_seconds += seconds
+
+    def get_stats(self) -> Dict[str, float]:
+        with self._lock:
+            turns = self.bypassed + self.condensed
+            avg_condense_ms = self.condense_seconds / self.condensed * 1000 if self.condensed else 0.0
+            saved_ms = avg_condense_ms * self.bypassed
+            return {
+                "turns": turns,
+                "bypassed": self.bypassed,
+                "condensed": self.condensed,
+                "bypass_rate": self.bypassed / turns if turns else 0.0,
+                "avg_condense_ms": avg_condense_ms,
+                "saved_ms_total": saved_ms,
+                "saved_ms_per_turn": saved_ms / turns if turns else 0.0,
+            }
+
+
+@lru_cache(maxsize=1)
+def get_condense_gate() -> CondenseGate:
+    return CondenseGate()
+
+
+class GatedQuestionGenerator(Chain):
+    """
+    question_generator для ConversationalRetrievalChain: самостоятельный вопрос на новую
+    тему («Что такое закон Ома?» после разговора о производных) уходит в поиск как есть, без вызова LLM;
+    остальные переформулирует исходная цепочка CONDENSE_QUESTION_PROMPT.
+    """
+
+    question_generator: Chain
+    gate: CondenseGate
+    output_key: str = "text"
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    @property
+    def input_keys(self) -> List[str]:
+        return self.question_generator.input_keys
+
+    @property
+    def output_keys(self) -> List[str]:
+        return [self.output_key]
+
+    def _call(self, inputs: Dict[str, Any],
+              run_manager: Optional[CallbackManagerForChainRun] = None) -> Dict[str, Any]:
+        question = inputs["question"]
+        if is_standalone_question(question, inputs.get("chat_history", "")):
+            self.gate.record_bypass()
+            return {self.output_key: question}
+
+        start = time.perf_counter()
+        callbacks = run_manager.get_child() if run_manager else None
+        output = self.question_generator.invoke(inputs, config={"callbacks": callbacks})
+        new_question = output[self.question_generator.output_keys[0]]
+        self.gate.record_condense(time.perf_counter() - start)
+        return {self.output_key: new_question}
@@ -0,0 +1,127 @@
+import re
+import logging
+from typing import Dict, List, Optional, Sequence, Union
+import numpy as np
+from langchain_core.documents import Document
+from src.config import CONTEXT_PACKING
+from src.tools.tokens import count_tokens
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_SEPARATOR = "\n---\n"
+
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?…])\s+|\n+")
+_BLOCK_RE = re.compile(r"\n-{3,}\n|\n\s*\n")
+
+
+def split_sentences(text: str) -> List[str]:
+    """Предложения (и строки: формулы, пункты списков) текста без пустых."""
+    return [part.strip() for part in _SENTENCE_END_RE.split(text) if part.strip()]
+
+
+def split_blocks(text: str) -> List[str]:
+    """Чанки уже собранного контекста: разделители «---» и пустые строки."""
+    return [part.strip() for part in _BLOCK_RE.split(text) if part.strip()]
+
+
+def _knapsack(weights: List[int], values: List[float], budget: int) -> List[int]:
+    """Точный 0/1-рюкзак по токенам (динамика по бюджету, векторно по NumPy)."""
+    best = np.zeros(budget + 1)
+    taken = np.zeros((len(weights), budget + 1), dtype=bool)
+    for i, (weight, value) in enumerate(zip(weights, values)):
+        if weight > budget:
+            continue
+        candidate = best[:budget + 1 - weight] + value
+        improved = candidate > best[weight:]
+        taken[i, weight:] = improved
+        best[weight:] = np.where(improved, candidate, best[weight:])
+
+    chosen, capacity = [], budget
+    for i in range(len(weights) - 1, -1, -1):
+        if taken[i, capacity]:
+            chosen.append(i)
+            capacity -= weights[i]
+    return chosen[::-1]
+
+
+def _fit_sentences(text: str, budget: int, separator_tokens: int) -> Optional[Dict]:
+    """Начало чанка из целых предложений, которое помещается в budget (None, если не влезает ни одно)."""
+    sentences, used = [], separator_tokens
+    for sentence in split_sentences(text):
+        tokens = count_tokens(sentence) + 1
+        if used + tokens > budget:
+            break
+        sentences.append(sentence)
+        used += tokens
+    if not sentences:
+        return None
+    return {"text": " ".join(sentences), "tokens": used}
+
+
+def pack_context(chunks: Sequence[Union[str, Document]], budget_tokens: int,
+                 scores: Optional[Sequence[float]] = None, method: str = CONTEXT_PACKING,
+                 separator: str = CONTEXT_SEPARATOR) -> Dict:
+    """
+    Собирает контекст для промпта из чанков так, чтобы он уместился в budget_tokens.
+
+    Чанки берутся по убыванию score (по умолчанию — порядок поиска: первый лучше):
+    greedy — лучшие по очереди, пока помещаются; knapsack — набор с максимальной
+    суммой score при данном бюджете. Оставшийся бюджет заполняется началом
+    следующего по score чанка из целых предложений: текст никогда не режется
+    посреди предложения. В итоговом тексте чанки идут в исходном порядке.
+
+    Возвращает text, tokens_used, budget_tokens, chunks_used (целиком), chunks_partial,
+    chunks_total.
+    """
+    if scores is None:
+        scores = [1.0 / (rank + 1) for rank in range(len(chunks))]
+    pairs = [((chunk.page_content if isinstance(chunk, Document) else chunk or "").strip(), score)
+             for chunk, score in zip(chunks, scores)]
+    texts = [text for text, _ in pairs if text]
+    scores = [score for text, score in pairs if text]
+
+    separator_tokens = count_tokens(separator) if separator.strip() else 0
+    weights = [count_tokens(text) + separator_tokens for text in texts]
+    order = sorted(range(len(texts)), key=lambda i: scores[i], reverse=True)
+
+    if method == "knapsack":
+        chosen = set(_knapsack(weights, list(scores), budget_tokens))
+    elif method == "greedy":
+        chosen, used = set(), 0
+        for i in order:
+            if used + weights[i] <= budget_tokens:
+                chosen.add(i)
+                used += weights[i]
+    else:
+        raise ValueError(f"Неизвестный способ упаковки контекста: {method}")
+
+    parts = {i: texts[i] for i in chosen}
+    used = sum(weights[i] for i in chosen)
+    partial = 0
+    for i in order:
+        if i in chosen:
+            continue
+        fitted = _fit_sentences(texts[i], budget_tokens - used, separator_tokens)
+        if fitted is not None:
+            parts[i] = fitted["text"]
+            used += fitted["tokens"]
+            partial = 1
+        break
+
+    text = separator.join(parts[i] for i in sorted(parts))
+    result = {
+        "text": text,
+        "tokens_used": count_tokens(text),
+        "budget_tokens": budget_tokens,
+        "chunks_used": len(chosen),
+        "chunks_partial": partial,
+        "chunks_total": len(texts),
+    }
+    logger.debug(f"📦 Контекст: {result['tokens_used']}/{budget_tokens} токенов, "
+                 f"чанков {len(chosen)}+{partial} из {len(texts)}")
+    return result
+
+
+def pack_text(text: str, budget_tokens: int, method: str = CONTEXT_PACKING) -> Dict:
+    """Укладывает в бюджет уже собранный текст (контекст агента): чанки в исходном порядке важности."""
+    return pack_context(split_blocks(text), budget_tokens, method=method)
@@ -0,0 +1,91 @@
+import os
+import time
+import sqlite3
+import threading
+from functools import lru_cache
+from typing import List, Tuple
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+from src.config import CONVERSATION_DB_PATH
+
+_MESSAGE_TYPES = {"human": HumanMessage, "ai": AIMessage}
+
+
+class ConversationStore:
+    """
+    Память диалогов RAG-сессий на диске (SQLite), общая для всех пользователей.
+
+    Реплики только дописываются (turns). Бегущая сводка хранится отдельно вместе с
+    номером последней реплики, которая в неё уже свёрнута. Восстановление сессии —
+    сводка и реплики после этого номера: один запрос по индексу, без LLM. Поэтому
+    сессию можно вытеснить из памяти в любой момент, и перезапуск бота ничего не теряет.
+    """
+
+    def __init__(self, db_path: str = CONVERSATION_DB_PATH):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        # WAL: дописывание реплики не блокирует чтение при восстановлении других сессий
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS turns (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, "
+            "role TEXT NOT NULL, content TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS turns_user ON turns(user_id, id)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS summaries (user_id INTEGER PRIMARY KEY, summary TEXT NOT NULL, "
+            "summarized_upto INTEGER NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._db.commit()
+
+    def append(self, user_id: int, messages: List[BaseMessage]):
+        """Дописывает реплики; message.id становится номером записи (по нему отмечается свёрнутое в сводку)."""
+        now = time.time()
+        with self._lock:
+            for message in messages:
+                cursor = self._db.execute(
+                    "INSERT INTO turns (user_id, role, content, created_at) VALUES (?, ?, ?, ?)",
+                    (user_id, message.type, str(message.content), now)
+                )
+                message.id = str(cursor.lastrowid)
+            self._db.commit()
+
+    def save_summary(self, user_id: int, summary: str, summarized_upto: int):
+        """Сводка всех реплик пользователя до summarized_upto включительно."""
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO summaries (user_id, summary, summarized_upto, updated_at) VALUES (?, ?, ?, ?)",
+                (user_id, summary, summarized_upto, time.time())
+            )
+            self._db.commit()
+
+    def load(self, user_id: int) -> Tuple[str, List[BaseMessage]]:
+        """Сводка и реплики, ещё не свёрнутые в неё (в порядке диалога)."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT summary, summarized_upto FROM summaries WHERE user_id = ?", (user_id,)
+            ).fetchone()
+            summary, summarized_upto = row if row else ("", 0)
+            rows = self._db.execute(
+                "SELECT id, role, content FROM turns WHERE user_id = ? AND id > ? ORDER BY id",
+                (user_id, summarized_upto)
+            ).fetchall()
+        messages = [_MESSAGE_TYPES.get(role, HumanMessage)(content=content, id=str(turn_id))
+                    for turn_id, role, content in rows]
+        return summary, messages
+
+    def delete_user(self, user_id: int):
+        """Забывает диалог пользователя (сброс сессии, новый документ)."""
+        with self._lock:
+            self._db.execute("DELETE FROM turns WHERE user_id = ?", (user_id,))
+            self._db.execute("DELETE FROM summaries WHERE user_id = ?", (user_id,))
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+@lru_cache(maxsize=1)
+def get_conversation_store() -> ConversationStore:
+    return ConversationStore()
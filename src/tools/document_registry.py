@@ -0,0 +1,77 @@
+import os
+import sqlite3
+import hashlib
+import threading
+from functools import lru_cache
+from typing import Optional
+from src.config import VECTOR_DB_ROOT_PATH, DOCUMENT_REGISTRY_PATH
+
+
+def file_sha256(file_path: str) -> str:
+    """Хэш содержимого файла (читается блоками, без загрузки в память целиком)."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def get_document_db_path(digest: str) -> str:
+    """Путь к общей (content-addressed) базе документа."""
+    return os.path.join(VECTOR_DB_ROOT_PATH, "shared", digest)
+
+
+class DocumentRegistry:
+    """
+    Реестр «пользователь -> документ (sha256)».
+
+    Пользователь хранит только ссылку на общую базу документа. Число ссылок
+    на документ и есть его счётчик: когда он падает до нуля, базу можно удалять.
+    """
+
+    def __init__(self, db_path: str = DOCUMENT_REGISTRY_PATH):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS user_documents (user_id INTEGER PRIMARY KEY, digest TEXT NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS user_documents_digest ON user_documents(digest)")
+        self._db.commit()
+
+    def get_digest(self, user_id: int) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute("SELECT digest FROM user_documents WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0] if row else None
+
+    def refcount(self, digest: str) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM user_documents WHERE digest = ?", (digest,)).fetchone()[0]
+
+    def assign(self, user_id: int, digest: str) -> Optional[str]:
+        """
+        Переводит пользователя на документ digest.
+        Возвращает предыдущий документ, если на него больше никто не ссылается (его пора удалить).
+        """
+        with self._lock:
+            row = self._db.execute("SELECT digest FROM user_documents WHERE user_id = ?", (user_id,)).fetchone()
+            self._db.execute("INSERT OR REPLACE INTO user_documents (user_id, digest) VALUES (?, ?)", (user_id, digest))
+            self._db.commit()
+            return self._orphan(row[0] if row else None, digest)
+
+    def release(self, user_id: int) -> Optional[str]:
+        """Убирает ссылку пользователя. Возвращает документ, если он стал никому не нужен."""
+        with self._lock:
+            row = self._db.execute("SELECT digest FROM user_documents WHERE user_id = ?", (user_id,)).fetchone()
+            self._db.execute("DELETE FROM user_documents WHERE user_id = ?", (user_id,))
+            self._db.commit()
+            return self._orphan(row[0] if row else None)
+
+    def _orphan(self, digest: Optional[str], current: Optional[str] = None) -> Optional[str]:
+        if digest is None or digest == current:
+            return None
+        count = self._db.execute("SELECT COUNT(*) FROM user_documents WHERE digest = ?", (digest,)).fetchone()[0]
+        return digest if count == 0 else None
+
+
+@lru_cache(maxsize=1)
+def get_document_registry() -> DocumentRegistry:
+    return DocumentRegistry()
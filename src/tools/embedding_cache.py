@@ -0,0 +1,193 @@
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from functools import lru_cache
+from typing import List, Optional
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from src.config import EMBEDDING_MODEL, EMBEDDING_CACHE_DIR, EMBEDDING_CACHE_MAX_ENTRIES
+
+logger = logging.getLogger(__name__)
+
+
+def _text_key(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Дисковый кэш эмбеддингов, общий для всех пользователей.
+
+    Векторы лежат в массиве фиксированной ёмкости (memmap float32, строка = слот),
+    индекс «хэш текста -> слот» — в SQLite. Для каждой модели своя папка,
+    поэтому ключ фактически (модель, sha256 текста).
+    Когда слоты кончаются, вытесняются давно не использованные записи (LRU).
+    """
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL, cache_dir: str = EMBEDDING_CACHE_DIR,
+                 max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES):
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.cache_dir = os.path.join(cache_dir, model_name.replace("/", "__"))
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        self._vectors_path = os.path.join(self.cache_dir, "vectors.f32")
+        self._vectors: Optional[np.memmap] = None
+        self._lock = threading.Lock()
+
+        self._db = sqlite3.connect(os.path.join(self.cache_dir, "index.sqlite3"), check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, slot INTEGER NOT NULL UNIQUE, last_used REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries(last_used)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+        self._db.commit()
+
+        row = self._db.execute("SELECT value FROM meta WHERE name = 'dim'").fetchone()
+        self.dim: Optional[int] = int(row[0]) if row else None
+        if self.dim is not None:
+            self._open_vectors()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _open_vectors(self):
+        mode = "r+" if os.path.exists(self._vectors_path) else "w+"
+        self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode=mode,
+                                  shape=(self.max_entries, self.dim))
+
+    def get_many(self, texts: List[str], touch: bool = True) -> List[Optional[List[float]]]:
+        """
+        Возвращает векторы для текстов; None там, где в кэше промах.
+        touch=False — только чтение (пересчёт близости при поиске): не обновляет LRU
+        и не считается в hits/misses, которые меряют экономию на индексации.
+        """
+        keys = [_text_key(text) for text in texts]
+        with self._lock:
+            slots = self._lookup_slots(keys) if self._vectors is not None else {}
+
+            result = [self._vectors[slots[key]].tolist() if key in slots else None for key in keys]
+            if not touch:
+                return result
+
+            if slots:
+                now = time.time()
+                self._db.executemany("UPDATE entries SET last_used = ? WHERE key = ?",
+                                     [(now, key) for key in slots])
+                self._db.commit()
+
+            hits = sum(1 for key in keys if key in slots)
+            self.hits += hits
+            self.misses += len(keys) - hits
+        return result
+
+    def put_many(self, texts: List[str], vectors: List[List[float]]):
+        """Сохраняет векторы; при нехватке места вытесняет самые старые записи."""
+        if not texts:
+            return
+        with self._lock:
+            if self.dim is None:
+                self.dim = len(vectors[0])
+                self._db.execute("INSERT OR REPLACE INTO meta VALUES ('dim', ?)", (str(self.dim),))
+                self._open_vectors()
+
+            entries = {}
+            for text, vector in zip(texts, vectors):
+                entries[_text_key(text)] = vector
+            existing = self._lookup_slots(list(entries))
+            new_items = [(key, vector) for key, vector in entries.items() if key not in existing]
+            if not new_items:
+                return
+            new_items = new_items[-self.max_entries:]
+
+            slots = self._allocate_slots(len(new_items))
+            now = time.time()
+            for slot, (_, vector) in zip(slots, new_items):
+                self._vectors[slot] = vector
+            self._vectors.flush()
+            self._db.executemany("INSERT INTO entries (key, slot, last_used) VALUES (?, ?, ?)",
+                                 [(key, slot, now) for slot, (key, _) in zip(slots, new_items)])
+            self._db.commit()
+
+    def _lookup_slots(self, keys: List[str]) -> dict:
+        slots = {}
+        for start in range(0, len(keys), 500):  # Лимит параметров SQLite
+            part = keys[start:start + 500]
+            placeholders = ",".join("?" * len(part))
+            slots.update(self._db.execute(
+                f"SELECT key, slot FROM entries WHERE key IN ({placeholders})", part
+            ).fetchall())
+        return slots
+
+    def _allocate_slots(self, count: int) -> List[int]:
+        """Выдаёт свободные слоты, при необходимости освобождая LRU-записи."""
+        # Слоты занимаются подряд, а освободившиеся сразу переиспользуются,
+        # поэтому занятые слоты всегда 0..used-1
+        used = self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        free = list(range(used, min(used + count, self.max_entries)))
+
+        missing = count - len(free)
+        if missing > 0:
+            victims = self._db.execute(
+                "SELECT key, slot FROM entries ORDER BY last_used LIMIT ?", (missing,)
+            ).fetchall()
+            self._db.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key, _ in victims])
+            free.extend(slot for _, slot in victims)
+            self.evictions += len(victims)
+        return free
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def get_stats(self) -> dict:
+        return {
+            "entries": len(self),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hit_rate,
+        }
+
+
+class CachedEmbeddings(Embeddings):
+    """Обёртка над моделью: сначала ищет эмбеддинги чанков в кэше, модель считает только промахи."""
+
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingCache):
+        self.embeddings = embeddings
+        self.cache = cache
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = self.cache.get_many(texts)
+
+        # Одинаковые тексты внутри батча считаем один раз
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+        if missing:
+            computed = dict(zip(missing, self.embeddings.embed_documents(missing)))
+            self.cache.put_many(missing, [computed[text] for text in missing])
+            vectors = [vector if vector is not None else computed[text]
+                       for text, vector in zip(texts, vectors)]
+
+        logger.info(f"💾 Кэш эмбеддингов: {len(texts) - len(missing)}/{len(texts)} из кэша, "
+                    f"hit rate {self.cache.hit_rate:.0%}")
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
+
+
+@lru_cache(maxsize=None)
+def get_embedding_cache(model_name: str = EMBEDDING_MODEL) -> EmbeddingCache:
+    """Один экземпляр кэша на модель в процессе."""
+    return EmbeddingCache(model_name=model_name)
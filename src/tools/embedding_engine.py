@@ -0,0 +1,122 @@
+import os
+import time
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+from langchain_core.embeddings import Embeddings
+from src.config import (
+    EMBEDDING_MODEL, EMBEDDING_BATCH_SIZE, EMBEDDING_WORKERS, EMBEDDING_THREADS_PER_WORKER, EMBEDDING_BACKEND
+)
+
+logger = logging.getLogger(__name__)
+
+# Модель внутри процесса-воркера (у каждого процесса своя копия)
+_WORKER_EMBEDDINGS = None
+
+
+def _init_worker(model_name: str, batch_size: int, torch_threads: int, backend: str):
+    """Инициализатор процесса пула: фиксирует число потоков torch и загружает модель."""
+    global _WORKER_EMBEDDINGS
+    import torch
+    from src.tools.embeddings import create_embeddings
+
+    # Без этого каждый воркер займёт все ядра и они будут мешать друг другу
+    torch.set_num_threads(torch_threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass  # Уже задано в этом процессе
+
+    _WORKER_EMBEDDINGS = create_embeddings(model_name, backend=backend, batch_size=batch_size)
+
+
+def _embed_batch(texts: List[str]) -> List[List[float]]:
+    return _WORKER_EMBEDDINGS.embed_documents(texts)
+
+
+class ParallelEmbeddings(Embeddings):
+    """
+    Считает эмбеддинги чанков в пуле процессов.
+    Батчи распределяются между воркерами, каждому выделено своё число потоков torch.
+    Ведёт статистику пропускной способности (чанков в секунду).
+    """
+
+    def __init__(
+        self,
+        model_name: str = EMBEDDING_MODEL,
+        workers: int = EMBEDDING_WORKERS,
+        batch_size: int = EMBEDDING_BATCH_SIZE,
+        threads_per_worker: int = EMBEDDING_THREADS_PER_WORKER,
+        backend: str = EMBEDDING_BACKEND,
+    ):
+        self.model_name = model_name
+        self.backend = backend
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        # 0 = поделить ядра поровну между воркерами
+        self.threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // self.workers)
+
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self.total_chunks = 0
+        self.total_seconds = 0.0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """Пул создаётся при первом обращении: модели грузятся только если есть что считать."""
+        with self._lock:
+            if self._executor is None:
+                logger.info(f"🚀 Запуск пула эмбеддингов: {self.workers} процессов "
+                            f"x {self.threads_per_worker} потоков, batch_size={self.batch_size}")
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(self.model_name, self.batch_size, self.threads_per_worker, self.backend),
+                )
+            return self._executor
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+
+        start = time.perf_counter()
+        shards = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        vectors = []
+        for shard_vectors in self._get_executor().map(_embed_batch, shards):
+            vectors.extend(shard_vectors)
+        elapsed = time.perf_counter() - start
+
+        with self._lock:
+            self.total_chunks += len(texts)
+            self.total_seconds += elapsed
+        logger.info(f"⚡ Эмбеддинги: {len(texts)} чанков за {elapsed:.2f} с "
+                    f"({len(texts) / elapsed:.1f} чанков/с, всего {self.chunks_per_second:.1f} чанков/с)")
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._get_executor().submit(_embed_batch, [text]).result()[0]
+
+    @property
+    def chunks_per_second(self) -> float:
+        """Средняя пропускная способность за всё время работы."""
+        return self.total_chunks / self.total_seconds if self.total_seconds > 0 else 0.0
+
+    def get_stats(self) -> dict:
+        return {
+            "backend": self.backend,
+            "workers": self.workers,
+            "threads_per_worker": self.threads_per_worker,
+            "batch_size": self.batch_size,
+            "total_chunks": self.total_chunks,
+            "total_seconds": self.total_seconds,
+            "chunks_per_second": self.chunks_per_second,
+        }
+
+    def close(self):
+        """Останавливает процессы пула."""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
@@ -0,0 +1,212 @@
+import os
+import re
+import time
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Iterable, List
+from langchain_core.embeddings import Embeddings
+from langchain_community.embeddings import HuggingFaceEmbeddings
+from src.config import (
+    EMBEDDING_MODEL, EMBEDDING_BATCH_SIZE, EMBEDDING_BACKEND, EMBEDDING_EXPORT_DIR,
+    QUERY_EMBEDDING_CACHE_SIZE, INTERNAL_QUERIES
+)
+
+logger = logging.getLogger(__name__)
+
+# torch      — обычный PyTorch (eager)
+# torch-int8 — PyTorch с динамическим int8-квантованием Linear-слоёв
+# onnx       — ONNX Runtime (нужен optimum[onnxruntime]); экспорт модели сохраняется на диск
+EMBEDDING_BACKENDS = ("torch", "torch-int8", "onnx")
+
+
+def embedding_model_id(model_name: str = EMBEDDING_MODEL, backend: str = EMBEDDING_BACKEND) -> str:
+    """
+    Идентификатор модели с учётом бэкенда.
+    Векторы разных бэкендов немного отличаются, поэтому кэш эмбеддингов у них раздельный.
+    """
+    return model_name if backend == "torch" else f"{model_name}@{backend}"
+
+
+def _quantize_dynamic_int8(embeddings: HuggingFaceEmbeddings) -> HuggingFaceEmbeddings:
+    import torch
+    transformer = embeddings.client[0]
+    transformer.auto_model = torch.ao.quantization.quantize_dynamic(
+        transformer.auto_model, {torch.nn.Linear}, dtype=torch.qint8
+    )
+    return embeddings
+
+
+def _load_onnx(model_name: str, encode_kwargs: dict) -> HuggingFaceEmbeddings:
+    # Экспорт в ONNX занимает время, поэтому делается один раз и сохраняется
+    export_dir = os.path.join(EMBEDDING_EXPORT_DIR, model_name.replace("/", "__") + "-onnx")
+    exported = os.path.exists(export_dir)
+    embeddings = HuggingFaceEmbeddings(
+        model_name=export_dir if exported else model_name,
+        model_kwargs={"backend": "onnx"},
+        encode_kwargs=encode_kwargs
+    )
+    if not exported:
+        embeddings.client.save(export_dir)
+        logger.info(f"💾 ONNX-экспорт модели сохранён в {export_dir}")
+    return embeddings
+
+
+def create_embeddings(model_name: str = EMBEDDING_MODEL, backend: str = EMBEDDING_BACKEND,
+                      batch_size: int = EMBEDDING_BATCH_SIZE) -> HuggingFaceEmbeddings:
+    """Загружает модель эмбеддингов на выбранном бэкенде (интерфейс у всех одинаковый)."""
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Неизвестный бэкенд эмбеддингов: {backend}. Доступны: {', '.join(EMBEDDING_BACKENDS)}")
+
+    encode_kwargs = {"batch_size": batch_size}
+    if backend == "onnx":
+        embeddings = _load_onnx(model_name, encode_kwargs)
+    else:
+        embeddings = HuggingFaceEmbeddings(model_name=model_name, encode_kwargs=encode_kwargs)
+        if backend == "torch-int8":
+            embeddings = _quantize_dynamic_int8(embeddings)
+
+    logger.info(f"🧠 Модель эмбеддингов {model_name} загружена (бэкенд: {backend})")
+    return embeddings
+
+
+@lru_cache(maxsize=None)
+def get_embeddings(model_name: str = EMBEDDING_MODEL) -> HuggingFaceEmbeddings:
+    """
+    Общая на весь процесс модель эмбеддингов. Индексатор, RAGLoader и оценщики
+    берут её отсюда, поэтому в памяти одна копия модели.
+    """
+    return create_embeddings(model_name)
+
+
+def normalize_whitespace(text: str) -> str:
+    """Unicode NFKC и одиночные пробелы: на вектор модели это не влияет."""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", text)).strip()
+
+
+def normalize_query(text: str) -> str:
+    """Ключ кэша результатов поиска: как normalize_whitespace, но без регистра."""
+    return normalize_whitespace(text).casefold()
+
+
+class QueryCachedEmbeddings(Embeddings):
+    """
+    LRU-кэш эмбеддингов запросов поверх модели, общий для всех пользователей.
+    Ключ и текст для модели — запрос после normalize_whitespace: регистр и
+    пунктуация сохраняются (у модели с регистром от них зависит вектор имён и
+    формул), поэтому кэш не меняет результаты поиска. Эмбеддинги чанков не кэшируются.
+    """
+
+    def __init__(self, embeddings: Embeddings, max_size: int = QUERY_EMBEDDING_CACHE_SIZE):
+        self.embeddings = embeddings
+        self.max_size = max_size
+        self._cache: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        key = normalize_whitespace(text)
+        with self._lock:
+            vector = self._cache.get(key)
+            if vector is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return vector
+            self.misses += 1
+
+        vector = self.embeddings.embed_query(key)
+        self._store(key, vector)
+        return vector
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """
+        Эмбеддинги нескольких запросов: промахи кэша считаются одним батчем
+        (один прямой проход модели вместо N вызовов embed_query).
+        """
+        keys = [normalize_whitespace(text) for text in texts]
+        vectors = {}
+        with self._lock:
+            for key in keys:
+                vector = self._cache.get(key)
+                if vector is not None:
+                    self._cache.move_to_end(key)
+                    vectors[key] = vector
+                    self.hits += 1
+                else:
+                    self.misses += 1
+
+        missing = [key for key in dict.fromkeys(keys) if key not in vectors]
+        if missing:
+            for key, vector in zip(missing, self.embeddings.embed_documents(missing)):
+                vectors[key] = vector
+                self._store(key, vector)
+        return [vectors[key] for key in keys]
+
+    def prefill(self, queries: Iterable[str]):
+        """Заранее считает эмбеддинги запросов (например, внутренних при старте)."""
+        for key in dict.fromkeys(normalize_whitespace(q) for q in queries):
+            if key not in self._cache:
+                self._store(key, self.embeddings.embed_query(key))
+
+    def _store(self, key: str, vector: List[float]):
+        with self._lock:
+            self._cache[key] = vector
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+
+    def get_stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._cache),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+@lru_cache(maxsize=None)
+def get_query_embeddings(model_name: str = EMBEDDING_MODEL) -> QueryCachedEmbeddings:
+    """Общая модель с кэшем эмбеддингов запросов — для поиска (RAGLoader)."""
+    return QueryCachedEmbeddings(get_embeddings(model_name))
+
+
+def get_sentence_transformer(model_name: str = EMBEDDING_MODEL):
+    """SentenceTransformer общей модели (для кода, которому нужен .encode())."""
+    return get_embeddings(model_name).client
+
+
+def get_memory_stats(model_name: str = EMBEDDING_MODEL) -> dict:
+    """Память модели (веса) и всего процесса, МБ."""
+    import psutil
+    stats = {"process_rss_mb": psutil.Process().memory_info().rss / 1024 / 1024}
+    if get_embeddings.cache_info().currsize:
+        model = get_sentence_transformer(model_name)
+        weights = sum(p.numel() * p.element_size() for p in model.parameters())
+        weights += sum(b.numel() * b.element_size() for b in model.buffers())
+        stats["model_weights_mb"] = weights / 1024 / 1024
+    return stats
+
+
+def warm_up(model_name: str = EMBEDDING_MODEL) -> dict:
+    """
+    Загружает общую модель и прогоняет пробный запрос при старте,
+    чтобы первый запрос пользователя не ждал загрузки.
+    """
+    rss_before = get_memory_stats(model_name)["process_rss_mb"]
+    start_time = time.perf_counter()
+    # Прогрев заодно заполняет кэш внутренними запросами, которые повторяются в каждом сценарии
+    get_query_embeddings(model_name).prefill(INTERNAL_QUERIES)
+    stats = get_memory_stats(model_name)
+    stats["warm_up_seconds"] = time.perf_counter() - start_time
+    stats["model_rss_delta_mb"] = stats["process_rss_mb"] - rss_before
+    logger.info(f"🔥 Модель эмбеддингов прогрета за {stats['warm_up_seconds']:.1f} с, "
+                f"память процесса {stats['process_rss_mb']:.0f} МБ (+{stats['model_rss_delta_mb']:.0f} МБ)")
+    return stats
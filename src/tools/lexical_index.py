@@ -0,0 +1,114 @@
+import os
+import re
+import sqlite3
+import logging
+import threading
+from typing import List, Tuple
+
+logger = logging.getLogger(__name__)
+
+LEXICAL_INDEX_FILE = "lexical.sqlite3"
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# Служебные и «вопросные» слова, которые есть почти в каждом запросе
+_STOPWORDS = {
+    "а", "в", "во", "и", "к", "о", "об", "с", "со", "у", "на", "по", "от", "до", "из", "за", "для",
+    "не", "ли", "же", "бы", "но", "или", "что", "как", "это", "то", "где", "когда", "такое",
+    "какой", "какая", "какие", "каков", "объясни", "расскажи", "найди", "покажи",
+}
+
+
+def _query_terms(query: str) -> List[str]:
+    """
+    Термы FTS5-запроса. Русские слова сильно изменяются по падежам, поэтому вместо
+    стемминга длинные слова ищутся по префиксу без окончания («ньютона» -> «ньюто*»).
+    Числа и короткие слова (номера задач, обозначения, «Ома») ищутся точно.
+    """
+    terms = []
+    for token in _TOKEN_RE.findall(query.lower()):
+        if token in _STOPWORDS:
+            continue
+        if token.isdigit() or len(token) <= 4:
+            terms.append(f'"{token}"')
+        else:
+            stem = token[:-2] if len(token) >= 7 else token[:-1]
+            terms.append(f'"{stem}"*')
+    return list(dict.fromkeys(terms))
+
+
+class LexicalIndex:
+    """
+    Инвертированный индекс чанков документа (SQLite FTS5, ранжирование BM25).
+    Лежит рядом с векторной базой в той же папке и обновляется вместе с ней.
+    """
+
+    def __init__(self, persist_directory: str):
+        self.path = os.path.join(persist_directory, LEXICAL_INDEX_FILE)
+        os.makedirs(persist_directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        # detail=column: без позиций слов — индекс компактнее, BM25 и префиксы работают
+        self._db.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS chunks USING fts5("
+            "id UNINDEXED, text, tokenize='unicode61 remove_diacritics 2', detail=column)"
+        )
+        self._db.commit()
+
+    @staticmethod
+    def exists(persist_directory: str) -> bool:
+        return os.path.exists(os.path.join(persist_directory, LEXICAL_INDEX_FILE))
+
+    def add(self, ids: List[str], texts: List[str]):
+        with self._lock:
+            self._db.executemany("INSERT INTO chunks (id, text) VALUES (?, ?)", zip(ids, texts))
+            self._db.commit()
+
+    def delete(self, ids: List[str]):
+        with self._lock:
+            self._db.executemany("DELETE FROM chunks WHERE id = ?", [(chunk_id,) for chunk_id in ids])
+            self._db.commit()
+
+    def search(self, query: str, k: int) -> List[Tuple[str, float]]:
+        """(id чанка, BM25) лучших k совпадений; чем больше скор, тем лучше."""
+        terms = _query_terms(query)
+        if not terms:
+            return []
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, bm25(chunks) FROM chunks WHERE chunks MATCH ? ORDER BY bm25(chunks) LIMIT ?",
+                (" OR ".join(terms), k)
+            ).fetchall()
+        # SQLite возвращает BM25 со знаком минус
+        return [(chunk_id, -score) for chunk_id, score in rows]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def build_lexical_index(persist_directory: str, vectorstore) -> LexicalIndex:
+    """
+    Строит индекс по чанкам уже готовой векторной базы (для баз, созданных до гибридного поиска).
+    Пишется во временный файл и подменяется атомарно, чтобы параллельные запросы не увидели половину.
+    """
+    data = vectorstore.get(include=["documents"])
+    tmp_dir = os.path.join(persist_directory, f".lexical-{os.getpid()}-{threading.get_ident()}")
+    index = LexicalIndex(tmp_dir)
+    index.add(data["ids"], data["documents"])
+    index.close()
+    os.replace(os.path.join(tmp_dir, LEXICAL_INDEX_FILE), os.path.join(persist_directory, LEXICAL_INDEX_FILE))
+    os.rmdir(tmp_dir)
+    return LexicalIndex(persist_directory)
+
+
+def open_lexical_index(persist_directory: str, vectorstore) -> LexicalIndex:
+    """Индекс документа; для баз без индекса он один раз строится по их чанкам."""
+    if LexicalIndex.exists(persist_directory):
+        return LexicalIndex(persist_directory)
+    logger.info(f"🔤 Строю лексический индекс для {persist_directory}")
+    return build_lexical_index(persist_directory, vectorstore)
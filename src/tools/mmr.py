@@ -0,0 +1,111 @@
+import hashlib
+from typing import Any, List
+import numpy as np
+from pydantic import ConfigDict
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.vectorstores import VectorStore
+from src.config import RETRIEVER_K, MMR_FETCH_K, MMR_LAMBDA
+
+
+def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-12)
+
+
+def _min_max(scores: List[float]) -> np.ndarray:
+    scores = np.asarray(scores, dtype=np.float32)
+    spread = scores.max() - scores.min()
+    return (scores - scores.min()) / spread if spread > 0 else np.ones(len(scores), dtype=np.float32)
+
+
+def upstream_relevance(docs: List[Document]) -> np.ndarray:
+    """
+    Релевантность кандидатов в [0, 1] по ранжированию базового ретривера, а не по
+    косинусу заново: так MMR сохраняет порядок RRF и кросс-энкодера.
+    Берётся rerank_score, иначе rrf_score (оба — min-max к [0, 1]); без оценок —
+    линейное убывание по месту 1 - rank / n. Обратный ранг 1 / (rank + 1) падает
+    слишком круто: дальние кандидаты не перевесили бы штраф за повтор.
+    """
+    for key in ("rerank_score", "rrf_score"):
+        scores = [doc.metadata.get(key) for doc in docs]
+        if docs and all(score is not None for score in scores):
+            return _min_max(scores)
+    return 1.0 - np.arange(len(docs), dtype=np.float32) / max(len(docs), 1)
+
+
+def maximal_marginal_relevance(relevance, candidate_vectors, k: int = RETRIEVER_K,
+                               lambda_mult: float = MMR_LAMBDA) -> List[int]:
+    """
+    Индексы k кандидатов по MMR: на каждом шаге берётся кандидат с максимальным
+    lambda * релевантность - (1 - lambda) * max сходство с уже выбранными.
+
+    relevance — оценки кандидатов от базового ретривера (upstream_relevance), векторы
+    нужны только для штрафа за повтор. Матрица сходств кандидатов считается одним
+    умножением, а максимум сходства с выбранными обновляется вектором за шаг, поэтому
+    выбор — O(k * n) без циклов Python по парам.
+    lambda_mult=1 — чистая релевантность, 0 — максимальное разнообразие.
+    """
+    candidates = _normalize_rows(np.asarray(candidate_vectors, dtype=np.float32))
+    n = len(candidates)
+    if n == 0 or k <= 0:
+        return []
+    relevance = np.asarray(relevance, dtype=np.float32)
+    similarity = candidates @ candidates.T
+
+    selected = [int(np.argmax(relevance))]
+    max_similarity = similarity[selected[0]].copy()
+    available = np.ones(n, dtype=bool)
+    available[selected[0]] = False
+    for _ in range(min(k, n) - 1):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * max_similarity
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        np.maximum(max_similarity, similarity[best], out=max_similarity)
+    return selected
+
+
+class MMRRetriever(BaseRetriever):
+    """
+    Убирает из выдачи почти дубликаты (соседние чанки с перекрытием CHUNK_OVERLAP):
+    берёт fetch_k кандидатов у базового ретривера и выбирает k по MMR.
+    Релевантность — оценки (rerank_score, rrf_score) или порядок базового ретривера, векторы кандидатов
+    читаются из базы (id чанка — sha256 текста) и идут только в штраф за повтор.
+    """
+
+    base_retriever: BaseRetriever
+    vectorstore: VectorStore
+    k: int = RETRIEVER_K
+    fetch_k: int = MMR_FETCH_K
+    lambda_mult: float = MMR_LAMBDA
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    def _candidate_vectors(self, docs: List[Document]) -> np.ndarray:
+        ids = [doc.id or hashlib.sha256(doc.page_content.encode("utf-8")).hexdigest() for doc in docs]
+        data = self.vectorstore.get(ids=ids, include=["embeddings"])
+        by_id = dict(zip(data["ids"], data["embeddings"]))
+        missing = [i for i, chunk_id in enumerate(ids) if chunk_id not in by_id]
+        if missing:
+            # Базы со случайными id чанков: векторы считаем заново
+            computed = self.vectorstore.embeddings.embed_documents([docs[i].page_content for i in missing])
+            by_id.update({ids[i]: vector for i, vector in zip(missing, computed)})
+        return np.asarray([by_id[chunk_id] for chunk_id in ids], dtype=np.float32)
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun,
+                                **kwargs: Any) -> List[Document]:
+        k = kwargs.get("k", self.k)
+        lambda_mult = kwargs.get("lambda_mult", self.lambda_mult)
+        fetch_k = max(kwargs.get("fetch_k", self.fetch_k), k)
+        if lambda_mult >= 1:
+            return self.base_retriever.invoke(query, k=k, config={"callbacks": run_manager.get_child()})
+
+        candidates = self.base_retriever.invoke(query, k=fetch_k, config={"callbacks": run_manager.get_child()})
+        if len(candidates) <= 1:
+            return candidates[:k]
+        order = maximal_marginal_relevance(upstream_relevance(candidates), self._candidate_vectors(candidates),
+                                           k, lambda_mult)
+        return [candidates[i] for i in order]
+
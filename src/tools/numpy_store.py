@@ -0,0 +1,483 @@
+import os
+import json
+import bisect
+import logging
+import weakref
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+from src.config import EMBEDDING_MODEL, EMBEDDING_CACHE_ENABLED, QUANTIZED_RESCORE, QUANTIZED_RESCORE_FETCH_K
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = "numpy_store.json"
+VECTORS_FILE = "vectors.npy"
+SCALES_FILE = "scales.npy"
+RECORDS_FILE = "records.jsonl"
+# Новые строки до persist() дописываются в эти файлы рядом с базой (сырые байты и jsonl)
+APPEND_VECTORS_FILE = "vectors.append"
+APPEND_SCALES_FILE = "scales.append"
+APPEND_RECORDS_FILE = "records.append.jsonl"
+PERSIST_BLOCK_ROWS = 4096  # Строк за раз при переписывании матрицы в persist()
+
+QUANTIZATIONS = ("float32", "float16", "int8")
+_DTYPES = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _save_npy(path: str, array: np.ndarray):
+    # Через файловый объект: np.save(path) дописал бы к временному имени ".npy"
+    with open(path, "wb") as f:
+        np.save(f, array)
+
+
+def quantize(vectors: np.ndarray, quantization: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    Квантует нормированные векторы.
+    int8: скалярное квантование с отдельным масштабом на каждый вектор (max|x| -> 127).
+    float16: просто половинная точность, масштаб не нужен. float32: без квантования.
+    """
+    if quantization == "float32":
+        return vectors.astype(np.float32), None
+    if quantization == "float16":
+        return vectors.astype(np.float16), None
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales = np.maximum(scales, 1e-12).astype(np.float32)
+    codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales
+
+
+
+_shared_stores: "weakref.WeakValueDictionary[tuple, NumpyVectorStore]" = weakref.WeakValueDictionary()
+_shared_lock = threading.Lock()
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    Векторное хранилище одного документа в .npy файлах, поиск полным перебором.
+
+    Для типичного конспекта (сотни — тысячи чанков) одно матричное умножение
+    быстрее, чем открытие клиента Chroma/SQLite. Векторы хранятся нормированными
+    (float32, float16 или int8 + масштаб на вектор) и при открытии отображаются
+    в память (mmap), тексты и метаданные — в records.jsonl. В памяти держатся
+    только id и смещения записей: текст чанка читается с диска, когда он попал
+    в выдачу. Поиск — косинусная близость прямо по матрице; для квантованных
+    векторов при rescore лучшие кандидаты пересчитываются в полной точности
+    (векторы берутся из кэша эмбеддингов).
+
+    Индексация не держит документ в памяти: новые векторы и записи дописываются
+    в файлы *.append, удаления помечаются, а persist() потоково собирает итоговые
+    файлы блоками по PERSIST_BLOCK_ROWS строк.
+
+    Для индексации поддерживает то же подмножество API, что и Chroma:
+    get(include=[]) / add_documents(ids=...) / delete(ids=...).
+    """
+
+    def __init__(self, persist_directory: str, embedding_function: Embeddings,
+                 quantization: Optional[str] = None, rescore: bool = QUANTIZED_RESCORE):
+        self.persist_directory = persist_directory
+        self._embedding_function = embedding_function
+        self.rescore = rescore
+        self._lock = threading.Lock()
+
+        manifest = self._read_manifest(persist_directory)
+        # Для существующего хранилища тип квантования задан на диске
+        self.quantization = manifest["quantization"] if manifest else (quantization or "float32")
+        if self.quantization not in QUANTIZATIONS:
+            raise ValueError(f"Неизвестный тип квантования: {self.quantization}")
+        self._dtype = _DTYPES[self.quantization]
+        self._reset()
+        if manifest:
+            self._load()
+
+    @classmethod
+    def open_shared(cls, persist_directory: str, embedding_function: Embeddings) -> "NumpyVectorStore":
+        """
+        Хранилище готовой базы только для чтения, одно на папку документа для всех сессий:
+        id и смещения записей загружаются один раз, матрица отображена в память один раз.
+        Живёт, пока его держит хотя бы одна сессия.
+        """
+        manifest_path = os.path.join(persist_directory, MANIFEST_FILE)
+        # Время манифеста в ключе: пересобранная база в той же папке откроется заново
+        key = (os.path.abspath(persist_directory), os.stat(manifest_path).st_mtime_ns)
+        with _shared_lock:
+            store = _shared_stores.get(key)
+            if store is None:
+                store = cls(persist_directory, embedding_function)
+                _shared_stores[key] = store
+            return store
+
+    def _reset(self):
+        self._ids: List[str] = []  # Строка -> id (удалённые строки остаются до persist)
+        self._rows: Dict[str, int] = {}  # id -> строка живых чанков
+        self._deleted: Set[int] = set()
+        self._dim: Optional[int] = None
+        self._base_count = 0
+        self._base_vectors: Optional[np.ndarray] = None
+        self._base_scales: Optional[np.ndarray] = None
+        self._base_offsets = np.zeros(1, dtype=np.int64)
+        self._records_fd: Optional[int] = None
+        self._append_fds: Optional[Dict[str, int]] = None
+        self._append_count = 0
+        self._append_offsets: List[int] = [0]
+
+    @staticmethod
+    def _read_manifest(persist_directory: str) -> Optional[dict]:
+        path = os.path.join(persist_directory, MANIFEST_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    @staticmethod
+    def exists(persist_directory: str) -> bool:
+        """Лежит ли в папке NumpyVectorStore (а не Chroma)."""
+        return os.path.exists(os.path.join(persist_directory, MANIFEST_FILE))
+
+    @property
+    def embeddings(self) -> Optional[Embeddings]:
+        return self._embedding_function
+
+    @property
+    def bytes_per_vector(self) -> int:
+        """Байт на вектор в матрице (с масштабом int8)."""
+        dim = self._dim or 0
+        return np.dtype(self._dtype).itemsize * dim + (4 if self.quantization == "int8" else 0)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.persist_directory, name)
+
+    def _load(self):
+        # mmap: матрица не читается в память целиком, страницы подгружает ОС
+        self._base_vectors = np.load(self._path(VECTORS_FILE), mmap_mode="r")
+        if self.quantization == "int8":
+            self._base_scales = np.load(self._path(SCALES_FILE), mmap_mode="r")
+        offsets = [0]
+        with open(self._path(RECORDS_FILE), "rb") as f:
+            for line in f:
+                self._ids.append(json.loads(line)["id"])
+                offsets.append(offsets[-1] + len(line))
+        self._rows = {chunk_id: row for row, chunk_id in enumerate(self._ids)}
+        self._base_offsets = np.asarray(offsets, dtype=np.int64)
+        self._base_count = len(self._ids)
+        self._records_fd = os.open(self._path(RECORDS_FILE), os.O_RDONLY)
+        if self._base_vectors.ndim == 2 and self._base_count:
+            self._dim = self._base_vectors.shape[1]
+
+    def _close_files(self):
+        if self._records_fd is not None:
+            os.close(self._records_fd)
+        for fd in (self._append_fds or {}).values():
+            os.close(fd)
+        self._records_fd, self._append_fds = None, None
+
+    def close(self):
+        with self._lock:
+            self._close_files()
+
+    def __del__(self):
+        try:
+            self._close_files()
+        except Exception:
+            pass
+
+    def _open_append(self):
+        os.makedirs(self.persist_directory, exist_ok=True)
+        flags = os.O_RDWR | os.O_CREAT | os.O_TRUNC | os.O_APPEND
+        names = [APPEND_VECTORS_FILE, APPEND_RECORDS_FILE] + ([APPEND_SCALES_FILE] if self.quantization == "int8" else [])
+        self._append_fds = {name: os.open(self._path(name), flags) for name in names}
+
+    def _remove_append_files(self):
+        for name in (APPEND_VECTORS_FILE, APPEND_SCALES_FILE, APPEND_RECORDS_FILE):
+            if os.path.exists(self._path(name)):
+                os.remove(self._path(name))
+
+    def _appended(self, name: str, dtype, shape) -> np.ndarray:
+        """Дописанные до persist() строки как memmap (пусто, если строк нет)."""
+        if not self._append_count:
+            return np.zeros((0,) + shape[1:], dtype=dtype)
+        return np.memmap(self._path(name), dtype=dtype, mode="r", shape=shape)
+
+    def _raw_rows(self, rows: List[int]) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """Квантованные векторы и масштабы строк (rows по возрастанию)."""
+        split = bisect.bisect_left(rows, self._base_count)
+        base_rows, extra_rows = rows[:split], [row - self._base_count for row in rows[split:]]
+        dim = self._dim or 0
+        parts = []
+        if base_rows:
+            parts.append(np.asarray(self._base_vectors[base_rows]))
+        if extra_rows:
+            parts.append(np.asarray(self._appended(APPEND_VECTORS_FILE, self._dtype, (self._append_count, dim))[extra_rows]))
+        vectors = np.concatenate(parts) if parts else np.zeros((0, dim), dtype=self._dtype)
+        if self.quantization != "int8":
+            return vectors, None
+        parts = []
+        if base_rows:
+            parts.append(np.asarray(self._base_scales[base_rows]))
+        if extra_rows:
+            parts.append(np.asarray(self._appended(APPEND_SCALES_FILE, np.float32, (self._append_count,))[extra_rows]))
+        return vectors, np.concatenate(parts) if parts else np.zeros(0, dtype=np.float32)
+
+    def _row_vectors(self, rows: List[int]) -> np.ndarray:
+        """Векторы строк в float32 с учётом масштаба int8 (rows по возрастанию)."""
+        codes, scales = self._raw_rows(rows)
+        vectors = codes.astype(np.float32)
+        if scales is not None:
+            vectors *= scales[:, None]
+        return vectors
+
+    def _record_bytes(self, row: int) -> bytes:
+        if row < self._base_count:
+            start, end = self._base_offsets[row], self._base_offsets[row + 1]
+            return os.pread(self._records_fd, int(end - start), int(start))
+        j = row - self._base_count
+        start, end = self._append_offsets[j], self._append_offsets[j + 1]
+        return os.pread(self._append_fds[APPEND_RECORDS_FILE], end - start, start)
+
+    def _record(self, row: int) -> dict:
+        return json.loads(self._record_bytes(row))
+
+    def _live_rows(self) -> List[int]:
+        return sorted(self._rows.values())
+
+    def _replace_file(self, name: str, write):
+        # Новый файл подменяет старый атомарно: открытые mmap старой версии остаются валидными
+        path = self._path(name)
+        tmp_path = f"{path}.tmp"
+        write(tmp_path)
+        os.replace(tmp_path, path)
+
+    def persist(self):
+        """Записывает хранилище на диск (после индексации) блоками, без загрузки всей базы в память."""
+        with self._lock:
+            os.makedirs(self.persist_directory, exist_ok=True)
+            rows = self._live_rows()
+            dim = self._dim or 0
+
+            def write_matrix(path, dtype, shape, read_block):
+                if not shape[0]:
+                    _save_npy(path, np.zeros(shape, dtype=dtype))
+                    return
+                out = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=shape)
+                for start in range(0, len(rows), PERSIST_BLOCK_ROWS):
+                    block = rows[start:start + PERSIST_BLOCK_ROWS]
+                    out[start:start + len(block)] = read_block(block)
+                out.flush()
+                del out
+
+            self._replace_file(VECTORS_FILE, lambda path: write_matrix(
+                path, self._dtype, (len(rows), dim), lambda block: self._raw_rows(block)[0]))
+            if self.quantization == "int8":
+                self._replace_file(SCALES_FILE, lambda path: write_matrix(
+                    path, np.float32, (len(rows),), lambda block: self._raw_rows(block)[1]))
+
+            def write_records(path):
+                with open(path, "wb") as f:
+                    for row in rows:
+                        f.write(self._record_bytes(row))
+            self._replace_file(RECORDS_FILE, write_records)
+
+            # Манифест пишется последним: без него папка не считается хранилищем
+            def write_manifest(path):
+                with open(path, "w", encoding="utf-8") as f:
+                    json.dump({"quantization": self.quantization, "count": len(rows),
+                               "model": EMBEDDING_MODEL}, f)
+            self._replace_file(MANIFEST_FILE, write_manifest)
+
+            # Дальше работаем с записанными файлами
+            self._close_files()
+            self._remove_append_files()
+            self._reset()
+            self._load()
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    # --- Запись ---
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None,
+                  ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        texts = list(texts)
+        vectors = self._embedding_function.embed_documents(texts)
+        return self.add_vectors(texts, vectors, metadatas, ids)
+
+    def add_vectors(self, texts: List[str], vectors: List[List[float]],
+                    metadatas: Optional[List[dict]] = None, ids: Optional[List[str]] = None) -> List[str]:
+        """Добавляет готовые векторы (без вызова модели): дописывает их в файлы *.append."""
+        if ids is None:
+            raise ValueError("NumpyVectorStore требует явные ids (хэши чанков)")
+        if not ids:
+            return []
+        metadatas = metadatas or [{} for _ in texts]
+        codes, scales = quantize(_normalize(np.asarray(vectors, dtype=np.float32)), self.quantization)
+        with self._lock:
+            self._append_rows(ids, texts, metadatas, codes, scales)
+        return list(ids)
+
+    def update_metadatas(self, ids: List[str], metadatas: List[dict]):
+        """
+        Заменяет метаданные существующих чанков, вектор остаётся прежним (модель не вызывается).
+        Строка дописывается заново с теми же квантованными кодами, старая помечается удалённой.
+        """
+        with self._lock:
+            pairs = sorted((self._rows[chunk_id], chunk_id, metadata)
+                           for chunk_id, metadata in zip(ids, metadatas) if chunk_id in self._rows)
+            if not pairs:
+                return
+            rows, ids, metadatas = (list(column) for column in zip(*pairs))
+            codes, scales = self._raw_rows(rows)
+            texts = [self._record(row)["text"] for row in rows]
+            self._append_rows(ids, texts, metadatas, codes, scales)
+
+    def _append_rows(self, ids: List[str], texts: List[str], metadatas: List[dict],
+                     codes: np.ndarray, scales: Optional[np.ndarray]):
+        """Дописывает квантованные строки и записи в файлы *.append (под self._lock)."""
+        records = [
+            (json.dumps({"id": chunk_id, "text": text, "metadata": metadata}, ensure_ascii=False) + "\n").encode("utf-8")
+            for chunk_id, text, metadata in zip(ids, texts, metadatas)
+        ]
+        if self._append_fds is None:
+            self._open_append()
+        if self._dim is None:
+            self._dim = codes.shape[1]
+        os.write(self._append_fds[APPEND_VECTORS_FILE], np.ascontiguousarray(codes).tobytes())
+        if scales is not None:
+            os.write(self._append_fds[APPEND_SCALES_FILE], np.ascontiguousarray(scales, dtype=np.float32).tobytes())
+        os.write(self._append_fds[APPEND_RECORDS_FILE], b"".join(records))
+        for chunk_id, record in zip(ids, records):
+            self._append_offsets.append(self._append_offsets[-1] + len(record))
+            previous = self._rows.get(chunk_id)
+            if previous is not None:
+                self._deleted.add(previous)  # Повторный id заменяет прежнюю запись
+            self._rows[chunk_id] = len(self._ids)
+            self._ids.append(chunk_id)
+        self._append_count += len(ids)
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        """Помечает строки удалёнными; из файлов они уходят при persist()."""
+        if not ids:
+            return None
+        with self._lock:
+            if not self._rows:
+                return None
+            for chunk_id in ids:
+                row = self._rows.pop(chunk_id, None)
+                if row is not None:
+                    self._deleted.add(row)
+        return True
+
+    def get(self, ids: Optional[List[str]] = None, include: Optional[List[str]] = None, **kwargs: Any) -> dict:
+        """Chroma-совместимый get: всегда ids, плюс documents/metadatas/embeddings по include."""
+        include = ["metadatas", "documents"] if include is None else include
+        with self._lock:
+            if ids is None:
+                rows = self._live_rows()
+            else:
+                rows = sorted({self._rows[chunk_id] for chunk_id in ids if chunk_id in self._rows})
+            result = {"ids": [self._ids[row] for row in rows]}
+            if "documents" in include or "metadatas" in include:
+                records = [self._record(row) for row in rows]
+                if "documents" in include:
+                    result["documents"] = [record["text"] for record in records]
+                if "metadatas" in include:
+                    result["metadatas"] = [record["metadata"] for record in records]
+            if "embeddings" in include:
+                # Читаются только нужные строки memmap, в float32 с учётом масштаба int8
+                result["embeddings"] = self._row_vectors(rows) if rows else np.zeros((0, 0), np.float32)
+        return result
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None,
+                   ids: Optional[List[str]] = None, persist_directory: str = "", **kwargs: Any) -> "NumpyVectorStore":
+        store = cls(persist_directory, embedding, **kwargs)
+        store.add_texts(texts, metadatas, ids)
+        store.persist()
+        return store
+
+    # --- Поиск ---
+
+    def _matrix_scores(self, vectors: np.ndarray, scales: Optional[np.ndarray], query: np.ndarray) -> np.ndarray:
+        if not len(vectors):
+            return np.zeros(0, dtype=np.float32)
+        if self.quantization == "float32":
+            return np.asarray(vectors) @ query
+        scores = vectors.astype(np.float32) @ query
+        if scales is not None:
+            scores *= scales
+        return scores
+
+    def _dequantized_scores(self, query: np.ndarray) -> np.ndarray:
+        """Косинусная близость запроса ко всем строкам (удалённые — -inf): матричные умножения."""
+        scores = self._matrix_scores(self._base_vectors[:self._base_count] if self._base_count else np.zeros((0, 0)),
+                                     self._base_scales, query)
+        if self._append_count:
+            dim = self._dim or 0
+            appended = self._appended(APPEND_VECTORS_FILE, self._dtype, (self._append_count, dim))
+            appended_scales = (self._appended(APPEND_SCALES_FILE, np.float32, (self._append_count,))
+                               if self.quantization == "int8" else None)
+            scores = np.concatenate([scores, self._matrix_scores(appended, appended_scales, query)])
+        if self._deleted:
+            scores[list(self._deleted)] = -np.inf
+        return scores
+
+    def _full_precision_vectors(self, texts: List[str]) -> np.ndarray:
+        """
+        Векторы float32 для пересчёта: из кэша эмбеддингов (только чтение), промахи — через модель.
+        Вызывается без self._lock: хранилище общее для всех сессий документа.
+        """
+        vectors = [None] * len(texts)
+        if EMBEDDING_CACHE_ENABLED:
+            from src.tools.embedding_cache import get_embedding_cache
+            from src.tools.embeddings import embedding_model_id
+            vectors = get_embedding_cache(embedding_model_id()).get_many(texts, touch=False)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            computed = self._embedding_function.embed_documents([texts[i] for i in missing])
+            for i, vector in zip(missing, computed):
+                vectors[i] = vector
+        return _normalize(np.asarray(vectors, dtype=np.float32))
+
+    def similarity_search_by_vector_with_score(self, embedding: List[float], k: int = 4,
+                                               rescore: Optional[bool] = None) -> List[Tuple[Document, float]]:
+        rescore = (self.rescore if rescore is None else rescore) and self.quantization != "float32"
+        query = _normalize(np.asarray([embedding], dtype=np.float32))[0]
+        # Под блокировкой только перебор матрицы и чтение записей кандидатов
+        with self._lock:
+            if not self._rows:
+                return []
+            scores = self._dequantized_scores(query)
+
+            fetch_k = min(len(self._rows), max(k, QUANTIZED_RESCORE_FETCH_K) if rescore else k)
+            top = np.argpartition(-scores, fetch_k - 1)[:fetch_k]
+            top = top[np.argsort(-scores[top])]
+            records = [self._record(row) for row in top.tolist()]
+            top_scores = scores[top]
+
+        if rescore:
+            # Кэш эмбеддингов (SQLite) и модель — уже без блокировки хранилища
+            exact = self._full_precision_vectors([record["text"] for record in records]) @ query
+            order = np.argsort(-exact)[:k]
+            records, top_scores = [records[i] for i in order.tolist()], exact[order]
+
+        return [(Document(page_content=record["text"], metadata=record["metadata"], id=record["id"]), float(score))
+                for record, score in zip(records, top_scores.tolist())]
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k, **kwargs)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_score(self._embedding_function.embed_query(query), k, **kwargs)
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, **kwargs)]
+
+    def _select_relevance_score_fn(self):
+        # Скоры — уже косинусная близость
+        return lambda score: score
@@ -0,0 +1,110 @@
+import os
+import json
+import sqlite3
+import hashlib
+import threading
+from typing import Any, Dict, List
+from pydantic import ConfigDict
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from src.config import RETRIEVER_K, PARENT_CHILD_FETCH_K
+
+PARENT_STORE_FILE = "parents.sqlite3"
+
+
+class ParentStore:
+    """
+    Родительские фрагменты документа (страница или её раздел) и связь «чанк -> родитель».
+
+    В векторной базе и лексическом индексе лежат только маленькие дочерние чанки;
+    в промпт вместо них идёт родитель — целый фрагмент страницы с контекстом вокруг
+    найденного места. Лежит в папке документа рядом с векторной базой.
+    """
+
+    def __init__(self, persist_directory: str):
+        self.path = os.path.join(persist_directory, PARENT_STORE_FILE)
+        os.makedirs(persist_directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS parents (id TEXT PRIMARY KEY, text TEXT, metadata TEXT)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS children (child_id TEXT PRIMARY KEY, parent_id TEXT)")
+        self._db.commit()
+
+    @staticmethod
+    def exists(persist_directory: str) -> bool:
+        return os.path.exists(os.path.join(persist_directory, PARENT_STORE_FILE))
+
+    def clear(self):
+        """Связи пересобираются при каждой индексации целиком: они дешёвые, эмбеддинги не нужны."""
+        with self._lock:
+            self._db.execute("DELETE FROM parents")
+            self._db.execute("DELETE FROM children")
+            self._db.commit()
+
+    def add(self, parent_id: str, text: str, metadata: dict, child_ids: List[str]):
+        # Одинаковый текст чанка на разных страницах: чанк хранится один раз и ведёт к первому родителю
+        with self._lock:
+            self._db.execute("INSERT OR IGNORE INTO parents (id, text, metadata) VALUES (?, ?, ?)",
+                             (parent_id, text, json.dumps(metadata, ensure_ascii=False)))
+            self._db.executemany("INSERT OR IGNORE INTO children (child_id, parent_id) VALUES (?, ?)",
+                                 [(child_id, parent_id) for child_id in child_ids])
+            self._db.commit()
+
+    def get_parents(self, child_ids: List[str]) -> Dict[str, Document]:
+        """Родитель каждого из child_ids (чанки без родителя в результат не попадают)."""
+        if not child_ids:
+            return {}
+        placeholders = ",".join("?" * len(child_ids))
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT c.child_id, p.id, p.text, p.metadata FROM children c "
+                f"JOIN parents p ON p.id = c.parent_id WHERE c.child_id IN ({placeholders})",
+                list(child_ids)
+            ).fetchall()
+        return {
+            child_id: Document(page_content=text, metadata=json.loads(metadata), id=parent_id)
+            for child_id, parent_id, text, metadata in rows
+        }
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM parents").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class ParentRetriever(BaseRetriever):
+    """
+    Ищет по дочерним чанкам (точное совпадение), а возвращает их родителей (полный контекст).
+    Если несколько чанков из одного фрагмента страницы, родитель берётся один раз.
+    """
+
+    base_retriever: BaseRetriever
+    parent_store: ParentStore
+    k: int = RETRIEVER_K
+    child_fetch_k: int = PARENT_CHILD_FETCH_K
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun,
+                                **kwargs: Any) -> List[Document]:
+        k = kwargs.pop("k", self.k)
+        children = self.base_retriever.invoke(query, k=max(self.child_fetch_k, k),
+                                              config={"callbacks": run_manager.get_child()}, **kwargs)
+        child_ids = [doc.id or hashlib.sha256(doc.page_content.encode("utf-8")).hexdigest() for doc in children]
+        parents = self.parent_store.get_parents(child_ids)
+
+        result, seen = [], set()
+        for child, child_id in zip(children, child_ids):
+            parent = parents.get(child_id, child)  # Чанк без родителя отдаём как есть
+            key = parent.id or child_id
+            if key in seen:
+                continue
+            seen.add(key)
+            result.append(parent)
+            if len(result) >= k:
+                break
+        return result
@@ -0,0 +1,92 @@
+import os
+import logging
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Callable, Iterator, List, Tuple
+from langchain_core.documents import Document
+from src.config import PDF_EXTRACTION_WORKERS, PDF_EXTRACTION_SHARD_PAGES
+
+logger = logging.getLogger(__name__)
+
+# Функция шарда: (путь к PDF, первая страница, последняя страница + 1) -> результаты по страницам
+RangeExtractor = Callable[[str, int, int], list]
+
+
+def count_pages(pdf_path: str) -> int:
+    from pypdf import PdfReader
+    return len(PdfReader(pdf_path).pages)
+
+
+def _resolve_workers(workers: int) -> int:
+    return workers if workers > 0 else (os.cpu_count() or 1)
+
+
+@lru_cache(maxsize=1)
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    """Общий пул процессов извлечения текста (создаётся один раз, переиспользуется между PDF)."""
+    logger.info(f"🚀 Запуск пула извлечения текста PDF: {workers} процессов")
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+def iter_page_results(pdf_path: str, extract_range: RangeExtractor, total_pages: int,
+                      workers: int = PDF_EXTRACTION_WORKERS,
+                      shard_pages: int = PDF_EXTRACTION_SHARD_PAGES) -> Iterator:
+    """
+    Извлекает страницы PDF диапазонами на пуле процессов и отдаёт результаты
+    постранично в исходном порядке.
+
+    Страницы независимы, поэтому каждый процесс сам открывает PDF и обрабатывает
+    свой диапазон. В работе одновременно не больше 2 * workers диапазонов,
+    так что память ограничена и при потоковой обработке.
+    """
+    workers = _resolve_workers(workers)
+    ranges = [(start, min(start + shard_pages, total_pages)) for start in range(0, total_pages, shard_pages)]
+
+    # Маленький PDF или один процесс: пул только добавит накладных расходов
+    if workers <= 1 or len(ranges) <= 1:
+        for start, end in ranges:
+            yield from extract_range(pdf_path, start, end)
+        return
+
+    pool = _get_pool(workers)
+    pending = deque()
+    next_range = 0
+    while next_range < len(ranges) or pending:
+        while next_range < len(ranges) and len(pending) < 2 * workers:
+            start, end = ranges[next_range]
+            pending.append(pool.submit(extract_range, pdf_path, start, end))
+            next_range += 1
+        yield from pending.popleft().result()
+
+
+def extract_pypdf_range(pdf_path: str, start: int, end: int) -> List[Tuple[int, str, str]]:
+    """Текст страниц [start, end) так же, как его извлекает PyPDFLoader: (номер, метка, текст)."""
+    import pypdf
+    reader = pypdf.PdfReader(pdf_path)
+    pages = []
+    for page_number in range(start, end):
+        page = reader.pages[page_number]
+        if pypdf.__version__.startswith("3"):
+            text = page.extract_text()
+        else:
+            text = page.extract_text(extraction_mode="plain")
+        text = text.strip()
+        pages.append((page_number, reader.page_labels[page_number], text))
+    return pages
+
+
+def iter_pdf_pages(pdf_path: str, workers: int = PDF_EXTRACTION_WORKERS) -> Iterator[Document]:
+    """Параллельная замена PyPDFLoader(pdf_path).lazy_load(): документ на страницу, по порядку."""
+    total_pages = count_pages(pdf_path)
+    for page_number, page_label, text in iter_page_results(pdf_path, extract_pypdf_range, total_pages, workers):
+        yield Document(
+            page_content=text,
+            metadata={
+                "source": pdf_path,
+                "total_pages": total_pages,
+                "page": page_number,
+                "page_label": page_label,
+            }
+        )
@@ -1,69 +1,420 @@
 import os
+import time
 import shutil
+import hashlib
+import threading
+from typing import Optional
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from functools import lru_cache
-from langchain_community.document_loaders import PyPDFLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_community.vectorstores import Chroma
-from src.config import EMBEDDING_MODEL, CHUNK_SIZE, CHUNK_OVERLAP, VECTOR_DB_ROOT_PATH
+from src.config import (
+    CHUNK_SIZE, CHUNK_OVERLAP, VECTOR_DB_ROOT_PATH,
+    PARENT_CHILD_ENABLED, CHILD_CHUNK_OVERLAP, PARENT_CHUNK_SIZE,
+    INDEX_BATCH_SIZE, INDEX_INFLIGHT_BATCHES,
+    EMBEDDING_BATCH_SIZE, EMBEDDING_WORKERS, EMBEDDING_CACHE_ENABLED,
+    VECTOR_QUANTIZATION, VECTOR_STORE_BACKEND, NUMPY_STORE_MAX_CHUNKS
+)
+from src.tools.document_registry import file_sha256, get_document_db_path, get_document_registry
+from src.tools.embedding_cache import CachedEmbeddings, get_embedding_cache
+from src.tools.embedding_engine import ParallelEmbeddings
+from src.tools.embeddings import get_embeddings, embedding_model_id
+from src.tools.numpy_store import (
+    NumpyVectorStore, MANIFEST_FILE as NUMPY_MANIFEST_FILE, VECTORS_FILE as NUMPY_VECTORS_FILE,
+    SCALES_FILE as NUMPY_SCALES_FILE, RECORDS_FILE as NUMPY_RECORDS_FILE
+)
+from src.tools.lexical_index import open_lexical_index
+from src.tools.parent_store import PARENT_STORE_FILE, ParentStore
+from src.tools.retrieval_cache import get_retrieval_cache
+from src.tools.chroma_store import (
+    CHROMA_DB_FILE, copy_document_collection, document_collection_exists,
+    drop_document_collection, open_document_collection, release_legacy_system
+)
+from src.tools.pdf_extraction import iter_pdf_pages
 # from src.tools.document_loader import universal_loader
 
+COMPLETE_MARKER = ".complete"
+
+_digest_locks = {}
+_digest_locks_guard = threading.Lock()
+
+
 def get_user_db_path(user_id:  int) -> str:
-    """Генерирует уникальный путь к базе данных для пользователя."""
+    """
+    Путь к векторной базе, которую использует пользователь.
+    Это общая база его документа; для баз, созданных до реестра, — старая папка user_<id>.
+    """
+    digest = get_document_registry().get_digest(user_id)
+    if digest is not None:
+        return get_document_db_path(digest)
     return os.path.join(VECTOR_DB_ROOT_PATH, f"user_{user_id}")
 
 @lru_cache(maxsize=1)
 def _get_embeddings():
-    return HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
+    if EMBEDDING_WORKERS > 1:
+        # Многоядерный хост индексации: батчи считаются в пуле процессов
+        embeddings = ParallelEmbeddings()
+    else:
+        embeddings = get_embeddings()  # Та же модель, что отвечает на запросы
+    if EMBEDDING_CACHE_ENABLED:
+        # Один и тот же учебник у разных студентов не пересчитывается
+        return CachedEmbeddings(embeddings, get_embedding_cache(embedding_model_id()))
+    return embeddings
 
-def index_user_pdf(pdf_file_path: str, user_id:  int):
+def _document_key(persist_dir: str) -> str:
+    """Ключ документа (sha256) — имя папки его базы; по нему же называется коллекция Chroma."""
+    return os.path.basename(os.path.normpath(persist_dir))
+
+def _store_backend(persist_dir: str) -> Optional[str]:
+    """Тип существующей базы: "numpy", "chroma" (коллекция общего клиента), "legacy" (своя папка Chroma)."""
+    if NumpyVectorStore.exists(persist_dir):
+        return "numpy"
+    if os.path.exists(os.path.join(persist_dir, CHROMA_DB_FILE)):
+        return "legacy"
+    if document_collection_exists(_document_key(persist_dir)):
+        return "chroma"
+    return None
+
+def _new_store_backend(quantization=None) -> str:
+    """Хранилище для новой базы: квантованные векторы умеет хранить только NumpyVectorStore."""
+    if quantization or VECTOR_STORE_BACKEND in ("numpy", "auto"):
+        return "numpy"
+    return "chroma"
+
+def open_vectorstore(persist_dir: str, embeddings, quantization=None, shared: bool = False):
     """
-    Обрабатывает PDF пользователя и сохраняет его в персональную векторную базу.
+    Открывает векторную базу документа. Тип хранилища существующей базы определяется
+    по тому, что уже есть на диске; для новой — по VECTOR_STORE_BACKEND и quantization.
+    Chroma-базы — коллекции одного общего клиента (src.tools.chroma_store).
+    shared=True — для поиска: готовый NumpyVectorStore открывается один на документ.
     """
-    user_persist_dir = get_user_db_path(user_id)
-    print(f"Начало индексации файла: {pdf_file_path} для user_id: {user_id}")
+    backend = _store_backend(persist_dir) or _new_store_backend(quantization)
+    if backend == "numpy":
+        if shared:
+            return NumpyVectorStore.open_shared(persist_dir, embeddings)
+        return NumpyVectorStore(persist_dir, embeddings, quantization=quantization)
+    if backend == "legacy":
+        # Ещё не перенесённая база старого формата (migrate_legacy_stores)
+        return Chroma(
+            persist_directory=persist_dir,
+            embedding_function=embeddings,
+            collection_metadata={"hnsw:space": "cosine"}
+        )
+    return open_document_collection(_document_key(persist_dir), embeddings)
 
-    # 1. Удаляем старую базу, если она была (чтобы заменить PDF)
-    if os.path.exists(user_persist_dir):
-        print(f"Удаление старой базы для user_id: {user_id}")
-        shutil.rmtree(user_persist_dir)
+def _migrate_to_chroma(store: NumpyVectorStore, persist_dir: str, embeddings):
+    """
+    Переносит разросшуюся базу из NumpyVectorStore в Chroma (HNSW вместо полного перебора).
+    Векторы переносятся готовыми, модель не вызывается.
+    """
+    collection = open_document_collection(_document_key(persist_dir), embeddings)._collection
+    ids = store.get(include=[])["ids"]
+    # Батчами: документ целиком в память не читается
+    for start in range(0, len(ids), INDEX_BATCH_SIZE):
+        batch = store.get(ids=ids[start:start + INDEX_BATCH_SIZE], include=["documents", "metadatas", "embeddings"])
+        collection.upsert(
+            ids=batch["ids"],
+            embeddings=batch["embeddings"].tolist(),
+            documents=batch["documents"],
+            metadatas=batch["metadatas"]
+        )
+    store.close()
 
-    # 2. Загрузка PDF
-    try:
-        loader = PyPDFLoader(pdf_file_path)
-        documents = loader.load()
-        if not documents:
-            raise ValueError("PDF-файл пуст или не удалось его загрузить.")
-    except Exception as e:
-        print(f"❌ Ошибка загрузки PDF: {e}")
-        return False  # Сигнал об ошибке
+    # Сначала манифест: без него папка уже не считается NumpyVectorStore
+    for name in (NUMPY_MANIFEST_FILE, NUMPY_VECTORS_FILE, NUMPY_SCALES_FILE, NUMPY_RECORDS_FILE):
+        path = os.path.join(persist_dir, name)
+        if os.path.exists(path):
+            os.remove(path)
+    print(f"🔁 База {persist_dir} переведена в Chroma ({len(ids)} чанков)")
+
+def _add_batch(vectorstore, lexical_index, chunks, ids):
+    """Записывает батч чанков в векторную базу и в лексический индекс."""
+    vectorstore.add_documents(documents=chunks, ids=ids)
+    lexical_index.add(ids, [chunk.page_content for chunk in chunks])
+
+def _refresh_metadata(vectorstore, chunks, ids) -> int:
+    """
+    Обновляет метаданные уже проиндексированных чанков (страница, ключ документа), если
+    они изменились: тот же текст в новой версии файла может стоять на другой странице.
+    Эмбеддинги не пересчитываются. Возвращает число обновлённых чанков.
+    """
+    current = vectorstore.get(ids=ids, include=["metadatas"])
+    stored = dict(zip(current["ids"], current["metadatas"]))
+    changed = [(chunk_id, chunk.metadata) for chunk, chunk_id in zip(chunks, ids)
+               if chunk_id in stored and stored[chunk_id] != chunk.metadata]
+    if not changed:
+        return 0
+    changed_ids, metadatas = (list(column) for column in zip(*changed))
+    if isinstance(vectorstore, NumpyVectorStore):
+        vectorstore.update_metadatas(changed_ids, metadatas)
+    else:
+        vectorstore._collection.update(ids=changed_ids, metadatas=metadatas)
+    return len(changed_ids)
+
+def _chunk_id(chunk) -> str:
+    """ID чанка = sha256 его текста. Одинаковый текст -> одинаковый ID при любой загрузке."""
+    return hashlib.sha256(chunk.page_content.encode("utf-8")).hexdigest()
+
+
+def _iter_chunks(pdf_file_path: str, digest: str, progress_callback=None, parent_store: Optional[ParentStore] = None):
+    """
+    Лениво читает PDF постранично и отдаёт чанки по одному.
+    Текст страниц извлекается параллельно (пул процессов), но приходит по порядку,
+    и в памяти находится только ограниченное окно страниц.
 
-    # 3. Разбиение на чанки
+    С parent_store страница дополнительно делится на родительские разделы
+    (не длиннее PARENT_CHUNK_SIZE), каждый чанк привязывается к разделу, в котором
+    начинается, а разделы и связи записываются в parent_store. Чанки режутся без
+    перекрытия: контекст вокруг найденного места даёт родитель.
+    """
     text_splitter = RecursiveCharacterTextSplitter(
         chunk_size=CHUNK_SIZE,
-        chunk_overlap=CHUNK_OVERLAP,
+        chunk_overlap=CHILD_CHUNK_OVERLAP if parent_store is not None else CHUNK_OVERLAP,
+        add_start_index=parent_store is not None,
     )
-    texts = text_splitter.split_documents(documents)
-    print(f"Документ разбит на {len(texts)} чанков.")
+    parent_splitter = RecursiveCharacterTextSplitter(chunk_size=PARENT_CHUNK_SIZE, chunk_overlap=0,
+                                                     add_start_index=True)
+    for page_num, page in enumerate(iter_pdf_pages(pdf_file_path), 1):
+        # База общая для всех, кто загрузил этот файл: не сохраняем временный путь загрузившего
+        page.metadata["source"] = digest
+        chunks = text_splitter.split_documents([page])
+        if parent_store is not None:
+            _store_parents(parent_store, parent_splitter.split_documents([page]), chunks)
+        yield from chunks
+        if progress_callback:
+            progress_callback("embedding", page_num, page.metadata["total_pages"])
+
+
+def _store_parents(parent_store: ParentStore, parents, chunks):
+    """Записывает разделы страницы и привязывает каждый чанк к разделу, в котором он начинается."""
+    starts = [parent.metadata.pop("start_index") for parent in parents]
+    children = [[] for _ in parents]
+    for chunk in chunks:
+        start = chunk.metadata.pop("start_index")
+        index = max((i for i, parent_start in enumerate(starts) if parent_start <= start), default=0)
+        children[index].append(_chunk_id(chunk))
+    for parent, child_ids in zip(parents, children):
+        parent_store.add(_chunk_id(parent), parent.page_content, parent.metadata, child_ids)
+
+
+def _iter_batches(items, batch_size: int):
+    """Группирует поток элементов в списки фиксированного размера."""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _drop_collection_dir(persist_dir: str):
+    """Удаляет базу документа: его коллекцию в общем клиенте Chroma и папку."""
+    try:
+        if os.path.exists(os.path.join(persist_dir, CHROMA_DB_FILE)):
+            # База старого формата: Chroma кэширует систему по пути, без этого папку держал бы старый клиент
+            release_legacy_system(persist_dir)
+        else:
+            drop_document_collection(_document_key(persist_dir))
+    except Exception as e:
+        print(f"Не удалось удалить векторы базы {persist_dir}: {e}")
+    shutil.rmtree(persist_dir, ignore_errors=True)
+
+
+def _is_complete(persist_dir: str) -> bool:
+    return os.path.exists(os.path.join(persist_dir, COMPLETE_MARKER))
+
+
+def _get_digest_lock(digest: str) -> threading.Lock:
+    """Один документ индексируется не более чем одним потоком одновременно."""
+    with _digest_locks_guard:
+        return _digest_locks.setdefault(digest, threading.Lock())
+
+
+def index_user_pdf(pdf_file_path: str, user_id:  int, progress_callback=None):
+    """
+    Обрабатывает PDF пользователя и привязывает пользователя к векторной базе документа.
+
+    Базы адресуются sha256 файла: одинаковые PDF разных пользователей используют
+    одну общую базу (только для чтения), у пользователя хранится лишь ссылка.
+    Готовая общая база больше не изменяется; когда на документ не остаётся
+    ссылок, его база удаляется.
+
+    progress_callback(stage, done, total) вызывается по ходу работы:
+    "parsing" — подготовка, "embedding" — обработано done из total страниц.
+    """
+    print(f"Начало индексации файла: {pdf_file_path} для user_id: {user_id}")
+    registry = get_document_registry()
+    if progress_callback:
+        progress_callback("parsing", 0, 0)
+
+    try:
+        digest = file_sha256(pdf_file_path)
+    except Exception as e:
+        print(f"❌ Ошибка чтения PDF: {e}")
+        return False
+
+    document_dir = get_document_db_path(digest)
+    previous_dir = get_user_db_path(user_id)
+
+    with _get_digest_lock(digest):
+        if _is_complete(document_dir):
+            print(f"♻️ Документ {digest[:12]} уже проиндексирован, используем общую базу")
+        else:
+            # Незавершённая попытка не должна попасть в общую базу
+            if os.path.exists(document_dir):
+                _drop_collection_dir(document_dir)
+
+            # Копия прошлой базы пользователя: пересчитается только разница (базы не изменяются на месте).
+            # Копируем, только если прошлая база того же типа, что и новая (в режиме auto подходит любая);
+            # базы старого формата не копируем.
+            previous_backend = _store_backend(previous_dir) if previous_dir != document_dir else None
+            same_storage = previous_backend != "legacy" and (
+                (VECTOR_STORE_BACKEND == "auto" and not VECTOR_QUANTIZATION)
+                or previous_backend == _new_store_backend(VECTOR_QUANTIZATION)
+            )
+            if previous_backend is not None and same_storage:
+                shutil.copytree(previous_dir, document_dir, ignore=shutil.ignore_patterns(COMPLETE_MARKER))
+                if previous_backend == "chroma":
+                    copy_document_collection(_document_key(previous_dir), digest, _get_embeddings())
+
+            if not _build_collection(pdf_file_path, document_dir, digest, progress_callback):
+                _drop_collection_dir(document_dir)
+                return False
+
+            with open(os.path.join(document_dir, COMPLETE_MARKER), "w") as f:
+                f.write(digest)
+
+        orphan = registry.assign(user_id, digest)
+
+    # Результаты поиска по прошлой базе пользователю больше не нужны
+    get_retrieval_cache().invalidate_user(user_id)
+
+    if orphan is not None:
+        with _get_digest_lock(orphan):
+            # Пока ждали блокировку, на документ мог сослаться кто-то ещё
+            if registry.refcount(orphan) == 0:
+                print(f"🗑 На документ {orphan[:12]} больше нет ссылок, удаляем его базу")
+                _drop_collection_dir(get_document_db_path(orphan))
+
+    # Персональная база в старом формате больше не нужна
+    legacy_dir = os.path.join(VECTOR_DB_ROOT_PATH, f"user_{user_id}")
+    if os.path.exists(legacy_dir):
+        _drop_collection_dir(legacy_dir)
+
+    print(f"✅ user_id: {user_id} использует базу {document_dir} (ссылок: {registry.refcount(digest)})")
+    return True
+
 
-    # 4. Создание эмбеддингов и сохранение
+def _build_collection(pdf_file_path: str, persist_dir: str, digest: str, progress_callback=None) -> bool:
+    """
+    Создаёт или обновляет векторную базу в persist_dir по содержимому PDF.
+
+    Индексация инкрементальная: чанки адресуются хэшем содержимого, поэтому
+    при повторной загрузке эмбеддинги считаются только для новых чанков,
+    у прежних обновляются метаданные (страница могла сдвинуться),
+    а из базы удаляются только исчезнувшие.
+
+    Обработка потоковая: страница -> чанки -> микро-батч эмбеддингов -> запись в базу.
+    Одновременно в работе не больше INDEX_INFLIGHT_BATCHES батчей, поэтому пиковая
+    память не зависит от размера PDF.
+    """
     try:
-        print("Создание эмбеддингов...")
         embeddings = _get_embeddings()
 
-        vectorstore = Chroma.from_documents(
-            documents=texts,
-            embedding=embeddings,
-            persist_directory=user_persist_dir,  # Сохраняем в папку пользователя
-            collection_metadata={"hnsw:space": "cosine"}
-        )
-        vectorstore.persist()
-        print(f"✅ Новая база успешно создана для user_id: {user_id} в {user_persist_dir}")
+        vectorstore = open_vectorstore(persist_dir, embeddings, quantization=VECTOR_QUANTIZATION)
+        existing_ids = set(vectorstore.get(include=[])["ids"])
+        # Инвертированный индекс для BM25 лежит в той же папке и обновляется вместе с базой
+        lexical_index = open_lexical_index(persist_dir, vectorstore)
+        # Родительские разделы для дочерних чанков: связи пересобираются целиком
+        parent_store = ParentStore(persist_dir) if PARENT_CHILD_ENABLED else None
+        if parent_store is not None:
+            parent_store.clear()
+        elif ParentStore.exists(persist_dir):
+            os.remove(os.path.join(persist_dir, PARENT_STORE_FILE))  # Скопирована из прошлой базы
+    except Exception as e:
+        print(f"❌ Ошибка открытия векторной базы: {e}")
+        return False
+
+    # Батч должен загрузить все воркеры пула эмбеддингов
+    batch_size = max(INDEX_BATCH_SIZE, EMBEDDING_WORKERS * EMBEDDING_BATCH_SIZE)
+
+    started_at = time.perf_counter()
+    seen_ids = set()
+    total_chunks = 0
+    added_chunks = 0
+    updated_chunks = 0  # Прежние чанки с новыми метаданными (страница сдвинулась)
+    in_flight = deque()
+
+    # Эмбеддинги и запись идут в отдельном потоке, пока основной читает следующие страницы
+    executor = ThreadPoolExecutor(max_workers=1)
+    try:
+        chunks = _iter_chunks(pdf_file_path, digest, progress_callback, parent_store)
+        for batch in _iter_batches(chunks, batch_size):
+            total_chunks += len(batch)
+
+            # Повторяющиеся куски текста храним один раз (первое вхождение)
+            new_chunks, new_ids, kept_chunks, kept_ids = [], [], [], []
+            for chunk in batch:
+                chunk_id = _chunk_id(chunk)
+                if chunk_id in seen_ids:
+                    continue
+                seen_ids.add(chunk_id)
+                if chunk_id not in existing_ids:
+                    new_chunks.append(chunk)
+                    new_ids.append(chunk_id)
+                else:
+                    kept_chunks.append(chunk)
+                    kept_ids.append(chunk_id)
+
+            # Окно фиксированного размера: ждём самый старый батч, прежде чем брать новый.
+            # Запись в базу — в одном потоке executor, поэтому батчи не пересекаются
+            if kept_chunks:
+                if len(in_flight) >= INDEX_INFLIGHT_BATCHES:
+                    updated_chunks += in_flight.popleft().result() or 0
+                in_flight.append(executor.submit(_refresh_metadata, vectorstore, kept_chunks, kept_ids))
+            if new_chunks:
+                if len(in_flight) >= INDEX_INFLIGHT_BATCHES:
+                    updated_chunks += in_flight.popleft().result() or 0
+                in_flight.append(executor.submit(_add_batch, vectorstore, lexical_index, new_chunks, new_ids))
+                added_chunks += len(new_chunks)
+
+        while in_flight:
+            updated_chunks += in_flight.popleft().result() or 0
+
+        if total_chunks == 0:
+            raise ValueError("PDF-файл пуст или не удалось его загрузить.")
+
+        # Удаляем только чанки, которых больше нет в документе
+        stale_ids = [chunk_id for chunk_id in existing_ids if chunk_id not in seen_ids]
+        for stale_batch in _iter_batches(stale_ids, INDEX_BATCH_SIZE):
+            vectorstore.delete(ids=stale_batch)
+            lexical_index.delete(stale_batch)
+
+        if isinstance(vectorstore, NumpyVectorStore):
+            vectorstore.persist()  # Chroma пишет на диск сама, NumpyVectorStore — один раз в конце
+            # В режиме auto полный перебор оставляем только для небольших баз
+            if VECTOR_STORE_BACKEND == "auto" and not VECTOR_QUANTIZATION and len(vectorstore) > NUMPY_STORE_MAX_CHUNKS:
+                _migrate_to_chroma(vectorstore, persist_dir, embeddings)
+
+        elapsed = time.perf_counter() - started_at
+        print(f"Документ разбит на {total_chunks} чанков. "
+              f"Новых: {added_chunks}, обновлено метаданных: {updated_chunks}, удалено устаревших: {len(stale_ids)}")
+        if parent_store is not None:
+            print(f"Родительских разделов: {len(parent_store)}")
+        print(f"⏱ Индексация заняла {elapsed:.1f} с ({total_chunks / elapsed:.1f} чанков/с)")
         return True  # Сигнал об успехе
 
     except Exception as e:
-        print(f"❌ Ошибка создания векторной базы: {e}")
+        print(f"❌ Ошибка индексации PDF: {e}")
         return False
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        lexical_index.close()
+        if parent_store is not None:
+            parent_store.close()
 
 
 # import os
@@ -5,6 +5,7 @@ import re
 import shutil
 import pdfplumber
 from typing import Optional, List
+from src.tools.pdf_extraction import count_pages, iter_page_results
 
 logger = logging.getLogger(__name__)
 
@@ -48,72 +49,84 @@ def load_marker_models():
 
 
 # --- ГЕОМЕТРИЧЕСКИЙ ПАРСЕР (План Б) ---
+def _parse_page_geometrically(page) -> str:
+    """Собирает текст одной страницы pdfplumber по координатам слов."""
+    # Извлекаем слова с координатами
+    words = page.extract_words(keep_blank_chars=True, x_tolerance=2, y_tolerance=3)
+
+    # Группируем слова в строки по Y-координате (с допуском 8 пикселей)
+    lines_map = {}
+    for w in words:
+        y_key = int(w['top'] // 8) * 8
+        if y_key not in lines_map: lines_map[y_key] = []
+        lines_map[y_key].append(w)
+
+    sorted_ys = sorted(lines_map.keys())
+    processed_lines = []
+    skip_y_indices = set()
+
+    for i, y in enumerate(sorted_ys):
+        if i in skip_y_indices: continue
+
+        row = sorted(lines_map[y], key=lambda x: x['x0'])
+        row_text = " ".join([w['text'] for w in row])
+
+        # Координаты текущей строки
+        row_left = row[0]['x0']
+        row_right = row[-1]['x1']
+
+        # Проверка на дробь (есть ли строка прямо под этой?)
+        is_fraction = False
+        if i + 1 < len(sorted_ys):
+            next_y = sorted_ys[i + 1]
+            # Если следующая строка очень близко (меньше 18 пикселей)
+            if (next_y - y) < 18:
+                next_row = sorted(lines_map[next_y], key=lambda x: x['x0'])
+                next_text = " ".join([w['text'] for w in next_row])
+
+                next_left = next_row[0]['x0']
+                next_right = next_row[-1]['x1']
+
+                # Проверка перекрытия по горизонтали
+                overlap = min(row_right, next_right) - max(row_left, next_left)
+                if overlap > 5:  # Если перекрытие существенное
+                    combined = f"({row_text}) / ({next_text})"
+                    processed_lines.append(combined)
+                    skip_y_indices.add(i + 1)  # Пропускаем следующую строку, так как объединили
+                    is_fraction = True
+
+        if not is_fraction:
+            processed_lines.append(row_text)
+
+    # Очистка текста от явного мусора (если кодировка совсем битая)
+    clean_lines = []
+    for line in processed_lines:
+        # Оставляем цифры, буквы, мат. символы
+        if len(line.strip()) > 1:
+            clean_lines.append(line)
+
+    return "\n".join(clean_lines)
+
+
+def _parse_page_range_geometrically(file_path: str, start: int, end: int) -> List[str]:
+    """Шард для пула процессов: тексты страниц [start, end)."""
+    with pdfplumber.open(file_path) as pdf:
+        return [
+            f"--- Page {p_num + 1} ---\n" + _parse_page_geometrically(pdf.pages[p_num])
+            for p_num in range(start, end)
+        ]
+
+
 def parse_pdf_geometrically(file_path: str) -> str:
     """
     Парсит PDF, основываясь на координатах слов.
     Пытается "склеить" дроби, расположенные друг над другом.
+    Страницы обрабатываются параллельно диапазонами и склеиваются по порядку.
     """
     logger.info("📐 Запуск Геометрического парсера (Fallback)...")
-    full_text = []
     try:
-        with pdfplumber.open(file_path) as pdf:
-            for p_num, page in enumerate(pdf.pages):
-                # Извлекаем слова с координатами
-                words = page.extract_words(keep_blank_chars=True, x_tolerance=2, y_tolerance=3)
-
-                # Группируем слова в строки по Y-координате (с допуском 8 пикселей)
-                lines_map = {}
-                for w in words:
-                    y_key = int(w['top'] // 8) * 8
-                    if y_key not in lines_map: lines_map[y_key] = []
-                    lines_map[y_key].append(w)
-
-                sorted_ys = sorted(lines_map.keys())
-                processed_lines = []
-                skip_y_indices = set()
-
-                for i, y in enumerate(sorted_ys):
-                    if i in skip_y_indices: continue
-
-                    row = sorted(lines_map[y], key=lambda x: x['x0'])
-                    row_text = " ".join([w['text'] for w in row])
-
-                    # Координаты текущей строки
-                    row_left = row[0]['x0']
-                    row_right = row[-1]['x1']
-
-                    # Проверка на дробь (есть ли строка прямо под этой?)
-                    is_fraction = False
-                    if i + 1 < len(sorted_ys):
-                        next_y = sorted_ys[i + 1]
-                        # Если следующая строка очень близко (меньше 18 пикселей)
-                        if (next_y - y) < 18:
-                            next_row = sorted(lines_map[next_y], key=lambda x: x['x0'])
-                            next_text = " ".join([w['text'] for w in next_row])
-
-                            next_left = next_row[0]['x0']
-                            next_right = next_row[-1]['x1']
-
-                            # Проверка перекрытия по горизонтали
-                            overlap = min(row_right, next_right) - max(row_left, next_left)
-                            if overlap > 5:  # Если перекрытие существенное
-                                combined = f"({row_text}) / ({next_text})"
-                                processed_lines.append(combined)
-                                skip_y_indices.add(i + 1)  # Пропускаем следующую строку, так как объединили
-                                is_fraction = True
-
-                    if not is_fraction:
-                        processed_lines.append(row_text)
-
-                # Очистка текста от явного мусора (если кодировка совсем битая)
-                clean_lines = []
-                for line in processed_lines:
-                    # Оставляем цифры, буквы, мат. символы
-                    if len(line.strip()) > 1:
-                        clean_lines.append(line)
-
-                full_text.append(f"--- Page {p_num + 1} ---\n" + "\n".join(clean_lines))
-        return "\n".join(full_text)
+        total_pages = count_pages(file_path)
+        return "\n".join(iter_page_results(file_path, _parse_page_range_geometrically, total_pages))
     except Exception as e:
         logger.error(f"Fallback Parser Error: {e}")
         return "Error parsing PDF geometrically."
@@ -215,7 +228,6 @@ def get_user_db_path(user_id: int) -> str:
 
 
 def get_embeddings():
-    """Заглушка для совместимости эмбеддингов"""
-    if HuggingFaceEmbeddings:
-        return HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
-    return None
+    """Заглушка для совместимости эмбеддингов: общая модель процесса"""
+    from src.tools.embeddings import get_embeddings as get_shared_embeddings
+    return get_shared_embeddings()
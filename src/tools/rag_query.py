@@ -1,17 +1,19 @@
 import os
-from functools import lru_cache
-from langchain_gigachat.chat_models import GigaChat
-from langchain_community.vectorstores import Chroma
-from langchain_community.embeddings import HuggingFaceEmbeddings
+import logging
+from typing import Dict, List, Optional
+import threading
 from langchain.chains import RetrievalQA
-from src.config import EMBEDDING_MODEL, LLM_TEMPERATURE, RETRIEVER_K
-from src.services.get_token import get_token
-from src.tools.pdf_indexer import get_user_db_path
+from src.config import RETRIEVER_K, MMR_ENABLED, AGENT_CONTEXT_TOKENS
+from src.services.llm_client import get_llm
+from src.tools.pdf_indexer import get_user_db_path, open_vectorstore
+from src.tools.embeddings import get_query_embeddings
+from src.tools.retrieval import build_retriever
+from src.tools.retrieval_cache import CachedRetriever, get_retrieval_cache
+from src.tools.context_packer import CONTEXT_SEPARATOR, pack_context
+from src.tools.tokens import count_tokens
 
+logger = logging.getLogger(__name__)
 
-@lru_cache(maxsize=1)
-def _get_embeddings():
-    return HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
 
 class RAGLoader:
     def __init__(self, user_id: int):
@@ -22,66 +24,129 @@ class RAGLoader:
         if not os.path.exists(self.user_db_path):
             raise FileNotFoundError(f"Нет базы данных для пользователя {user_id}. Загрузите PDF.")
 
-        # Инициализируем LLM (с кэшированным токеном!)
-        self.llm = self._initialize_llm()
-
-        # Получаем эмбеддинги из кэша
-        self.embeddings = _get_embeddings()
-
-        # Загружаем векторную БД пользователя (Chroma читает с диска — быстро)
-        self.vectorstore = Chroma(
-            persist_directory=self.user_db_path,
-            embedding_function=self.embeddings
-        )
-
-        # Настраиваем ретривер (сколько чанков брать)
-        self.retriever = self.vectorstore.as_retriever(search_kwargs={"k": RETRIEVER_K})
-
-        # Собираем цепочку: вопрос → ретривер → LLM → ответ
-        # self.qa_chain = self._create_qa_chain()
+        # Общая LLM процесса: один HTTP-клиент и один токен на все сессии
+        self.llm = get_llm()
+
+        # Общая модель эмбеддингов процесса (уже прогрета при старте бота) с кэшем эмбеддингов запросов
+        self.embeddings = get_query_embeddings()
+
+        # Версия индекса — ключ документа, поэтому после переиндексации кэш результатов не совпадает
+        self.index_version = os.path.basename(self.user_db_path)
+
+        # Векторная база и ретривер открываются при первом поиске (см. _build)
+        self._vectorstore = None
+        self._retriever = None
+        self._build_lock = threading.Lock()
+
+    def _build(self):
+        """Открывает векторную БД пользователя и собирает ретривер (один раз, при первом обращении)."""
+        if self._retriever is not None:
+            return
+        with self._build_lock:
+            if self._retriever is not None:
+                return
+            # Векторная БД пользователя (Chroma или квантованное NumpyVectorStore)
+            vectorstore = open_vectorstore(self.user_db_path, self.embeddings, shared=True)
+            # Ретривер: гибридный BM25 + векторный, результаты кэшируются
+            retriever = CachedRetriever(
+                base_retriever=build_retriever(vectorstore, self.user_db_path, k=RETRIEVER_K),
+                cache=get_retrieval_cache(),
+                user_id=self.user_id,
+                index_version=self.index_version,
+                k=RETRIEVER_K
+            )
+            self._vectorstore = vectorstore
+            self._retriever = retriever
+
+    @property
+    def vectorstore(self):
+        self._build()
+        return self._vectorstore
+
+    @property
+    def retriever(self):
+        self._build()
+        return self._retriever
 
     def get_components(self):
         """НОВЫЙ МЕТОД: Возвращает LLM и Retriever."""
         return self.llm, self.retriever
 
-    def _initialize_llm(self):
-        """Создаёт GigaChat с валидным токеном."""
-        token = get_token()
-        if not token:
-            raise ValueError("Не удалось получить Access Token.")
-        return GigaChat(
-            temperature=LLM_TEMPERATURE,
-            verify_ssl_certs=False,
-            access_token=token
-        )
-
     def close(self):
-        """Явно закрывает соединение ChromaDB/SQLite."""
+        """
+        Освобождает ресурсы сессии. Клиент Chroma общий на процесс и не закрывается:
+        число открытых файлов не зависит от числа пользователей.
+        """
         try:
-            # Chroma хранит ссылку на клиент. Закрываем его, чтобы освободить файл.
-            if hasattr(self.vectorstore, '_client'):
-                self.vectorstore._client.close()
+            # Ретриверы цепочки держат открытыми SQLite лексического индекса и родительских разделов
+            # (если база так и не открывалась, закрывать нечего)
+            retriever = self._retriever
+            while retriever is not None:
+                for resource in (getattr(retriever, "lexical_index", None), getattr(retriever, "parent_store", None)):
+                    if resource is not None:
+                        resource.close()
+                retriever = getattr(retriever, "base_retriever", None)
         except Exception as e:
             # Логируем, но не прерываем работу, если закрытие не удалось
-            print(f"Ошибка при закрытии ChromaDB: {e}")
+            print(f"Ошибка при закрытии ресурсов RAGLoader: {e}")
 
-    def get_retrieved_context(self, topic: str, k: int = 4) -> str:
+    def get_packed_context(self, topic: str, k: int = 4, budget_tokens: int = AGENT_CONTEXT_TOKENS,
+                           lambda_mult: Optional[float] = None) -> Dict:
         """
-        Возвращает ЧИСТЫЙ извлеченный текст (чанки), ИГНОРИРУЯ ПАМЯТЬ и LLM.
-        Используется только для предоставления контекста другим агентам.
+        Найденные чанки, уложенные в бюджет токенов (см. pack_context): text и статистика
+        (tokens_used, сколько чанков вошло). lambda_mult переопределяет MMR_LAMBDA, если MMR включён.
         """
-        # 1. Используем чистый ретривер (из RAGLoader)
-        retriever = self.vectorstore.as_retriever(search_kwargs={"k": k})
-        docs = retriever.get_relevant_documents(topic)  # self.qa_chain.retriever - это ваш retriever
-        if not docs:
-            return ""
+        # Почти дубликаты отсеивает MMR, упаковщик берёт лучшие чанки целиком и не режет предложения
+        search_kwargs = {"lambda_mult": lambda_mult} if MMR_ENABLED and lambda_mult is not None else {}
+        docs = self.retriever.invoke(topic, k=k, **search_kwargs)
+        return pack_context(docs, budget_tokens)
 
-        # 2. Объединяем в одну строку
-        context = "\n---\n".join([doc.page_content for doc in docs])
-
-        # 3. Ограничиваем длину (для Concept Explainer)
-        if len(context) > 2000:
-            return context[:2000] + " [Контекст обрезан для передачи агенту]"
-
-        return context
+    def get_retrieved_context(self, topic: str, k: int = 4, lambda_mult: Optional[float] = None) -> str:
+        """
+        Возвращает ЧИСТЫЙ извлеченный текст (чанки), ИГНОРИРУЯ ПАМЯТЬ и LLM.
+        Используется только для предоставления контекста другим агентам:
+        не длиннее AGENT_CONTEXT_TOKENS токенов.
+        """
+        packed = self.get_packed_context(topic, k=k, lambda_mult=lambda_mult)
+        logger.info(f"📦 Контекст для агента: {packed['tokens_used']}/{packed['budget_tokens']} токенов, "
+                    f"чанков {packed['chunks_used']} из {packed['chunks_total']}")
+        return packed["text"]
 
+    def retrieve_batch(self, queries: List[str], k: int = 4, budget_tokens: Optional[int] = None) -> Dict:
+        """
+        Поиск сразу по нескольким запросам (подтемы квиза, учебного плана).
+
+        Эмбеддинги всех запросов считаются одним батчем модели. Сам поиск —
+        retriever.batch: отдельный вызов ретривера на каждую подтему, вызовы идут
+        параллельно в пуле потоков и берут векторы запросов из кэша.
+        Возвращает:
+          per_query — списки чанков по каждому запросу (в порядке queries);
+          documents — объединённые чанки без повторов: по очереди первый чанк каждого
+                      запроса, затем вторые и т. д., чтобы в контекст попали все подтемы;
+          context   — documents одной строкой, уложенные в budget_tokens (без него — все);
+          tokens_used — токенов в context.
+        """
+        unique_queries = list(dict.fromkeys(q for q in queries if q and q.strip()))
+        if not unique_queries:
+            return {"per_query": [[] for _ in queries], "documents": [], "context": "", "tokens_used": 0}
+
+        self.embeddings.embed_queries(unique_queries)
+        results = dict(zip(unique_queries, self.retriever.batch(unique_queries, k=k)))
+        per_query = [results.get(q, []) for q in queries]
+
+        documents, seen = [], set()
+        for rank in range(k):
+            for docs in results.values():
+                if rank < len(docs) and docs[rank].page_content not in seen:
+                    seen.add(docs[rank].page_content)
+                    documents.append(docs[rank])
+
+        # Порядок documents — очередь по подтемам, он же приоритет при упаковке
+        if budget_tokens is None:
+            context = CONTEXT_SEPARATOR.join(doc.page_content for doc in documents)
+            packed = {"text": context, "tokens_used": count_tokens(context)}
+        else:
+            packed = pack_context(documents, budget_tokens)
+
+        return {"per_query": per_query, "documents": documents, "context": packed["text"],
+                "tokens_used": packed["tokens_used"]}
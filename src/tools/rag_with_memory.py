@@ -1,7 +1,12 @@
+import threading
+from typing import Optional
 from langchain.chains import ConversationalRetrievalChain
-from langchain.memory import ConversationSummaryBufferMemory
 # Используем наш новый загрузчик
 from .rag_query import RAGLoader
+from .background_memory import BackgroundSummaryMemory
+from .condense_gate import GatedQuestionGenerator, get_condense_gate
+from .conversation_store import ConversationStore, get_conversation_store
+from src.config import MEMORY_MAX_TOKENS, CONDENSE_GATE_ENABLED, SESSION_PERSIST_MEMORY
 from langchain.prompts import PromptTemplate
 
 # Новый шаблон промпта для ConversationalRetrievalChain
@@ -50,30 +55,55 @@ class UserRAGQuery:
     Класс, который создает и хранит RAG-цепочку с памятью для одного пользователя.
     """
 
-    def __init__(self, user_id: int):
-        # 1. Загружаем компоненты
+    def __init__(self, user_id: int, conversation_store: Optional[ConversationStore] = None):
+        # conversation_store — куда писать диалог вместо общего хранилища (бенчмарки во временной базе)
+        # 1. Загружаем компоненты: LLM общая, векторная база откроется при первом вопросе
         self.loader = RAGLoader(user_id)
-        llm, retriever = self.loader.get_components()
+        llm = self.loader.llm
 
-        self.retriever = retriever
-
-        # 2. Создание памяти с суммаризацией
-        self.memory = ConversationSummaryBufferMemory(
+        # 2. Создание памяти с суммаризацией (сводка пишется фоном, ответ её не ждёт)
+        self.memory = BackgroundSummaryMemory(
             llm=llm,
-            max_token_limit=1000,
+            max_token_limit=MEMORY_MAX_TOKENS,
             memory_key="chat_history",
-            return_messages=True
-        )
-
-        # 3. Создание цепи RAG с памятью
-        self.qa_chain = ConversationalRetrievalChain.from_llm(
-            llm=llm,
-            retriever=retriever,
-            memory=self.memory,
-            combine_docs_chain_kwargs = {"prompt": QA_CHAIN_PROMPT},  # Для финального ответа
-            condense_question_prompt = CONDENSE_QUESTION_PROMPT
-
+            return_messages=True,
+            store=conversation_store or (get_conversation_store() if SESSION_PERSIST_MEMORY else None),
+            user_id=user_id
         )
+        if self.memory.store is not None:
+            # Диалог, сохранённый до вытеснения сессии или перезапуска бота
+            self.memory.restore()
+
+        # 3. Цепь RAG собирается при первом вопросе (см. qa_chain)
+        self._qa_chain = None
+        self._build_lock = threading.Lock()
+
+    @property
+    def retriever(self):
+        return self.loader.retriever
+
+    @property
+    def qa_chain(self) -> ConversationalRetrievalChain:
+        """Цепь RAG с памятью; собирается при первом обращении."""
+        if self._qa_chain is None:
+            with self._build_lock:
+                if self._qa_chain is None:
+                    llm, retriever = self.loader.get_components()
+                    qa_chain = ConversationalRetrievalChain.from_llm(
+                        llm=llm,
+                        retriever=retriever,
+                        memory=self.memory,
+                        combine_docs_chain_kwargs = {"prompt": QA_CHAIN_PROMPT},  # Для финального ответа
+                        condense_question_prompt = CONDENSE_QUESTION_PROMPT
+                    )
+                    if CONDENSE_GATE_ENABLED:
+                        # Самостоятельный вопрос не переформулируется: на ход на один вызов LLM меньше
+                        qa_chain.question_generator = GatedQuestionGenerator(
+                            question_generator=qa_chain.question_generator,
+                            gate=get_condense_gate()
+                        )
+                    self._qa_chain = qa_chain
+        return self._qa_chain
 
     def ask(self, question: str) -> str:
         """Отправляет вопрос в цепочку с памятью и возвращает ответ."""
@@ -0,0 +1,115 @@
+import time
+import logging
+import threading
+from functools import lru_cache
+from typing import Any, List, Optional
+from pydantic import ConfigDict
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from src.config import (
+    RERANKER_MODEL, RERANK_BATCH_SIZE, RERANK_FETCH_K, RERANK_TOP_N, RERANK_LATENCY_BUDGET_MS
+)
+
+logger = logging.getLogger(__name__)
+
+
+class CrossEncoderReranker:
+    """
+    Переранжирование кандидатов кросс-энкодером (пары «запрос, чанк» на CPU).
+
+    Кандидаты оцениваются небольшими батчами в порядке первого этапа поиска.
+    Перед каждым батчем проверяется, успеет ли он до конца бюджета задержки
+    (по времени предыдущего батча); если нет, оставшиеся кандидаты не оцениваются
+    и идут после оценённых в исходном порядке — ответ не ждёт переранжирования
+    дольше бюджета. Оценка кросс-энкодера пишется в metadata["rerank_score"].
+    """
+
+    def __init__(self, model_name: str = RERANKER_MODEL, batch_size: int = RERANK_BATCH_SIZE,
+                 latency_budget_ms: float = RERANK_LATENCY_BUDGET_MS):
+        from sentence_transformers import CrossEncoder
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.latency_budget_ms = latency_budget_ms
+        self.model = CrossEncoder(model_name, max_length=512)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.total_ms = 0.0
+        self.over_budget = 0
+
+    def rerank(self, query: str, docs: List[Document], top_n: int = RERANK_TOP_N,
+               latency_budget_ms: Optional[float] = None) -> List[Document]:
+        if not docs:
+            return []
+        budget_ms = self.latency_budget_ms if latency_budget_ms is None else latency_budget_ms
+        start_time = time.perf_counter()
+        deadline = start_time + budget_ms / 1000 if budget_ms else None
+
+        scores, batch_seconds = [], 0.0
+        for start in range(0, len(docs), self.batch_size):
+            # Первый батч оценивается всегда; следующий — только если успевает до конца бюджета
+            if deadline is not None and scores and time.perf_counter() + batch_seconds > deadline:
+                break
+            batch_start = time.perf_counter()
+            batch = docs[start:start + self.batch_size]
+            scores.extend(self.model.predict([(query, doc.page_content) for doc in batch],
+                                             batch_size=self.batch_size, show_progress_bar=False).tolist())
+            batch_seconds = time.perf_counter() - batch_start
+
+        scored = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)
+        order = scored + list(range(len(scores), len(docs)))
+        elapsed_ms = (time.perf_counter() - start_time) * 1000
+
+        with self._lock:
+            self.calls += 1
+            self.total_ms += elapsed_ms
+            if len(scores) < len(docs):
+                self.over_budget += 1
+        logger.info(f"🎯 Переранжирование: {len(scores)}/{len(docs)} кандидатов за {elapsed_ms:.0f} мс")
+        result = []
+        for i in order[:top_n]:
+            doc = docs[i]
+            if i < len(scores):
+                doc = Document(page_content=doc.page_content, metadata={**doc.metadata, "rerank_score": float(scores[i])},
+                               id=doc.id)
+            result.append(doc)
+        return result
+
+    def warm_up(self):
+        self.model.predict([("прогрев", "прогрев модели")], show_progress_bar=False)
+
+    def get_stats(self) -> dict:
+        return {
+            "model": self.model_name,
+            "calls": self.calls,
+            "avg_latency_ms": self.total_ms / self.calls if self.calls else 0.0,
+            "over_budget": self.over_budget,
+        }
+
+
+@lru_cache(maxsize=1)
+def get_reranker() -> CrossEncoderReranker:
+    """Один кросс-энкодер на процесс."""
+    return CrossEncoderReranker()
+
+
+class RerankingRetriever(BaseRetriever):
+    """
+    Берёт fetch_k кандидатов у базового ретривера и оставляет top_n лучших по кросс-энкодеру.
+    top_n не зависит от k внешних обёрток (MMR, родительские разделы просят больше
+    кандидатов): с переранжированием дальше идут не больше top_n чанков.
+    """
+
+    base_retriever: BaseRetriever
+    reranker: CrossEncoderReranker
+    fetch_k: int = RERANK_FETCH_K
+    top_n: int = RERANK_TOP_N
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun,
+                                **kwargs: Any) -> List[Document]:
+        top_n = min(kwargs.get("k", self.top_n), self.top_n)
+        candidates = self.base_retriever.invoke(query, k=self.fetch_k,
+                                                config={"callbacks": run_manager.get_child()})
+        return self.reranker.rerank(query, candidates, top_n=top_n)
@@ -0,0 +1,105 @@
+import hashlib
+from typing import Any, Dict, List, Optional
+from pydantic import ConfigDict
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.vectorstores import VectorStore
+from src.config import (
+    RETRIEVER_K, RETRIEVAL_MODE, HYBRID_FETCH_K, RRF_K, RERANKER_ENABLED, RERANK_FETCH_K, MMR_ENABLED
+)
+from src.tools.lexical_index import LexicalIndex, open_lexical_index
+from src.tools.parent_store import ParentRetriever, ParentStore
+
+
+def _content_key(doc: Document) -> str:
+    # Ключ по тексту, а не по id: в старых базах user_<id> id чанков случайные
+    return hashlib.sha256(doc.page_content.encode("utf-8")).hexdigest()
+
+
+def reciprocal_rank_fusion(rankings: List[List[Document]], rrf_k: int = RRF_K) -> List[Document]:
+    """
+    Объединяет ранжированные списки: score = сумма 1 / (rrf_k + место) по всем спискам.
+    Оценка пишется в metadata["rrf_score"] (по ней MMR считает релевантность).
+    """
+    scores: Dict[str, float] = {}
+    docs: Dict[str, Document] = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking, start=1):
+            key = _content_key(doc)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank)
+            docs.setdefault(key, doc)
+    return [
+        Document(page_content=docs[key].page_content, metadata={**docs[key].metadata, "rrf_score": scores[key]},
+                 id=docs[key].id)
+        for key in sorted(scores, key=scores.get, reverse=True)
+    ]
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Гибридный поиск: векторный (смысл) + BM25 по инвертированному индексу (точные термины:
+    названия формул, номера задач, фамилии). Списки объединяются reciprocal rank fusion.
+    """
+
+    vectorstore: VectorStore
+    lexical_index: LexicalIndex
+    k: int = RETRIEVER_K
+    fetch_k: int = HYBRID_FETCH_K
+    rrf_k: int = RRF_K
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    def _lexical_documents(self, query: str) -> List[Document]:
+        hits = self.lexical_index.search(query, self.fetch_k)
+        if not hits:
+            return []
+        ids = [chunk_id for chunk_id, _ in hits]
+        data = self.vectorstore.get(ids=ids, include=["documents", "metadatas"])
+        by_id = {
+            chunk_id: Document(page_content=text, metadata=metadata or {})
+            for chunk_id, text, metadata in zip(data["ids"], data["documents"], data["metadatas"])
+        }
+        return [by_id[chunk_id] for chunk_id in ids if chunk_id in by_id]
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun,
+                                **kwargs: Any) -> List[Document]:
+        k = kwargs.get("k", self.k)
+        fetch_k = max(self.fetch_k, k)
+        dense = self.vectorstore.similarity_search(query, k=fetch_k)
+        lexical = self._lexical_documents(query)
+        return reciprocal_rank_fusion([dense, lexical], self.rrf_k)[:k]
+
+
+def build_retriever(vectorstore: VectorStore, persist_directory: str, k: int = RETRIEVER_K,
+                    mode: Optional[str] = None, rerank: Optional[bool] = None,
+                    mmr: Optional[bool] = None) -> BaseRetriever:
+    """
+    Ретривер для векторной базы документа: гибридный или только векторный (RETRIEVAL_MODE).
+    С rerank (по умолчанию RERANKER_ENABLED) кандидаты переранжируются кросс-энкодером
+    и дальше идут не больше RERANK_TOP_N лучших,
+    с mmr (по умолчанию MMR_ENABLED) из итоговых кандидатов убираются почти дубликаты.
+    Если у документа есть родительские разделы (parent-child), ищутся дочерние чанки,
+    а возвращаются их родители без повторов.
+    """
+    mode = mode or RETRIEVAL_MODE
+    rerank = RERANKER_ENABLED if rerank is None else rerank
+    mmr = MMR_ENABLED if mmr is None else mmr
+    if mode == "hybrid":
+        retriever = HybridRetriever(
+            vectorstore=vectorstore,
+            lexical_index=open_lexical_index(persist_directory, vectorstore),
+            k=k
+        )
+    else:
+        retriever = vectorstore.as_retriever(search_kwargs={"k": k})
+
+    if rerank:
+        from src.tools.reranker import RerankingRetriever, get_reranker
+        retriever = RerankingRetriever(base_retriever=retriever, reranker=get_reranker(), fetch_k=RERANK_FETCH_K)
+    if mmr:
+        from src.tools.mmr import MMRRetriever
+        retriever = MMRRetriever(base_retriever=retriever, vectorstore=vectorstore, k=k)
+    if ParentStore.exists(persist_directory):
+        retriever = ParentRetriever(base_retriever=retriever, parent_store=ParentStore(persist_directory), k=k)
+    return retriever
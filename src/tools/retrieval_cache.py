@@ -0,0 +1,117 @@
+import time
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Hashable, List, Optional, Tuple
+from pydantic import ConfigDict
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from src.config import RETRIEVER_K, RETRIEVAL_CACHE_SIZE, RETRIEVAL_CACHE_TTL_SECONDS
+from src.tools.embeddings import normalize_query
+
+
+def retrieval_cache_key(user_id: int, index_version: str, query: str, k: int,
+                        options: Tuple[Hashable, ...] = ()) -> Tuple[Hashable, ...]:
+    """
+    Ключ результата поиска. Версия индекса — ключ документа (sha256 PDF): после
+    переиндексации у пользователя другая база, и старые записи перестают совпадать.
+    Вопросительный знак и точка в конце не меняют поиск, поэтому отбрасываются.
+    options — прочие параметры поиска (например, lambda_mult для MMR).
+    """
+    return user_id, index_version, normalize_query(query).rstrip("?!. "), k, options
+
+
+def _copy_documents(docs: List[Document]) -> List[Document]:
+    # Цепочки могут дописывать метаданные в документы — кэш отдаёт копии
+    return [Document(page_content=doc.page_content, metadata=dict(doc.metadata), id=doc.id) for doc in docs]
+
+
+class RetrievalCache:
+    """
+    LRU-кэш результатов поиска (списков чанков), общий для всех пользователей.
+    Повторные и почти одинаковые вопросы (регистр, пробелы, знак вопроса)
+    не вызывают ни эмбеддинг, ни поиск, ни переранжирование.
+    """
+
+    def __init__(self, max_size: int = RETRIEVAL_CACHE_SIZE, ttl_seconds: Optional[float] = RETRIEVAL_CACHE_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._cache: "OrderedDict[tuple, Tuple[float, List[Document]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+
+    def get(self, key: tuple) -> Optional[List[Document]]:
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None and self.ttl_seconds and time.monotonic() - entry[0] > self.ttl_seconds:
+                del self._cache[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._cache.move_to_end(key)
+            self.hits += 1
+        return _copy_documents(entry[1])
+
+    def put(self, key: tuple, docs: List[Document]):
+        with self._lock:
+            self._cache[key] = (time.monotonic(), _copy_documents(docs))
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+
+    def invalidate_user(self, user_id: int) -> int:
+        """Удаляет все результаты пользователя (вызывается после переиндексации его PDF)."""
+        with self._lock:
+            stale = [key for key in self._cache if key[0] == user_id]
+            for key in stale:
+                del self._cache[key]
+            self.invalidated += len(stale)
+        return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def get_stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._cache),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "invalidated": self.invalidated,
+        }
+
+
+@lru_cache(maxsize=1)
+def get_retrieval_cache() -> RetrievalCache:
+    """Один кэш результатов поиска на процесс."""
+    return RetrievalCache()
+
+
+class CachedRetriever(BaseRetriever):
+    """Отдаёт результат базового ретривера из кэша по (пользователь, версия индекса, запрос, k)."""
+
+    base_retriever: BaseRetriever
+    cache: RetrievalCache
+    user_id: int
+    index_version: str
+    k: int = RETRIEVER_K
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun,
+                                **kwargs: Any) -> List[Document]:
+        k = kwargs.pop("k", self.k)
+        options = tuple(sorted(kwargs.items()))
+        key = retrieval_cache_key(self.user_id, self.index_version, query, k, options)
+        docs = self.cache.get(key)
+        if docs is None:
+            docs = self.base_retriever.invoke(query, k=k, config={"callbacks": run_manager.get_child()}, **kwargs)
+            self.cache.put(key, docs)
+        return docs
@@ -0,0 +1,19 @@
+from typing import List
+from src.tools.embeddings import get_sentence_transformer
+
+
+def encode_tokens(text: str) -> List[int]:
+    """Id токенов текста (токенизатор общей модели эмбеддингов, без служебных токенов)."""
+    if not text:
+        return []
+    tokenizer = get_sentence_transformer().tokenizer
+    return tokenizer(text, add_special_tokens=False, verbose=False)["input_ids"]
+
+
+def count_tokens(text: str) -> int:
+    """
+    Приблизительное число токенов текста в промпте.
+    Считается токенизатором общей модели эмбеддингов: он тоже обучен на русском,
+    поэтому для оценки длины промпта GigaChat его достаточно (без обращения к API).
+    """
+    return len(encode_tokens(text))
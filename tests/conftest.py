@@ -0,0 +1,8 @@
+import os
+import sys
+
+# src.config проверяет обязательные переменные окружения при импорте; тестам ключи API не нужны
+for name in ("GIGACHAT_AUTH_KEY", "GIGACHAT_CLIENT_SECRET", "TELEGRAM_BOT_TOKEN"):
+    os.environ.setdefault(name, "test")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
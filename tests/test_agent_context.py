@@ -0,0 +1,48 @@
+from typing import List
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from src.config import PARENT_CHUNK_SIZE
+from src.tools.rag_query import RAGLoader
+
+SENTENCES = [
+    "Закон Ома связывает силу тока, напряжение и сопротивление участка цепи.",
+    "Сила тока прямо пропорциональна напряжению и обратно пропорциональна сопротивлению.",
+    "При последовательном соединении проводников их сопротивления складываются.",
+    "При параллельном соединении складываются величины, обратные сопротивлениям.",
+    "Работа тока равна произведению напряжения, силы тока и времени.",
+]
+
+
+def _section(n: int) -> str:
+    """Родительский раздел почти предельной длины из целых предложений."""
+    text = f"Раздел {n}."
+    i = 0
+    while len(text) + len(SENTENCES[i % len(SENTENCES)]) + 1 <= PARENT_CHUNK_SIZE:
+        text += " " + SENTENCES[i % len(SENTENCES)]
+        i += 1
+    return text
+
+
+class _SectionsRetriever(BaseRetriever):
+    sections: List[str]
+
+    def _get_relevant_documents(self, query, *, run_manager, **kwargs) -> List[Document]:
+        return [Document(page_content=text) for text in self.sections[:kwargs.get("k", len(self.sections))]]
+
+
+def _loader_with(retriever) -> RAGLoader:
+    # Без базы на диске: ретривер уже собран, _build его не трогает
+    loader = RAGLoader.__new__(RAGLoader)
+    loader._retriever = retriever
+    return loader
+
+
+def test_agents_receive_several_parent_sections():
+    sections = [_section(n) for n in range(4)]
+    loader = _loader_with(_SectionsRetriever(sections=sections))
+
+    # Целиком вошло больше одного найденного раздела, а не один и обрывок следующего
+    assert loader.get_packed_context("закон Ома")["chunks_used"] > 1
+
+    context = loader.get_retrieved_context("закон Ома")
+    assert "Раздел 0." in context and "Раздел 1." in context
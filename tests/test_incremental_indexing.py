@@ -0,0 +1,58 @@
+import pytest
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+import src.tools.chroma_store as chroma_store
+import src.tools.pdf_indexer as pdf_indexer
+
+OHM = "Закон Ома: сила тока на участке цепи прямо пропорциональна напряжению и обратно пропорциональна сопротивлению."
+NEWTON = "Второй закон Ньютона: ускорение тела пропорционально равнодействующей силе и обратно пропорционально массе."
+PREFACE = "Предисловие ко второму изданию: добавлены задачи с решениями и исправлены опечатки."
+
+
+def _fake_pages(versions):
+    """Подменяет чтение PDF: путь файла -> тексты страниц."""
+    def iter_pages(pdf_path, workers=None):
+        texts = versions[pdf_path]
+        for page_number, text in enumerate(texts):
+            yield Document(page_content=text, metadata={
+                "source": pdf_path, "total_pages": len(texts), "page": page_number, "page_label": str(page_number + 1),
+            })
+    return iter_pages
+
+
+@pytest.fixture
+def indexer(tmp_path, monkeypatch, request):
+    embeddings = DeterministicFakeEmbedding(size=32)
+    monkeypatch.setattr(pdf_indexer, "_get_embeddings", lambda: embeddings)
+    monkeypatch.setattr(pdf_indexer, "VECTOR_STORE_BACKEND", request.param)
+    monkeypatch.setattr(pdf_indexer, "VECTOR_QUANTIZATION", None)
+    monkeypatch.setattr(chroma_store, "CHROMA_SHARED_PATH", str(tmp_path / "chroma"))
+    chroma_store.get_chroma_client.cache_clear()
+    monkeypatch.setattr(pdf_indexer, "iter_pdf_pages", _fake_pages({
+        "v1.pdf": [OHM, NEWTON],
+        "v2.pdf": [PREFACE, OHM, NEWTON],  # Новая первая страница перед неизменным текстом
+    }))
+    yield embeddings, str(tmp_path / "document")
+    chroma_store.get_chroma_client.cache_clear()
+
+
+def _metadata_by_text(persist_dir, embeddings):
+    data = pdf_indexer.open_vectorstore(persist_dir, embeddings).get(include=["documents", "metadatas"])
+    return dict(zip(data["documents"], data["metadatas"]))
+
+
+@pytest.mark.parametrize("indexer", ["numpy", "chroma"], indirect=True)
+def test_reused_chunks_get_metadata_of_new_version(indexer):
+    embeddings, persist_dir = indexer
+    assert pdf_indexer._build_collection("v1.pdf", persist_dir, "digest-v1")
+    before = _metadata_by_text(persist_dir, embeddings)
+    assert before[OHM]["page"] == 0 and before[NEWTON]["page"] == 1
+
+    # Повторная загрузка в ту же базу: эмбеддинги прежних чанков переиспользуются
+    assert pdf_indexer._build_collection("v2.pdf", persist_dir, "digest-v2")
+    after = _metadata_by_text(persist_dir, embeddings)
+
+    assert set(after) == {PREFACE, OHM, NEWTON}
+    assert after[OHM]["page"] == 1 and after[NEWTON]["page"] == 2
+    assert all(metadata["source"] == "digest-v2" for metadata in after.values())
+    assert all(metadata["total_pages"] == 3 for metadata in after.values())
@@ -0,0 +1,52 @@
+import numpy as np
+from langchain_core.documents import Document
+from src.config import MMR_LAMBDA
+from src.tools.mmr import maximal_marginal_relevance, upstream_relevance
+from src.tools.retrieval import reciprocal_rank_fusion
+
+# Кандидаты 0-2 — почти один и тот же текст (перекрытие чанков), 3 и 4 — другие темы
+VECTORS = np.array([
+    [1.0, 0.0, 0.0],
+    [1.0, 0.02, 0.0],
+    [1.0, 0.0, 0.02],
+    [0.0, 1.0, 0.0],
+    [0.0, 0.0, 1.0],
+])
+
+
+def _docs(n: int, **metadata_lists):
+    return [Document(page_content=f"chunk {i}", metadata={key: values[i] for key, values in metadata_lists.items()})
+            for i in range(n)]
+
+
+def test_rank_fallback_promotes_lower_ranked_diverse_candidate():
+    relevance = upstream_relevance(_docs(len(VECTORS)))
+    order = maximal_marginal_relevance(relevance, VECTORS, k=2, lambda_mult=MMR_LAMBDA)
+    # Второе место у почти дубликата, но MMR поднимает кандидата с 4-го места
+    assert order == [0, 3]
+
+
+def test_rank_fallback_decays_linearly():
+    relevance = upstream_relevance(_docs(4))
+    np.testing.assert_allclose(relevance, [1.0, 0.75, 0.5, 0.25])
+
+
+def test_rrf_scores_are_used_when_present():
+    dense = [Document(page_content=text) for text in ("a", "b", "c")]
+    lexical = [Document(page_content=text) for text in ("b", "c")]
+    fused = reciprocal_rank_fusion([dense, lexical])
+    assert [doc.page_content for doc in fused] == ["b", "c", "a"]
+
+    relevance = upstream_relevance(fused)
+    assert relevance[0] == 1.0 and relevance[-1] == 0.0
+    assert 0.0 < relevance[1] < 1.0
+
+
+def test_rerank_score_takes_precedence():
+    docs = _docs(3, rerank_score=[2.0, 6.0, 4.0], rrf_score=[0.3, 0.2, 0.1])
+    np.testing.assert_allclose(upstream_relevance(docs), [0.0, 1.0, 0.5])
+
+
+def test_lambda_one_keeps_upstream_order():
+    relevance = upstream_relevance(_docs(len(VECTORS)))
+    assert maximal_marginal_relevance(relevance, VECTORS, k=3, lambda_mult=1.0) == [0, 1, 2]